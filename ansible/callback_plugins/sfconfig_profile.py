@@ -0,0 +1,89 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Record the wall time of each play and role for sfconfig --profile
+#
+# The task durations are measured per host, from the runner start to its
+# result, so that they are right for the plays using the free strategy. The
+# time of a role in a play is the time its slowest host spent in it.
+
+import json
+import os
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'sfconfig_profile'
+    CALLBACK_NEEDS_WHITELIST = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.output = os.environ.get("SFCONFIG_PROFILE_FILE")
+        self.records = []
+        self.play = None
+        self.action = ""
+        # The running tasks start time, by host and task
+        self.started = {}
+        # The time spent in each role of the play, by host
+        self.roles = {}
+
+    def _close_play(self):
+        for name, hosts in sorted(self.roles.items()):
+            self.records.append({'category': 'role', 'name': name,
+                                 'duration': max(hosts.values())})
+        self.roles = {}
+        self.started = {}
+        if self.play:
+            name, begin = self.play
+            self.records.append({'category': 'play', 'name': name,
+                                 'duration': time.monotonic() - begin})
+            self.play = None
+
+    def v2_playbook_on_play_start(self, play):
+        self._close_play()
+        self.action = play.vars.get('role_action', '')
+        self.play = ("%s %s" % (play.get_name(), self.action),
+                     time.monotonic())
+
+    def v2_runner_on_start(self, host, task):
+        self.started[(host.get_name(), task._uuid)] = time.monotonic()
+
+    def _runner_done(self, result):
+        host, task = result._host.get_name(), result._task
+        begin = self.started.pop((host, task._uuid), None)
+        if begin is None:
+            return
+        role = task._role.get_name() if task._role else "(tasks)"
+        hosts = self.roles.setdefault("%s %s" % (role, self.action), {})
+        hosts[host] = hosts.get(host, 0) + time.monotonic() - begin
+
+    def v2_runner_on_ok(self, result):
+        self._runner_done(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._runner_done(result)
+
+    def v2_runner_on_skipped(self, result):
+        self._runner_done(result)
+
+    def v2_runner_on_unreachable(self, result):
+        self._runner_done(result)
+
+    def v2_playbook_on_stats(self, stats):
+        self._close_play()
+        if self.output:
+            with open(self.output, "w") as of:
+                json.dump(self.records, of)
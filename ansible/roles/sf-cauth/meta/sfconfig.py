@@ -13,8 +13,10 @@
 import os
 
 from sfconfig.components import Component
+from sfconfig.groupvars import vars_path
 from sfconfig.utils import execute
 from sfconfig.utils import fail
+from sfconfig.utils import write_file
 from sfconfig.utils import yaml_dump
 from sfconfig.utils import yaml_load
 
@@ -57,7 +59,7 @@ class Cauth(Component):
 
         # Check if secret hash needs to be generated:
         update_secrets = False
-        previous_vars = yaml_load("%s/group_vars/all.yaml" % args.ansible_root)
+        previous_vars = yaml_load(vars_path(args))
         # TODO move this part to sf-base too
         if not args.secrets.get('cauth_admin_password_hash') or \
            previous_vars.get("authentication", {}).get("admin_password") != \
@@ -72,7 +74,7 @@ class Cauth(Component):
             args.secrets["sf_service_user_password_hash"] = self.hash_password(
                 args.secrets["sf_service_user_password"])
         if update_secrets and not args.skip_setup:
-            yaml_dump(args.secrets, open("%s/secrets.yaml" % args.lib, "w"))
+            write_file("%s/secrets.yaml" % args.lib, yaml_dump(args.secrets))
             args.glue.update(args.secrets)
 
     def validate(self, args, host):
@@ -15,5 +15,7 @@ from sfconfig.components import Component
 
 class DLRN(Component):
 
+    ssh_keys = ["dlrn_rsa"]
+
     def configure(self, args, host):
         self.get_or_generate_ssh_key(args, "dlrn_rsa")
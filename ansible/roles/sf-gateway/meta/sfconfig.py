@@ -15,13 +15,24 @@ import os
 
 from sfconfig.components import Component
 from sfconfig.utils import fail
+from sfconfig.utils import system_path
 
 
 def encode_image(path):
     return base64.b64encode(open(path, "rb").read()).decode()
 
 
+def logo_path(args, name):
+    path = system_path(args, "/etc/software-factory/%s" % name)
+    if args.generate_only and not os.path.isfile(path):
+        # Use the default logo when the target root doesn't provide one
+        path = "%s/defaults/%s" % (args.share, name)
+    return path
+
+
 class Gateway(Component):
+    ssh_keys = ["zuul_gatewayserver_rsa"]
+
     def usage(self, parser):
         parser.add_argument("--disable-ssl-redirection", action="store_true",
                             help="Do not redirect direct gateway access "
@@ -33,6 +44,11 @@ class Gateway(Component):
         else:
             args.glue["gateway_force_ssl_redirection"] = True
 
+    def certificates(self, args, host):
+        if args.sfconfig["network"]["tls_cert_file"]:
+            return []
+        return [("gateway", args.sfconfig["fqdn"])]
+
     def configure(self, args, host):
         if (
                 bool(args.sfconfig["network"]["tls_cert_file"]) !=
@@ -67,11 +83,11 @@ class Gateway(Component):
         else:
             self.get_or_generate_cert(args, "gateway", args.sfconfig["fqdn"])
         args.glue["gateway_topmenu_logo_data"] = encode_image(
-            "/etc/software-factory/logo-topmenu.png")
+            logo_path(args, "logo-topmenu.png"))
         args.glue["gateway_favicon_data"] = encode_image(
-            "/etc/software-factory/logo-favicon.ico")
+            logo_path(args, "logo-favicon.ico"))
         args.glue["gateway_splash_image_data"] = encode_image(
-            "/etc/software-factory/logo-splash.png")
+            logo_path(args, "logo-splash.png"))
         self.get_or_generate_ssh_key(args, "zuul_gatewayserver_rsa")
         args.glue["pagesuser_authorized_keys"] = []
         args.glue["pagesuser_authorized_keys"].append(
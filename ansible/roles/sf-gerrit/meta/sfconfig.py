@@ -14,6 +14,8 @@ from sfconfig.components import Component
 
 
 class Gerrit(Component):
+    ssh_keys = ["gerrit_service_rsa", "gerrit_admin_rsa"]
+
     def usage(self, parser):
         parser.add_argument("--provision-demo", action='store_true',
                             help="Provision demo projects")
@@ -14,6 +14,8 @@ from sfconfig.components import Component
 
 
 class Gerritbot(Component):
+    ssh_keys = ["zuul_rsa"]
+
     def configure(self, args, host):
         self.get_or_generate_ssh_key(args, "zuul_rsa")
         conn = args.sfconfig.get("gerritbot", {}).get("gerrit")
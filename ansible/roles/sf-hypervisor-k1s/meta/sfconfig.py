@@ -20,6 +20,9 @@ class HypervisorK1s(Component):
         if args.enable_insecure_workers:
             args.glue["enable_insecure_workers"] = True
 
+    def certificates(self, args, host):
+        return [("k1s", "localhost")]
+
     def configure(self, args, host):
         self.get_or_generate_cert(args, "k1s", "localhost")
 
@@ -14,5 +14,8 @@ from sfconfig.components import Component
 
 
 class Influxdb(Component):
+    def certificates(self, args, host):
+        return [("influxdb", host["hostname"])]
+
     def configure(self, args, host):
         self.get_or_generate_cert(args, "influxdb", host["hostname"])
@@ -21,10 +21,14 @@
 
 import argparse
 import datetime
+import os
 import yaml
 
 import pymysql
 
+from sfconfig.utils import SafeDumper
+from sfconfig.utils import SafeLoader
+
 
 HTML_DOM = """<!DOCTYPE html>
 <html>
@@ -109,8 +113,10 @@ class StatusPage:
     ]
 
     def connect(self):
-        secrets = yaml.safe_load(open(
-            "/var/lib/software-factory/ansible/group_vars/all.yaml"))
+        vars_path = "/var/lib/software-factory/ansible/sfconfig-vars.yaml"
+        if not os.path.isfile(vars_path):
+            vars_path = "/var/lib/software-factory/ansible/group_vars/all.yaml"
+        secrets = yaml.load(open(vars_path), Loader=SafeLoader)
         return pymysql.connect(
             host=secrets["zuul_mysql_host"],
             user=secrets["zuul_mysql_user"],
@@ -269,7 +275,7 @@ def main():
     if args.lib:
         try:
             with open(args.lib) as fileobj:
-                history = yaml.safe_load(fileobj)
+                history = yaml.load(fileobj, Loader=SafeLoader)
         except IOError:
             pass
 
@@ -285,8 +291,8 @@ def main():
 
     if args.lib:
         with open(args.lib, "w") as fileobj:
-            yaml.safe_dump(
-                history[:60], fileobj, default_flow_style=False)
+            yaml.dump(history[:60], fileobj, Dumper=SafeDumper,
+                      default_flow_style=False)
 
 
 if __name__ == "__main__":
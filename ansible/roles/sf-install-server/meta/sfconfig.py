@@ -20,18 +20,15 @@ from six.moves.urllib import parse
 
 from sfconfig.components import Component
 from sfconfig.utils import fail
+from sfconfig.utils import get_sf_version
+from sfconfig.utils import system_path
+from sfconfig.utils import write_file
 
 
-def get_sf_version():
+def get_previous_version(args):
     try:
-        return open("/etc/sf-release").read().strip()
-    except IOError:
-        return "master"
-
-
-def get_previous_version():
-    try:
-        ver = float(open("/var/lib/software-factory/.version").read().strip())
+        ver = float(open(system_path(
+            args, "/var/lib/software-factory/.version")).read().strip())
         if ver == '':
             raise IOError
     except Exception:
@@ -41,6 +38,8 @@ def get_previous_version():
 
 
 class InstallServer(Component):
+    ssh_keys = ["zuul_worker_rsa"]
+
     def validate(self, args, host):
         if bool(args.sfconfig['config-locations']['config-repo']) != \
            bool(args.sfconfig['config-locations']['jobs-repo']):
@@ -63,8 +62,8 @@ class InstallServer(Component):
         if args.glue["install_server_host"] == args.glue["gateway_host"]:
             args.glue["install_server_hostname"] = args.sfconfig["fqdn"]
 
-        args.glue["sf_version"] = get_sf_version()
-        args.glue["sf_previous_version"] = get_previous_version()
+        args.glue["sf_version"] = get_sf_version(args)
+        args.glue["sf_previous_version"] = get_previous_version(args)
         if args.upgrade:
             print("Going to upgrade from %s to %s" % (
                 args.glue["sf_previous_version"], args.glue["sf_version"]))
@@ -250,15 +249,18 @@ class InstallServer(Component):
     def resolve_config_key(self, args, url):
         """The goal of this method is to check and ensure we have the correct
         zuul public key for the config project to pre-generate secrets."""
-        key_path = "/var/lib/software-factory/bootstrap-data/certs/config.pub"
+        args.glue["config_key_path"] = \
+            "/var/lib/software-factory/bootstrap-data/certs/config.pub"
+        key_path = system_path(args, args.glue["config_key_path"])
         key_data = ""
-        args.glue["config_key_path"] = key_path
         args.glue["config_key_url"] = url
         args.glue["config_key_exists"] = False
         args.glue["config_key_changed"] = True
         if os.path.exists(key_path):
             key_data = open(key_path).read()
         try:
+            if args.generate_only:
+                raise urllib.error.URLError("generate-only mode is offline")
             req = request.urlopen(url)
             current_data = req.read().decode("utf-8")
             if "PUBLIC KEY" not in current_data:
@@ -267,8 +269,7 @@ class InstallServer(Component):
             args.glue["config_key_exists"] = True
             args.glue["config_key_changed"] = current_data != key_data
             if args.glue["config_key_changed"]:
-                with open(key_path, "w") as of:
-                    of.write(current_data)
+                write_file(key_path, current_data)
         except (
                 urllib.error.HTTPError,
                 urllib.error.URLError,
@@ -596,7 +597,7 @@ class InstallServer(Component):
             try:
                 req = request.urlopen(key_url)
                 zuul_key = req.read().decode("utf-8")
-                open(zuul_key_path, "w").write(zuul_key)
+                write_file(zuul_key_path, zuul_key)
             except Exception:
                 fail("Couldn't get zuul public key at %s" % key_url)
         args.glue["zuul_rsa_pub"] = zuul_key
@@ -640,8 +641,7 @@ class InstallServer(Component):
                   "add tenant config and restart sfconfig")
 
         # Fetch main install-server tenant-update secret to trigger zuul reload
-        secret_path = "/var/lib/software-factory/bootstrap-data/certs/" \
-                      "tenant-update-secret.yaml"
+        secret_path = "%s/certs/tenant-update-secret.yaml" % args.lib
         if args.glue["config_key_exists"]:
             if (
                     os.path.exists(secret_path) and
@@ -655,7 +655,7 @@ class InstallServer(Component):
                             args.glue["tenant_name"]))
                     secret_data = req.read().decode("utf-8")
                     if "pkcs" in secret_data:
-                        open(secret_path, "w").write(secret_data)
+                        write_file(secret_path, secret_data)
                         args.glue["tenant_update_secret"] = secret_data
                     else:
                         raise RuntimeError(
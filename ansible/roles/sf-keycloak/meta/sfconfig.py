@@ -11,6 +11,8 @@
 # under the License.
 
 from sfconfig.components import Component
+from sfconfig.groupvars import vars_path
+from sfconfig.utils import write_file
 from sfconfig.utils import yaml_dump
 from sfconfig.utils import yaml_load
 
@@ -28,7 +30,7 @@ class Keycloak(Component):
         # TODO duplicate from sf-cauth.
         # Check if secret hash needs to be generated:
         update_secrets = False
-        previous_vars = yaml_load("%s/group_vars/all.yaml" % args.ansible_root)
+        previous_vars = yaml_load(vars_path(args))
         if not args.secrets.get('cauth_admin_password_hash') or \
            previous_vars.get("authentication", {}).get("admin_password") != \
            args.sfconfig["authentication"]["admin_password"]:
@@ -42,5 +44,5 @@ class Keycloak(Component):
             args.secrets["sf_service_user_password_hash"] = self.hash_password(
                 args.secrets["sf_service_user_password"])
         if update_secrets and not args.skip_setup:
-            yaml_dump(args.secrets, open("%s/secrets.yaml" % args.lib, "w"))
+            write_file("%s/secrets.yaml" % args.lib, yaml_dump(args.secrets))
             args.glue.update(args.secrets)
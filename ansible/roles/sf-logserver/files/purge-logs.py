@@ -13,22 +13,95 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+#
+# The job dirs are recorded in an sqlite index with their creation time,
+# size and zuul metadata. Each run only reads the directories modified since
+# the previous run, then removes the expired job dirs found by an index
+# query. The index also gives the disk usage reports (--report).
+#
+# The expiry of a job dir is given by the first matching retention policy
+# of the --policy-file, e.g. [{"result": "FAILURE", "expiry": 90}], or by
+# --retention-days. When the disk usage is over --high-watermark, the job
+# dirs closest to their expiry are removed until it is under --low-watermark.
+# The --watermark-only runs only do that check, on the current index, so
+# that they can run frequently.
+#
+# The text logs of the job dirs older than --compress-after-days are then
+# gzipped in place, the logserver httpd serves foo.txt from foo.txt.gz.
 
 
 import argparse
+import fcntl
+import gzip
+import json
 import os
 from pathlib import Path
 import shutil
+import sqlite3
 import sys
 import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from datetime import datetime, timedelta
 
+import yaml
+
+# This script runs on the logserver, without sfconfig, so it picks
+# the libyaml loader itself
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+# The zuul-info/inventory.yaml zuul vars and the build result recorded in
+# the index
+METADATA = ('tenant', 'project', 'pipeline', 'job', 'result', 'build')
+# The retention policy match keys
+POLICY_KEYS = METADATA[:-1]
+# Job dirs younger than this may still be uploading, they are indexed later
+SETTLE_TIME = 3600
+# The compressed text logs, matching the logserver.conf gzip types
+COMPRESS_EXTENSIONS = ('.txt', '.log', '.json', '.yaml', '.yml', '.html',
+                       '.sh', '.conf', '.xml')
+COMPRESS_MIN_SIZE = 4096
+# The ara directories are served by the ara wsgi application
+COMPRESS_SKIP_DIRS = ('ara-report', 'ara-database')
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--dry-run', action='store_true')
 parser.add_argument('--retention-days', type=int, default=31)
 parser.add_argument('--log-path-dir', default='/var/www/logs')
 parser.add_argument('--debug', action='store_true')
+parser.add_argument('--workers', type=int, default=4,
+                    help='The number of scan and delete threads')
+parser.add_argument('--max-iops', type=float, default=0,
+                    help='The maximum directory reads and unlinks per '
+                         'second, 0 for unlimited')
+parser.add_argument('--max-runtime', type=int, default=0,
+                    help='Stop after this many seconds and resume from '
+                         'there on the next run, 0 for unlimited')
+parser.add_argument('--state-dir', default='/var/lib/purge-logs')
+parser.add_argument('--progress-interval', type=int, default=60)
+parser.add_argument('--reindex', action='store_true',
+                    help='Read every directory again')
+parser.add_argument('--report', choices=POLICY_KEYS,
+                    help='Print the indexed disk usage and exit')
+parser.add_argument('--policy-file',
+                    help='A json list of retention policies')
+parser.add_argument('--high-watermark', type=int, default=0,
+                    help='The disk usage percent triggering the removal of '
+                         'the oldest job dirs, 0 to disable')
+parser.add_argument('--low-watermark', type=int, default=80)
+parser.add_argument('--watermark-only', action='store_true',
+                    help='Only remove the job dirs over the high watermark, '
+                         'without reading the directories')
+parser.add_argument('--compress-after-days', type=int, default=0,
+                    help='Gzip the text logs of the job dirs older than '
+                         'this, 0 to disable')
+parser.add_argument('--compress-cpus', type=float, default=1,
+                    help='The CPU time budget of the compression, in CPUs')
+parser.add_argument('--compress-level', type=int, default=6)
 args = parser.parse_args()
 logging.basicConfig(
     format='%(asctime)s %(levelname)-5.5s %(message)s',
@@ -44,64 +117,595 @@ def check_dir_path(log_path):
     return p.resolve()
 
 
-def delete_dir(dir_path):
-    shutil.rmtree(dir_path)
+class RateLimiter:
+    """Space the I/O operations of every thread to a maximum rate"""
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next = time.monotonic()
 
+    def wait(self):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next, now)
+            self.next = start + 1 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class CpuBudget:
+    """Throttle the threads to a CPU time budget"""
+    def __init__(self, cpus):
+        self.cpus = cpus
+        self.started = time.monotonic()
+        self.started_cpu = time.process_time()
+
+    def wait(self):
+        if not self.cpus:
+            return
+        used = time.process_time() - self.started_cpu
+        ahead = used / self.cpus - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
 
-def get_jobdir(dirs, files):
-    dirs_name = set(map(lambda s: s.name, dirs))
 
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.reported = (self.started, 0)
+        self.scanned = 0
+        self.cached = 0
+        self.indexed = 0
+        self.removed = 0
+        self.freed = 0
+        self.compressed = 0
+        self.saved = 0
+        self.errors = 0
+
+    def add(self, **counters):
+        with self.lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def report(self, final=False):
+        now = time.monotonic()
+        last, last_scanned = self.reported
+        if final:
+            last, last_scanned = self.started, 0
+        self.reported = (now, self.scanned)
+        log.info("%d dirs scanned (%.1f/s, %d unchanged), %d job dirs "
+                 "indexed, %d job dirs removed, %.1f MB freed, %d files "
+                 "compressed, %.1f MB saved, %d errors%s",
+                 self.scanned, (self.scanned - last_scanned) / max(
+                     now - last, 0.001), self.cached, self.indexed,
+                 self.removed, self.freed / 1e6, self.compressed,
+                 self.saved / 1e6, self.errors,
+                 " in %.0f seconds" % (now - self.started) if final else "")
+
+
+def get_jobdir(dirs, files):
     def is_zuul():
-        return 'zuul-info' in dirs_name
+        return 'zuul-info' in dirs
 
     def is_jenkins():
-        return 'ara-database' in dirs_name
+        return 'ara-database' in dirs
 
     def is_jenkins_console():
         return 'consoleText.txt' in files
 
-    def is_empty_dir():
-        return not files and not dirs
+    return is_zuul() or is_jenkins() or is_jenkins_console()
 
-    return is_zuul() or is_jenkins() or is_jenkins_console() or is_empty_dir()
 
-
-# (dirs, files)
-# DirContent = typing.Tuple[typing.Set[Path], typing.Set[str]]
-
-
-def ls(dir_path):
+def ls(dir_path, limiter):
+    """Return the (dirs, files) names, using the scandir cached file type"""
     dirs = set()
     files = set()
-    for entry in os.listdir(dir_path):
-        entry_path = dir_path / entry
-        if entry_path.is_dir():
-            dirs.add(entry_path)
-        elif entry_path.exists():
-            files.add(entry)
+    limiter.wait()
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                dirs.add(entry.name)
+            else:
+                files.add(entry.name)
     return (dirs, files)
 
 
-def find_old_files(calculated_time, log_path):
-    queue = set((log_path, ))
-    while queue:
-        root = queue.pop()
-        current_dirs, current_files = ls(root)
-        if get_jobdir(current_dirs, current_files):
-            log.debug("%s : is a job dir", root)
-            dir_date = datetime.fromtimestamp(os.path.getctime(root))
-            if dir_date < calculated_time:
-                yield root
+def dir_size(dir_path, limiter):
+    """Return the disk usage of a tree"""
+    size = os.lstat(dir_path).st_blocks * 512
+    limiter.wait()
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                size += dir_size(entry.path, limiter)
+            else:
+                size += entry.stat(follow_symlinks=False).st_blocks * 512
+    return size
+
+
+def job_metadata(dir_path):
+    """Return the zuul vars of a job dir"""
+    metadata = dict((key, None) for key in METADATA)
+    inventory = os.path.join(dir_path, 'zuul-info', 'inventory.yaml')
+    opener = open
+    if not os.path.isfile(inventory):
+        inventory, opener = inventory + '.gz', gzip.open
+    if not os.path.isfile(inventory):
+        return metadata
+    try:
+        with opener(inventory, 'rt') as f:
+            zuul = yaml.load(f, Loader=SafeLoader)['all']['vars']['zuul']
+    except (IOError, EOFError, yaml.YAMLError, KeyError, TypeError) as e:
+        log.warning("%s : invalid inventory %s", dir_path, e)
+        return metadata
+    for key in METADATA:
+        value = zuul.get(key)
+        if isinstance(value, dict):
+            value = value.get('name')
+        metadata[key] = value
+    metadata['result'] = job_result(dir_path)
+    return metadata
+
+
+def job_result(dir_path):
+    """Return the build result from the job-output.json playbook stats"""
+    for name, opener in (('job-output.json', open),
+                         ('job-output.json.gz', gzip.open)):
+        path = os.path.join(dir_path, name)
+        if os.path.isfile(path):
+            break
+    else:
+        return None
+    try:
+        with opener(path, 'rt') as f:
+            playbooks = json.load(f)
+    except (IOError, EOFError, ValueError) as e:
+        log.warning("%s : invalid job output %s", dir_path, e)
+        return None
+    result = None
+    for playbook in playbooks:
+        failed = any(stats.get('failures') or stats.get('unreachable')
+                     for stats in playbook.get('stats', {}).values())
+        if failed:
+            return 'POST_FAILURE' if playbook.get('phase') == 'post' \
+                else 'FAILURE'
+        if playbook.get('phase') == 'run':
+            result = 'SUCCESS'
+    return result
+
+
+def scan(dir_path, limiter, indexed):
+    """Return the job dir to index, or the sub dirs to walk
+
+    The sub dirs of a directory that didn't change since it was indexed
+    are read from the index instead of the filesystem.
+    """
+    st = os.lstat(dir_path)
+    if indexed and indexed[0] == st.st_mtime:
+        return 'cached', st, indexed[1:]
+    current_dirs, current_files = ls(dir_path, limiter)
+    if get_jobdir(current_dirs, current_files):
+        if st.st_ctime > time.time() - SETTLE_TIME:
+            log.debug("%s : is a new job dir", dir_path)
+            return 'new', st, None
+        log.debug("%s : is a job dir", dir_path)
+        return 'job', st, (dir_size(dir_path, limiter),
+                           job_metadata(dir_path))
+    log.debug("%s : walking", dir_path)
+    return 'dir', st, (sorted(current_dirs), not current_files)
+
+
+def delete_dir(dir_path, limiter):
+    """Remove a tree bottom-up"""
+    limiter.wait()
+    with os.scandir(dir_path) as it:
+        entries = list(it)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            delete_dir(entry.path, limiter)
         else:
-            log.debug("%s : walking", root)
-            queue = queue.union(current_dirs)
+            limiter.wait()
+            os.unlink(entry.path)
+    os.rmdir(dir_path)
 
 
-def search_and_destroy(calculated_time, dry_run, log_path):
-    for job_dir in find_old_files(calculated_time, log_path):
+def compress_file(path, st):
+    """Replace a file with its gzipped copy, return the saved bytes"""
+    compressed = path + '.gz'
+    if os.path.lexists(compressed):
+        return 0
+    with open(path, 'rb') as src, open(compressed + '.tmp', 'wb') as raw:
+        with gzip.GzipFile(os.path.basename(path), 'wb',
+                           args.compress_level, raw, st.st_mtime) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    saved = (st.st_blocks - os.lstat(compressed + '.tmp').st_blocks) * 512
+    if saved <= 0:
+        os.unlink(compressed + '.tmp')
+        return 0
+    os.chown(compressed + '.tmp', st.st_uid, st.st_gid)
+    os.chmod(compressed + '.tmp', st.st_mode & 0o7777)
+    os.utime(compressed + '.tmp', ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.rename(compressed + '.tmp', compressed)
+    os.unlink(path)
+    return saved
+
+
+def compress_dir(dir_path, limiter, budget):
+    """Compress the text logs of a tree, return the files and saved bytes"""
+    files = saved = 0
+    limiter.wait()
+    with os.scandir(dir_path) as it:
+        entries = list(it)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if entry.name not in COMPRESS_SKIP_DIRS:
+                sub_files, sub_saved = compress_dir(
+                    entry.path, limiter, budget)
+                files, saved = files + sub_files, saved + sub_saved
+            continue
+        if not entry.is_file(follow_symlinks=False) or \
+           not entry.name.endswith(COMPRESS_EXTENSIONS):
+            continue
+        st = entry.stat(follow_symlinks=False)
+        if st.st_size < COMPRESS_MIN_SIZE:
+            continue
+        budget.wait()
+        limiter.wait()
+        file_saved = compress_file(entry.path, st)
+        if file_saved:
+            files, saved = files + 1, saved + file_saved
+    return files, saved
+
+
+def open_index(state_dir):
+    if not os.path.isdir(state_dir):
+        os.makedirs(state_dir, 0o700)
+    db = sqlite3.connect(os.path.join(state_dir, 'index.sqlite'))
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('CREATE TABLE IF NOT EXISTS dirs ('
+               'path TEXT PRIMARY KEY, mtime REAL, children TEXT, '
+               'empty INTEGER)')
+    db.execute('CREATE TABLE IF NOT EXISTS jobs ('
+               'path TEXT PRIMARY KEY, ctime REAL, size INTEGER)')
+    columns = [row[1] for row in db.execute('PRAGMA table_info(jobs)')]
+    for key, kind in [(key, 'TEXT') for key in METADATA] + [
+            ('compressed', 'INTEGER DEFAULT 0')]:
+        if key not in columns:
+            db.execute('ALTER TABLE jobs ADD COLUMN %s %s' % (key, kind))
+    db.execute('CREATE INDEX IF NOT EXISTS jobs_ctime ON jobs (ctime)')
+    return db
+
+
+def forget(db, path):
+    """Remove a tree from the index"""
+    # The paths under path/ sort between path/ and path0 ('0' follows '/'),
+    # a range that the primary key index can search
+    for table in ('dirs', 'jobs'):
+        db.execute('DELETE FROM %s WHERE path = ? OR '
+                   '(path >= ? AND path < ?)' % table,
+                   (path, path + '/', path + '0'))
+
+
+def state_path(state_dir):
+    return os.path.join(state_dir, 'purge-state.json')
+
+
+def load_state(state_dir, log_path):
+    """Return the dirs left by a run stopped by --max-runtime"""
+    try:
+        state = json.load(open(state_path(state_dir)))
+    except (IOError, ValueError):
+        return None
+    if state.get('root') != str(log_path):
+        return None
+    log.info("Resuming the scan stopped at %s with %d dirs left",
+             state['date'], len(state['queue']))
+    return state['queue']
+
+
+def save_state(state_dir, log_path, queue):
+    path = state_path(state_dir)
+    if not queue:
+        if os.path.exists(path):
+            os.unlink(path)
+        return
+    with open(path + '.tmp', 'w') as of:
+        json.dump({'root': str(log_path), 'queue': queue,
+                   'date': datetime.now().isoformat()}, of)
+    os.rename(path + '.tmp', path)
+
+
+def expired(deadline):
+    return deadline is not None and time.monotonic() > deadline
+
+
+def update_index(db, log_path, limiter, stats, deadline):
+    """Index the new job dirs, return the dirs left to scan"""
+    queue = load_state(args.state_dir, log_path) or [str(log_path)]
+    scans = {}
+    # Bound the in-flight work to keep the traversal memory flat
+    max_inflight = args.workers * 4
+
+    def indexed(dir_path):
+        if args.reindex:
+            return None
+        row = db.execute(
+            'SELECT mtime, children, empty FROM dirs WHERE path = ?',
+            (dir_path,)).fetchone()
+        return row and (row[0], json.loads(row[1]), bool(row[2]))
+
+    def is_job(dir_path):
+        return db.execute('SELECT 1 FROM jobs WHERE path = ?',
+                          (dir_path,)).fetchone() is not None
+
+    with ThreadPoolExecutor(args.workers) as scanner:
+        while scans or (queue and not expired(deadline)):
+            while queue and len(scans) < max_inflight and \
+                    not expired(deadline):
+                dir_path = queue.pop()
+                scans[scanner.submit(
+                    scan, dir_path, limiter, indexed(dir_path))] = dir_path
+            done, _ = wait(scans, timeout=args.progress_interval,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                dir_path = scans.pop(future)
+                if future.exception():
+                    if isinstance(future.exception(), FileNotFoundError):
+                        forget(db, dir_path)
+                        continue
+                    log.warning("%s : %s", dir_path, future.exception())
+                    stats.add(errors=1)
+                    continue
+                stats.add(scanned=1)
+                kind, st, result = future.result()
+                if kind == 'cached':
+                    stats.add(cached=1)
+                elif kind == 'job':
+                    forget(db, dir_path)
+                    size, metadata = result
+                    db.execute(
+                        'INSERT INTO jobs (path, ctime, size, %s) '
+                        'VALUES (?, ?, ?, %s)' % (
+                            ', '.join(METADATA),
+                            ', '.join('?' * len(METADATA))),
+                        [dir_path, st.st_ctime, size] +
+                        [metadata[key] for key in METADATA])
+                    stats.add(indexed=1)
+                elif kind == 'dir':
+                    previous = indexed(dir_path)
+                    for name in set(previous[1] if previous else []) - \
+                            set(result[0]):
+                        forget(db, os.path.join(dir_path, name))
+                    db.execute(
+                        'INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)',
+                        (dir_path, st.st_mtime, json.dumps(result[0]),
+                         not result[0] and result[1]))
+                if kind in ('cached', 'dir'):
+                    for name in result[0]:
+                        sub_dir = os.path.join(dir_path, name)
+                        if args.reindex or not is_job(sub_dir):
+                            queue.append(sub_dir)
+            if time.monotonic() - stats.reported[0] >= \
+                    args.progress_interval:
+                db.commit()
+                stats.report()
+    db.commit()
+    return queue
+
+
+def load_policies(policy_file):
+    if not policy_file:
+        return []
+    policies = json.load(open(policy_file))
+    for policy in policies:
+        if not isinstance(policy.get('expiry'), int) or \
+           set(policy) - set(POLICY_KEYS + ('expiry',)):
+            print("Invalid retention policy %s" % policy)
+            sys.exit(1)
+    return policies
+
+
+def expiry_sql(policies, retention_days):
+    """Return the SQL expression of a job dir expiry time and its params"""
+    cases = []
+    params = []
+    for policy in policies:
+        conditions = []
+        for key in POLICY_KEYS:
+            if policy.get(key) is not None:
+                conditions.append('%s GLOB ?' % key)
+                params.append(str(policy[key]))
+        cases.append('WHEN %s THEN ?' % (' AND '.join(conditions) or '1'))
+        params.append(policy['expiry'] * 86400)
+    if not cases:
+        return 'ctime + ?', [retention_days * 86400]
+    return 'ctime + CASE %s ELSE ? END' % ' '.join(cases), params + [
+        retention_days * 86400]
+
+
+def run_tasks(db, func, items, collect, stats, deadline):
+    """Run func on the items in the thread pool until the deadline"""
+    tasks = {}
+    max_inflight = args.workers * 4
+
+    def collect_tasks(done):
+        for future in done:
+            item = tasks.pop(future)
+            if future.cancelled():
+                continue
+            if future.exception() and \
+                    not isinstance(future.exception(), FileNotFoundError):
+                log.warning("%s : %s", item[0], future.exception())
+                stats.add(errors=1)
+                continue
+            collect(item, future)
+
+    with ThreadPoolExecutor(args.workers) as pool:
+        for item in items:
+            if expired(deadline):
+                break
+            tasks[pool.submit(func, item[0])] = item
+            if len(tasks) >= max_inflight:
+                collect_tasks(wait(tasks, return_when=FIRST_COMPLETED).done)
+            if time.monotonic() - stats.reported[0] >= \
+                    args.progress_interval:
+                db.commit()
+                stats.report()
+        collect_tasks(wait(tasks).done)
+    db.commit()
+
+
+def remove_dirs(db, dirs, dry_run, limiter, stats, deadline):
+    """Remove the job dirs and their index entries"""
+    if dry_run:
+        stats.add(removed=len(dirs), freed=sum(size for _, size in dirs))
+        return
+
+    def remove(job_dir):
         log.debug("%s : removing old logs", job_dir)
-        if not dry_run and log_path != job_dir:
-            delete_dir(job_dir)
+        delete_dir(job_dir, limiter)
+
+    def collect(item, future):
+        forget(db, item[0])
+        stats.add(removed=1, freed=item[1])
+
+    run_tasks(db, remove, dirs, collect, stats, deadline)
+
+
+def remove_expired(db, log_path, policies, cutoff, dry_run, limiter, stats,
+                   deadline):
+    """Remove the expired job dirs and the empty dirs found in the index"""
+    now = time.time()
+    expiry, params = expiry_sql(policies, args.retention_days)
+    # Only the job dirs older than the shortest expiry may be expired, this
+    # bound uses the ctime index
+    shortest = min([args.retention_days] + [
+        policy['expiry'] for policy in policies])
+    expired_dirs = db.execute(
+        'SELECT path, size FROM (SELECT path, size, %s AS expiry FROM jobs '
+        'WHERE ctime < ?) WHERE expiry < ? ORDER BY expiry' % expiry,
+        params + [now - shortest * 86400, now]).fetchall()
+    expired_dirs.extend(
+        (path, 0) for (path,) in db.execute(
+            'SELECT path FROM dirs WHERE empty AND mtime < ? AND path != ?',
+            (cutoff, str(log_path))))
+    if expired_dirs:
+        log.info("Removing %d expired job dirs", len(expired_dirs))
+        remove_dirs(db, expired_dirs, dry_run, limiter, stats, deadline)
+
+
+def disk_usage(log_path):
+    st = os.statvfs(log_path)
+    return (st.f_blocks - st.f_bfree) * st.f_frsize, st.f_blocks * st.f_frsize
+
+
+def remove_over_watermark(db, log_path, policies, dry_run, limiter, stats):
+    """Remove the job dirs closest to their expiry until the disk usage is
+    under the low watermark
+
+    A full disk is worse than an overrun, so --max-runtime doesn't apply.
+    """
+    used, total = disk_usage(log_path)
+    if not args.high_watermark or used * 100 < total * args.high_watermark:
+        return
+    needed = used - total * args.low_watermark / 100
+    log.info("Disk usage %.1f%% is over the high watermark, removing "
+             "%.1f MB", used * 100 / total, needed / 1e6)
+    expiry, params = expiry_sql(policies, args.retention_days)
+    selected = []
+    freed = 0
+    # The sizes are the indexed ones, the tree is not walked again
+    for job_dir, size in db.execute(
+            'SELECT path, size FROM (SELECT path, size, %s AS expiry FROM '
+            'jobs) WHERE expiry >= ? ORDER BY expiry' % expiry,
+            params + [time.time()]):
+        if freed >= needed:
+            break
+        selected.append((job_dir, size))
+        freed += size
+    log.info("Removing %d job dirs to free %.1f MB", len(selected),
+             freed / 1e6)
+    remove_dirs(db, selected, dry_run, limiter, stats, None)
+
+
+def compress_cold(db, dry_run, limiter, stats, deadline):
+    """Compress the text logs of the job dirs older than the compress delay"""
+    if not args.compress_after_days:
+        return
+    cold_dirs = db.execute(
+        'SELECT path FROM jobs WHERE NOT compressed AND ctime < ? '
+        'ORDER BY ctime', (time.time() - args.compress_after_days * 86400,)
+    ).fetchall()
+    if not cold_dirs:
+        return
+    log.info("Compressing the logs of %d job dirs", len(cold_dirs))
+    if dry_run:
+        return
+    budget = CpuBudget(args.compress_cpus)
+
+    def compress(job_dir):
+        log.debug("%s : compressing logs", job_dir)
+        return compress_dir(job_dir, limiter, budget)
+
+    def collect(item, future):
+        files, saved = future.result()
+        # Keep the indexed size up to date for the watermark
+        db.execute('UPDATE jobs SET compressed = 1, size = size - ? '
+                   'WHERE path = ?', (saved, item[0]))
+        stats.add(compressed=files, saved=saved)
+
+    run_tasks(db, compress, cold_dirs, collect, stats, deadline)
+
+
+def report(db, key):
+    print("%-60s %8s %12s" % (key, "builds", "size (MB)"))
+    total = [0, 0]
+    for name, count, size in db.execute(
+            'SELECT %s, count(*), sum(size) FROM jobs GROUP BY %s '
+            'ORDER BY sum(size) DESC' % (key, key)):
+        print("%-60s %8d %12.1f" % (name, count, size / 1e6))
+        total = [total[0] + count, total[1] + size]
+    print("%-60s %8d %12.1f" % ("total", total[0], total[1] / 1e6))
+
+
+def search_and_destroy(calculated_time, dry_run, log_path):
+    db = open_index(args.state_dir)
+    if args.report:
+        return report(db, args.report)
+    lock = open(os.path.join(args.state_dir, 'purge-logs.lock'), 'w')
+    try:
+        # The frequent watermark runs don't wait for the nightly run
+        fcntl.flock(lock, fcntl.LOCK_EX | (
+            fcntl.LOCK_NB if args.watermark_only else 0))
+    except BlockingIOError:
+        log.info("Another purge-logs run is in progress, skipping")
+        db.close()
+        return
+    limiter = RateLimiter(args.max_iops)
+    stats = Stats()
+    policies = load_policies(args.policy_file)
+    if args.watermark_only:
+        remove_over_watermark(db, log_path, policies, dry_run, limiter, stats)
+        stats.report(final=True)
+        db.close()
+        return
+    deadline = None
+    if args.max_runtime:
+        deadline = time.monotonic() + args.max_runtime
+    queue = update_index(db, log_path, limiter, stats, deadline)
+    remove_expired(db, log_path, policies, calculated_time.timestamp(),
+                   dry_run, limiter, stats, deadline)
+    remove_over_watermark(db, log_path, policies, dry_run, limiter, stats)
+    compress_cold(db, dry_run, limiter, stats, deadline)
+    stats.report(final=True)
+    if queue:
+        log.info("Max runtime reached, %d dirs left for the next run",
+                 len(queue))
+    save_state(args.state_dir, log_path, queue)
+    db.close()
 
 
 if __name__ == "__main__":
@@ -11,13 +11,23 @@
 # under the License.
 
 from sfconfig.components import Component
+from sfconfig.utils import fail
 
 
 class LogServer(Component):
+    ssh_keys = ["zuul_logserver_rsa"]
+
     def prepare(self, args):
         super(LogServer, self).prepare(args)
         args.glue["loguser_authorized_keys"] = []
 
+    def validate(self, args, host):
+        logs = args.conf.logs
+        if logs.disk_high_watermark and not \
+           0 < logs.disk_low_watermark < logs.disk_high_watermark <= 100:
+            fail("logs.disk_low_watermark must be lower than "
+                 "logs.disk_high_watermark")
+
     def configure(self, args, host):
         self.get_or_generate_ssh_key(args, "zuul_logserver_rsa")
         args.glue["logservers"].append({
@@ -32,7 +42,13 @@ class LogServer(Component):
                 "host": args.glue["logserver_host"],
                 "port": 22
             })
-        args.glue["logs_expiry"] = args.sfconfig["logs"]["expiry"]
+        args.glue["logs_expiry"] = args.conf.logs.expiry
+        args.glue["logs_retention_policies"] = \
+            args.conf.logs.retention_policies
+        args.glue["logs_disk_high_watermark"] = \
+            args.conf.logs.disk_high_watermark
+        args.glue["logs_disk_low_watermark"] = \
+            args.conf.logs.disk_low_watermark
         args.glue["loguser_authorized_keys"].append(
             args.glue["zuul_logserver_rsa_pub"])
         # When logserver is hosted on the gateway, we can use fqdn instead
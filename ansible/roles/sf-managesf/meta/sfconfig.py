@@ -14,6 +14,8 @@ from sfconfig.components import Component
 
 
 class Managesf(Component):
+    ssh_keys = ["managesf_rsa"]
+
     def configure(self, args, host):
         self.add_mysql_database(args, "managesf")
         self.get_or_generate_ssh_key(args, "managesf_rsa")
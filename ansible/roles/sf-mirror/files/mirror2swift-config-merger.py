@@ -18,6 +18,11 @@ import sys
 import os
 import yaml
 
+# This script runs on the mirror host, without sfconfig, so it picks
+# the libyaml loader and dumper itself
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
 if len(sys.argv) != 3 or not os.path.exists(sys.argv[1]):
     print("usage: %s mirrors-dir output-conf.yaml" % sys.argv[0])
     exit(1)
@@ -47,11 +52,11 @@ conf = {
 
 # Add mirrors definition
 for path in paths:
-    data = yaml.load(open(path))
+    data = yaml.load(open(path), Loader=SafeLoader)
     if not data:
         continue
     for mirror in data:
         conf["sfmirrors"]["mirrors"].append(mirror)
 
 if conf["sfmirrors"]["mirrors"]:
-    open(sys.argv[2], "w").write(yaml.safe_dump(conf, indent=4))
+    open(sys.argv[2], "w").write(yaml.dump(conf, Dumper=SafeDumper, indent=4))
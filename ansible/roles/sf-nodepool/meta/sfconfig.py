@@ -27,6 +27,7 @@ class NodepoolBuilder(Component):
 class NodepoolLauncher(Component):
     role = "nodepool-launcher"
     require_roles = ["zookeeper"]
+    ssh_keys = ["nodepool_rsa", "zuul_rsa"]
 
     def configure(self, args, host):
         args.glue["nodepool_hosts"].append(host["hostname"])
@@ -58,12 +59,11 @@ class NodepoolLauncher(Component):
 
         # nodepool_openshift_providers is only used to hold managed clusters
         args.glue["nodepool_openshift_providers"] = []
-        for host in args.sfarch['inventory']:
-            if 'hypervisor-openshift' in host['roles']:
-                args.glue["nodepool_openshift_providers"].append({
-                    "url": "https://%s:8443" % host['hostname'],
-                    "hostname": host['hostname'],
-                    "context": "local-%s" % host['hostname'].replace('.', '-'),
-                    "max_servers": host.get('max-servers', 10),
-                    "insecure_skip_tls_verify": True,
-                })
+        for host in args.arch_index.role_hosts('hypervisor-openshift'):
+            args.glue["nodepool_openshift_providers"].append({
+                "url": "https://%s:8443" % host['hostname'],
+                "hostname": host['hostname'],
+                "context": "local-%s" % host['hostname'].replace('.', '-'),
+                "max_servers": host.get('max-servers', 10),
+                "insecure_skip_tls_verify": True,
+            })
@@ -7,6 +7,8 @@ import sys
 import os
 import yaml
 
+from sfconfig.utils import SafeDumper
+from sfconfig.utils import SafeLoader
 
 try:
     resources_dir = sys.argv[1]
@@ -25,7 +27,7 @@ for path in paths:
     if not (path.endswith(".yaml") or path.endswith(".yml")):
         continue
     try:
-        data = yaml.safe_load(open(path))
+        data = yaml.load(open(path), Loader=SafeLoader)
     except Exception:
         continue
 
@@ -57,4 +59,5 @@ for path in paths:
                 except KeyError:
                     pass
         print("Updating %s" % path)
-        yaml.safe_dump(data, open(path, "w"), default_flow_style=False)
+        yaml.dump(data, open(path, "w"), Dumper=SafeDumper,
+                  default_flow_style=False)
@@ -15,15 +15,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import os
 import json
 import re
+import time
 
 from ansible.module_utils.six.moves import urllib
 from ansible.module_utils.basic import AnsibleModule, get_exception
 
 import gear
 
+# The gear.Client.submitJob default timeout of a job creation
+SUBMIT_JOB_TIMEOUT = 30
+
 
 class FileMatcher(object):
     def __init__(self, name, tags):
@@ -83,9 +88,15 @@ class File(object):
 
 
 class LogMatcher(object):
-    def __init__(self, server, port, config, success, log_url, host_vars):
-        self.client = gear.Client()
-        self.client.addServer(server, port)
+    def __init__(self, server, port, config, success, log_url, host_vars,
+                 connections=1):
+        # A gear client only opens one connection per server
+        self.clients = []
+        for idx in range(max(connections, 1)):
+            client = gear.Client('submit-log-processor-jobs-%d' % idx)
+            client.addServer(server, port)
+            self.clients.append(client)
+        self.client = self.clients[0]
         self.hosts = host_vars
         self.zuul = list(host_vars.values())[0]['zuul']
         self.success = success
@@ -93,6 +104,11 @@ class LogMatcher(object):
         self.matchers = []
         for f in config['files']:
             self.matchers.append(FileMatcher(f['name'], f.get('tags', [])))
+        # The fields are the same for every file of the build
+        self.base_fields = self.makeBaseFields()
+        self.stats = dict(submitted=0, skipped=0, unacknowledged=0,
+                          duration=0, wait_for_server=0, max_latency=0,
+                          avg_latency=0)
 
     def findFiles(self, path):
         results = set()
@@ -106,16 +122,114 @@ class LogMatcher(object):
                         break
         return results
 
-    def submitJobs(self, jobname, files):
-        self.client.waitForServer(90)
+    def submitJobs(self, jobname, files, batch_size=0, timeout=0):
+        """Submit the files, until the timeout when it is set
+
+        With a batch_size, up to batch_size submit requests are pipelined
+        on each connection instead of waiting for each job creation.
+        """
+        start = time.monotonic()
+        deadline = start + timeout if timeout else None
+        for client in self.clients:
+            client.waitForServer(90 if deadline is None else max(
+                min(90, deadline - time.monotonic()), 0))
+        self.stats['wait_for_server'] = time.monotonic() - start
+        outputs = [json.dumps(self.makeOutput(f)).encode('utf8')
+                   for f in files]
+        latencies = []
+        if batch_size:
+            ret = self.submitBatched(jobname, outputs, batch_size, deadline,
+                                     latencies)
+        else:
+            ret = []
+            for idx, output in enumerate(outputs):
+                if deadline is not None and time.monotonic() > deadline:
+                    break
+                job = gear.TextJob(jobname, output)
+                begin = time.monotonic()
+                self.clients[idx % len(self.clients)].submitJob(
+                    job, background=True)
+                latencies.append(time.monotonic() - begin)
+                ret.append(dict(handle=job.handle,
+                                arguments=output))
+        self.stats.update(
+            submitted=len(ret),
+            skipped=len(outputs) - len(ret) - self.stats['unacknowledged'],
+            duration=time.monotonic() - start,
+            max_latency=max(latencies or [0]),
+            avg_latency=sum(latencies) / max(len(latencies), 1))
+        return ret
+
+    def submitBatched(self, jobname, outputs, batch_size, deadline,
+                      latencies):
+        """Pipeline the SUBMIT_JOB_BG requests on each connection
+
+        This does what gear.Client.submitJob does without waiting for each
+        response: it uses the Connection.pending_tasks list and the
+        Client._lostConnection method, as found in gear 0.11 to 0.16.
+        """
         ret = []
-        for f in files:
-            output = self.makeOutput(f)
-            output = json.dumps(output).encode('utf8')
-            job = gear.TextJob(jobname, output)
-            self.client.submitJob(job, background=True)
+        inflight = collections.deque()
+        # The connections that timed out waiting for a job creation
+        lost = set()
+        unacknowledged = 0
+
+        def complete(task, job, output, sent, client, conn):
+            # Bound the wait as gear.Client.submitJob does, or stop waiting
+            # at the deadline
+            timeout = SUBMIT_JOB_TIMEOUT
+            if deadline is not None:
+                timeout = min(max(deadline - time.monotonic(), 0), timeout)
+            if not task.wait(timeout):
+                if timeout == SUBMIT_JOB_TIMEOUT:
+                    # The server didn't answer in time, drop the connection
+                    client._lostConnection(conn)
+                    lost.add(conn)
+                return False
+            if not job.handle:
+                # The server refused the job, retry with the other servers
+                self.client.submitJob(job, background=True)
+            latencies.append(time.monotonic() - sent)
             ret.append(dict(handle=job.handle,
                             arguments=output))
+            return True
+
+        for idx, output in enumerate(outputs):
+            if lost or (deadline is not None and time.monotonic() > deadline):
+                break
+            client = self.clients[idx % len(self.clients)]
+            job = gear.TextJob(jobname, output)
+            packet = gear.Packet(gear.constants.REQ,
+                                 gear.constants.SUBMIT_JOB_BG,
+                                 b'\x00'.join((job.binary_name, b'',
+                                               job.binary_arguments)))
+            # The JOB_CREATED responses arrive in order on a connection
+            conn = client.getConnection()
+            task = gear.SubmitJobTask(job)
+            conn.pending_tasks.append(task)
+            sent = time.monotonic()
+            try:
+                client.sendPacket(packet, conn)
+            except Exception:
+                # The connection is lost, forget its task and submit one at
+                # a time to the remaining connections
+                if task in conn.pending_tasks:
+                    conn.pending_tasks.remove(task)
+                client.submitJob(job, background=True)
+                ret.append(dict(handle=job.handle,
+                                arguments=output))
+                continue
+            inflight.append((task, job, output, sent, client, conn))
+            if len(inflight) >= batch_size * len(self.clients):
+                if not complete(*inflight.popleft()):
+                    unacknowledged += 1
+        while inflight:
+            entry = inflight.popleft()
+            if entry[-1] in lost or not complete(*entry):
+                unacknowledged += 1
+        # The jobs sent on a lost connection, or not acknowledged before the
+        # deadline, may have been created or not
+        self.stats['unacknowledged'] = unacknowledged
         return ret
 
     def makeOutput(self, file_object):
@@ -133,10 +247,15 @@ class LogMatcher(object):
         return out_event
 
     def makeFields(self, filename):
+        fields = dict(self.base_fields)
+        fields["filename"] = filename
+        fields["log_url"] = urllib.parse.urljoin(self.log_url, filename)
+        return fields
+
+    def makeBaseFields(self):
         hosts = [h for h in self.hosts.values() if 'nodepool' in h]
         zuul = self.zuul
         fields = {}
-        fields["filename"] = filename
         fields["build_name"] = zuul['job']
         fields["build_status"] = self.success and 'SUCCESS' or 'FAILURE'
         # TODO: this is too simplistic for zuul v3 multinode jobs
@@ -170,8 +289,6 @@ class LogMatcher(object):
             fields["node_provider"] = hosts[0]['nodepool']['provider']
         else:
             fields["node_provider"] = 'local'
-        log_url = urllib.parse.urljoin(self.log_url, filename)
-        fields["log_url"] = log_url
         fields["tenant"] = zuul["tenant"]
         if 'executor' in zuul and 'hostname' in zuul['executor']:
             fields["zuul_executor"] = zuul['executor']['hostname']
@@ -190,6 +307,9 @@ def main():
             success=dict(type='bool'),
             log_url=dict(type='str'),
             job=dict(type='str'),
+            connections=dict(type='int', default=1),
+            batch_size=dict(type='int', default=0),
+            submit_timeout=dict(type='int', default=0),
         ),
     )
 
@@ -201,12 +321,21 @@ def main():
                          p.get('config'),
                          p.get('success'),
                          p.get('log_url'),
-                         p.get('host_vars'))
+                         p.get('host_vars'),
+                         p.get('connections'))
         files = lmc.findFiles(p['path'])
         for f in files:
             results['files'].append(f.toDict())
-        for handle in lmc.submitJobs(p['job'], files):
+        for handle in lmc.submitJobs(p['job'], files, p.get('batch_size'),
+                                     p.get('submit_timeout')):
             results['jobs'].append(handle)
+        results['stats'] = lmc.stats
+        if lmc.stats['skipped']:
+            module.warn("%d files were not submitted before the timeout "
+                        "or a lost connection" % lmc.stats['skipped'])
+        if lmc.stats['unacknowledged']:
+            module.warn("%d files were submitted but their job creation "
+                        "was not acknowledged" % lmc.stats['unacknowledged'])
         module.exit_json(**results)
     except Exception:
         e = get_exception()
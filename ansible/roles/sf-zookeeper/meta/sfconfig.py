@@ -16,14 +16,9 @@ from pathlib import Path
 
 
 zk_ca_script = Path(__file__).resolve().parent / "zk-ca.sh"
-zk_tls_root_path = Path("/var/lib/software-factory/bootstrap-data/zk-ca")
-zk_ca_pem = zk_tls_root_path / "demoCA" / "cacert.pem"
-zk_tls_crt = zk_tls_root_path / "certs" / "client.pem"
-zk_tls_key = zk_tls_root_path / "keys" / "clientkey.pem"
-zk_ca_files = [zk_ca_pem, zk_tls_crt, zk_tls_key]
 
 
-def run_zk_ca_script(arg):
+def run_zk_ca_script(zk_tls_root_path, arg):
     execute([str(zk_ca_script), str(zk_tls_root_path), arg])
 
 
@@ -31,13 +26,18 @@ class Zookeeper(Component):  # type: ignore
     role = "zookeeper"
 
     def configure(self, args, host):
+        zk_tls_root_path = Path(args.lib) / "zk-ca"
+        zk_ca_pem = zk_tls_root_path / "demoCA" / "cacert.pem"
+        zk_tls_crt = zk_tls_root_path / "certs" / "client.pem"
+        zk_tls_key = zk_tls_root_path / "keys" / "clientkey.pem"
+        zk_ca_files = [zk_ca_pem, zk_tls_crt, zk_tls_key]
         zk_tls_root_path.mkdir(parents=True, exist_ok=True)
 
         def setup():
             # Client certs
             if not all(map(lambda x: x.exists(), zk_ca_files)):
                 print("Creating initial zk-ca")
-                run_zk_ca_script(host["hostname"])
+                run_zk_ca_script(zk_tls_root_path, host["hostname"])
             args.glue["zk_client_crt"] = zk_tls_crt.read_text()
             args.glue["zk_client_key"] = zk_tls_key.read_text()
             args.glue["zk_ca_pem"] = zk_ca_pem.read_text()
@@ -48,7 +48,7 @@ class Zookeeper(Component):  # type: ignore
             server_key = zk_tls_root_path / "keystores" / (
                 host["hostname"] + ".pem")
             if not server_key.exists():
-                run_zk_ca_script(host["hostname"])
+                run_zk_ca_script(zk_tls_root_path, host["hostname"])
             args.glue["zk_keys"][host["hostname"]] = server_key.read_text()
 
         try:
@@ -11,25 +11,26 @@
 # under the License.
 
 from sfconfig.components import Component
-from sfconfig.utils import get_default
 
 
 class ZuulScheduler(Component):
     role = "zuul-scheduler"
     require_role = ["nodepool", "zookeeper"]
+    ssh_keys = ["zuul_rsa", "zuul_worker_rsa"]
+
+    def certificates(self, args, host):
+        return [("gearman", host["hostname"])]
 
     def validate(self, args, _):
         # Check scheduler is defined before executor, web or merger
-        scheduler_found = False
-        for host in args.sfarch["inventory"]:
-            for role in host["roles"]:
-                if role == "zuul-scheduler":
-                    scheduler_found = True
-                if role in ("zuul-executor", "zuul-merger", "zuul-web") and \
-                   not scheduler_found:
-                    print("Zuul-scheduler needs to be defined before any other"
-                          " Zuul services")
-                    exit(1)
+        scheduler = args.arch_index.position("zuul-scheduler")
+        for role in ("zuul-executor", "zuul-merger", "zuul-web"):
+            position = args.arch_index.position(role)
+            if position is not None and (
+                    scheduler is None or position < scheduler):
+                print("Zuul-scheduler needs to be defined before any other"
+                      " Zuul services")
+                exit(1)
 
     def configure(self, args, host):
         args.glue["zuul_host"] = args.glue["zuul_scheduler_host"]
@@ -42,25 +43,21 @@ class ZuulScheduler(Component):
         args.glue["zuul_pub_url"] = "%s/zuul/" % args.glue["gateway_url"]
         args.glue["zuul_mysql_host"] = args.glue["mysql_host"]
 
-        args.glue["zuul_periodic_pipeline_mail_rcpt"] = args.sfconfig[
-            "zuul"]["periodic_pipeline_mail_rcpt"]
-        args.glue["zuul_github_gate_require_review"] = args.sfconfig[
-            "zuul"].get("github_gate_require_review", True)
+        zuul_config = args.conf.zuul
+        args.glue["zuul_periodic_pipeline_mail_rcpt"] = \
+            zuul_config.periodic_pipeline_mail_rcpt
+        args.glue["zuul_github_gate_require_review"] = \
+            zuul_config.github_gate_require_review is not False
 
         # Extra settings
-        zuul_config = args.sfconfig.get("zuul", {})
-        args.glue["zuul_default_retry_attempts"] = zuul_config[
-            "default_retry_attempts"]
-        args.glue["zuul_upstream_zuul_jobs"] = zuul_config[
-            "upstream_zuul_jobs"]
-        args.glue["zuul_success_log_url"] = get_default(
-            zuul_config, "success_log_url",
-            "%s/logs/{build.uuid}/" % args.glue["gateway_url"]
-        )
-        args.glue["zuul_failure_log_url"] = get_default(
-            zuul_config, "failure_log_url",
-            "%s/logs/{build.uuid}/" % args.glue["gateway_url"]
-        )
+        args.glue["zuul_default_retry_attempts"] = \
+            zuul_config.default_retry_attempts
+        args.glue["zuul_upstream_zuul_jobs"] = zuul_config.upstream_zuul_jobs
+        logs_url = "%s/logs/{build.uuid}/" % args.glue["gateway_url"]
+        args.glue["zuul_success_log_url"] = \
+            zuul_config.success_log_url or logs_url
+        args.glue["zuul_failure_log_url"] = \
+            zuul_config.failure_log_url or logs_url
 
         if "logserver" in args.glue["roles"]:
             args.glue["zuul_ssh_known_hosts"].append({
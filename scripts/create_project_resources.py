@@ -14,6 +14,8 @@
 import yaml
 import argparse
 
+from sfconfig.utils import SafeDumper
+
 DEFAULT_ACL = """
 [access "refs/*"]
   owner = group {repo}-core
@@ -74,7 +76,8 @@ def main():
                 'acl': '%s-acl' % name
             }
     with open(args.output, "w") as of:
-        yaml.safe_dump({'resources': resources}, of, default_flow_style=False)
+        yaml.dump({'resources': resources}, of, Dumper=SafeDumper,
+                  default_flow_style=False)
 
 
 if __name__ == "__main__":
@@ -29,7 +29,8 @@ LOCK_PATH=/var/lib/software-factory/state/ansible.lock
 case $ACTION in
     sf_configrepo_update)
         set -o pipefail
-        exec flock $LOCK_PATH ansible-playbook -v /var/lib/software-factory/ansible/sf_configrepo_update.yml 2>&1 | tee /var/log/software-factory/configrepo_update.log
+        # sf-configrepo-update takes the lock and coalesces the queued updates
+        exec sf-configrepo-update 2>&1 | tee /var/log/software-factory/configrepo_update.log
         ;;
     sf_tenant_update)
         set -o pipefail
@@ -14,6 +14,9 @@
 import os
 import yaml
 
+from sfconfig.utils import SafeDumper
+from sfconfig.utils import SafeLoader
+
 
 def loadConfig(config_path):
     """Load layout configuration whenever it is a single file or a directory.
@@ -41,7 +44,7 @@ def loadConfig(config_path):
 
     final_data = {}
     for path in paths:
-        data = yaml.safe_load(open(path))
+        data = yaml.load(open(path), Loader=SafeLoader)
         if not data:
             continue
         # Merge document
@@ -61,7 +64,7 @@ def main(argv):
     if len(argv) != 2 and not os.path.isdir(argv[1]):
         print("usage: %s dir" % argv[0])
     data = loadConfig(argv[1])
-    print(yaml.safe_dump(data, indent=4))
+    print(yaml.dump(data, Dumper=SafeDumper, indent=4))
 
 
 if __name__ == "__main__":
@@ -27,6 +27,7 @@ Requires:       openssl
 
 Buildrequires:  python3-devel
 Buildrequires:  python3-setuptools
+Buildrequires:  python3-jinja2
 Buildrequires:  python3-pbr
 
 %description
@@ -49,9 +50,11 @@ install -p -D -m 0644 defaults/sfconfig.yaml %{buildroot}%{_sysconfdir}/software
 install -p -D -m 0644 defaults/logo-favicon.ico %{buildroot}%{_sysconfdir}/software-factory/logo-favicon.ico
 install -p -D -m 0644 defaults/logo-splash.png %{buildroot}%{_sysconfdir}/software-factory/logo-splash.png
 install -p -D -m 0644 defaults/logo-topmenu.png %{buildroot}%{_sysconfdir}/software-factory/logo-topmenu.png
+install -p -D -m 0644 defaults/sfconfig-daemon.service %{buildroot}%{_unitdir}/sfconfig-daemon.service
 # /usr/share/sf-config
 install -p -d %{buildroot}%{_datarootdir}/sf-config
 mv ansible defaults refarch scripts templates testinfra %{buildroot}%{_datarootdir}/sf-config/
+PYTHONPATH=%{buildroot}%{python3_sitelib} %{__python3} -m sfconfig.tools.compile_templates %{buildroot}%{_datarootdir}/sf-config/templates
 # /var/
 install -p -d -m 0700 %{buildroot}/var/log/software-factory
 install -p -d -m 0755 %{buildroot}/var/lib/software-factory
@@ -68,6 +71,7 @@ install -p -d -m 0750 %{buildroot}/usr/share/software-factory
 %files
 %license LICENSE
 %{_bindir}/sf*
+%{_unitdir}/sfconfig-daemon.service
 %{python3_sitelib}/sfconfig-%{version}-py*.egg-info
 %{python3_sitelib}/sfconfig
 %dir %attr(0750, root, root) %{_sysconfdir}/software-factory/
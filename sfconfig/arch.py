@@ -11,8 +11,15 @@
 # under the License.
 
 import sys
-from sfconfig.utils import pread
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
 from sfconfig.utils import fail
+from sfconfig.utils import get_os_id
+from sfconfig.utils import pread
 
 required_roles = (
     "install-server",
@@ -30,6 +37,59 @@ rhel_unsupported_roles = (
 correct_order = ['gerrit', 'managesf']
 
 
+class Architecture(object):
+    """The arch inventory indexed by host name and by role
+
+    The hosts are the arch inventory dictionaries, the roles added with
+    add_role are also added to the arch file host.
+    """
+    def __init__(self, inventory: List[dict]):
+        self.hosts = inventory
+        self.by_name: Dict[str, dict] = {}
+        self.by_role: Dict[str, List[dict]] = {}
+        # The (host index, role index) of the first occurence of a role
+        self.positions: Dict[str, Tuple[int, int]] = {}
+        for host_idx, host in enumerate(inventory):
+            if "name" in host:
+                self.by_name[host["name"]] = host
+            for role_idx, role in enumerate(host["roles"]):
+                self._index(host_idx, role_idx, host, role)
+
+    def _index(self, host_idx, role_idx, host, role):
+        self.by_role.setdefault(role, []).append(host)
+        self.positions.setdefault(role, (host_idx, role_idx))
+
+    def add_role(self, host: dict, role: str):
+        host["roles"].append(role)
+        host_idx = next(idx for idx, h in enumerate(self.hosts) if h is host)
+        self._index(host_idx, len(host["roles"]) - 1, host, role)
+
+    def has_role(self, role: str) -> bool:
+        return role in self.by_role
+
+    def role_hosts(self, role: str) -> List[dict]:
+        return self.by_role.get(role, [])
+
+    def position(self, role: str) -> Optional[Tuple[int, int]]:
+        """Return the position of a role in the inventory, None if absent"""
+        return self.positions.get(role)
+
+    def host_roles(self) -> Iterator[Tuple[dict, str]]:
+        """Return the (host, role) pairs in the inventory order"""
+        for host in self.hosts:
+            for role in host["roles"]:
+                yield host, role
+
+
+def get_install_server_ip(args, host):
+    if args.install_server_ip:
+        return args.install_server_ip
+    if args.generate_only:
+        # Do not probe the system in generate-only mode
+        return host.get("ip", "127.0.0.1")
+    return pread(["ip", "route", "get", "8.8.8.8"]).split()[6]
+
+
 def process(args):
     # scalable_roles are the roles that can be instantiate multiple time
     # this indicate that we don't need $role.$fqdn aliases
@@ -54,7 +114,7 @@ def process(args):
 
     for host in args.sfarch["inventory"]:
         if "install-server" in host["roles"]:
-            host["ip"] = pread(["ip", "route", "get", "8.8.8.8"]).split()[6]
+            host["ip"] = get_install_server_ip(args, host)
         elif "ip" not in host:
             fail("%s: host '%s' needs an ip" % (args.arch, host))
 
@@ -89,7 +149,7 @@ def process(args):
             if role == "nodepool-launcher" and not args.glue["first_launcher"]:
                 args.glue["first_launcher"] = host['name']
         args.glue["hosts_file"][host["ip"]] = [host["hostname"]] + \
-            list(aliases)
+            sorted(aliases)
 
         # Check if inventory role order is correct
         correct_order_indexes = []
@@ -111,7 +171,7 @@ def process(args):
             fail("Only one instance of %s is required" % requirement)
 
     # Check if unsuported components
-    if 'ID="rhel"' in open("/etc/os-release").read():
+    if get_os_id(args) == "rhel":
         unsupported_roles = []
         message = '''The following roles are not supported on RHEL,
 please remove them from /etc/software-factory/arch.yaml file:
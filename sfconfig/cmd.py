@@ -14,19 +14,28 @@
 # Generate ansible group vars based on refarch and sfconfig.yaml
 
 import argparse
+import atexit
 import os
+import shutil
 import sys
+import tempfile
 import time
 
 import sfconfig.arch
+import sfconfig.components
+import sfconfig.config
 import sfconfig.groupvars
 import sfconfig.inventory
+import sfconfig.manifest
+import sfconfig.profile
+import sfconfig.rolegraph
 import sfconfig.upgrade
 
 import sfconfig.utils
+from sfconfig.profile import phase
 from sfconfig.utils import execute
 from sfconfig.utils import save_file
-from sfconfig.utils import yaml_dump
+from sfconfig.utils import system_path
 from sfconfig.utils import yaml_load
 
 
@@ -82,6 +91,13 @@ def usage(components):
                    help="Generated playbook output directory")
     p.add_argument("--lib", default="/var/lib/software-factory/bootstrap-data",
                    help="Deployment secrets output directory")
+    p.add_argument("--generate-only", metavar="ROOT",
+                   help="Only generate the playbooks, inventory and "
+                        "group_vars, without probing the system, and write "
+                        "the outputs under the ROOT directory")
+    p.add_argument("--install-server-ip",
+                   help="The install-server ip, default to the ip route "
+                        "source address")
 
     # common component options
     p.add_argument("--enable-insecure-workers", action='store_true',
@@ -90,6 +106,15 @@ def usage(components):
     # tunning
     p.add_argument("--skip-apply", default=False, action='store_true',
                    help="Do not execute Ansible playbook")
+    p.add_argument("--profile", default=False, action='store_true',
+                   help="Report the time spent in each phase, component "
+                        "and play")
+    p.add_argument("--ansible-profile", default="default",
+                   choices=sfconfig.inventory.ANSIBLE_PROFILES,
+                   help="The ansible execution profile: 'fast' uses smart "
+                        "facts gathering, ssh ControlPersist and forks "
+                        "sized from the inventory, 'mitogen' also uses the "
+                        "mitogen strategy")
     p.add_argument("--skip-test", default=False, action='store_true',
                    help="Do not execute testinfra")
     p.add_argument("--skip-populate-hosts", default=False, action='store_true',
@@ -97,6 +122,22 @@ def usage(components):
     p.add_argument("--disable-external-resources", default=False,
                    action='store_true',
                    help="Disable gerrit replication and nodepool providers")
+    p.add_argument("--split-group-vars", default=False, action='store_true',
+                   help="Only write the variables of a role to its group "
+                        "group_vars file instead of group_vars/all.yaml")
+    p.add_argument("--incremental", default=False, action='store_true',
+                   help="Skip the run when the inputs and the generated "
+                        "files didn't change since the last successful run")
+    p.add_argument("--only-changed-roles", default=False, action='store_true',
+                   help="Only run the roles affected by the group_vars "
+                        "changes since the last successful run")
+    p.add_argument("--dry-run", default=False, action='store_true',
+                   help="Print the roles affected by the group_vars changes "
+                        "and exit, without writing any file")
+    p.add_argument("--renew-certs", nargs='?', const=30, type=int,
+                   metavar='DAYS',
+                   help="Renew the certificates expiring in less than DAYS "
+                        "(default to 30) and only run the roles using them")
 
     # TODO: switch default to False when 2.7 is released
     # (with zookeeper enabled in minimal arch)
@@ -118,8 +159,7 @@ def usage(components):
                    help="Do not call setup tasks")
 
     # Add components options
-    for component in components.values():
-        component.usage(p)
+    components.add_options(p)
 
     # Hidden 3.4 backward compatible command line interface
     argv = sys.argv[1:]
@@ -138,17 +178,88 @@ def usage(components):
     if legacy_value:
         args.enable_insecure_workers = True
 
+    if args.renew_certs is not None:
+        args.only_changed_roles = True
+        args.incremental = False
+
+    args.root = None
+    if args.generate_only:
+        # Relocate every system path under the target root
+        args.root = os.path.abspath(args.generate_only)
+        args.ansible_root = system_path(args, args.ansible_root)
+        args.lib = system_path(args, args.lib)
+        args.skip_apply = True
+        args.skip_populate_hosts = True
+        if args.recover or args.disable or args.erase or args.update:
+            sfconfig.utils.fail("--generate-only can't be used with "
+                                "recover, disable, erase or update")
+        os.environ["XDG_CACHE_HOME"] = cache_home(args.root)
+        # The openssl commands save their random seed in the HOME
+        os.environ["HOME"] = system_path(args, os.path.expanduser("~"))
+        if not os.path.isdir(os.environ["HOME"]):
+            os.makedirs(os.environ["HOME"])
+        # Work on copies of the inputs, they are upgraded in place
+        for name in ("arch", "config"):
+            path = getattr(args, name)
+            root_path = system_path(args, os.path.abspath(path))
+            if os.path.isfile(path):
+                if not os.path.isdir(os.path.dirname(root_path)):
+                    os.makedirs(os.path.dirname(root_path))
+                shutil.copyfile(path, root_path)
+            setattr(args, name, root_path)
+
+    if args.dry_run:
+        dry_run_copies(args)
+
     return args
 
 
-def fix_rhel_centos_name(glue):
+def cache_home(root):
+    """Return the caches directory of a --generate-only root"""
+    return os.path.join(os.path.abspath(root), "var/cache")
+
+
+def dry_run_copies(args):
+    """Point the inputs and the deployment state to temporary copies
+
+    The dry run generates the group_vars like a regular run, the missing
+    secrets, keys and certificates and the upgraded configuration are only
+    written to the copies.
+    """
+    root = tempfile.mkdtemp(prefix="sfconfig-dry-run-")
+    atexit.register(shutil.rmtree, root, True)
+    for name in ("arch", "config"):
+        path = "%s/%s" % (root, os.path.basename(getattr(args, name)))
+        if os.path.isfile(getattr(args, name)):
+            shutil.copyfile(getattr(args, name), path)
+        setattr(args, name, path)
+    if os.path.isdir(args.lib):
+        shutil.copytree(args.lib, "%s/lib" % root, symlinks=True)
+    args.lib = "%s/lib" % root
+
+    def ignore(path, names):
+        # Only the files of the previous run, e.g. the applied group_vars
+        if path != args.ansible_root:
+            return []
+        return [name for name in names if name != "group_vars" and
+                os.path.isdir(os.path.join(path, name))]
+
+    if os.path.isdir(args.ansible_root):
+        shutil.copytree(args.ansible_root, "%s/ansible" % root,
+                        symlinks=True, ignore=ignore)
+    args.ansible_root = "%s/ansible" % root
+
+
+def generate_only_root(argv):
+    """Return the --generate-only root, before the components are loaded"""
+    p = argparse.ArgumentParser(add_help=False)
+    p.add_argument("--generate-only")
+    return p.parse_known_args(argv)[0].generate_only
+
+
+def fix_rhel_centos_name(args, glue):
     """Set correct names once and for all depending on the os id"""
-    osid = list(
-        filter(lambda x: x.startswith("id="),
-               map(str.lower,
-                   open("/etc/os-release").readlines()))
-        )[0].split('=')[1].strip()[1:-1]
-    if osid == "rhel":
+    if sfconfig.utils.get_os_id(args) == "rhel":
         glue["openshift_client"] = "atomic-openshift-clients"
         glue["openshift_server"] = "atomic-openshift"
 
@@ -158,9 +269,21 @@ def fix_rhel_centos_name(glue):
         glue["openshift_server"] = "origin"
 
 
-def main():
-    components = sfconfig.utils.load_components()
+def main(components=None):
+    begin = time.monotonic()
+    if components is None:
+        # The components registry is cached, keep it under the root too
+        root = generate_only_root(sys.argv[1:])
+        if root:
+            os.environ["XDG_CACHE_HOME"] = cache_home(root)
+        components = sfconfig.utils.load_components()
+    # The daemon runs main several times in the same process
+    del sfconfig.utils.changed_files[:]
     args = usage(components)
+    if args.profile:
+        sfconfig.profile.start()
+        sfconfig.profile.record(
+            "phase", "load_components", time.monotonic() - begin)
 
     # Ensure environment is UTF-8
     os.environ["LC_ALL"] = "en_US.UTF-8"
@@ -170,7 +293,6 @@ def main():
         print("[%s] Running sfconfig" % time.ctime())
 
     # Create required directories
-    allyaml = "%s/group_vars/all.yaml" % args.ansible_root
     for dirname in (args.ansible_root,
                     "%s/group_vars" % args.ansible_root,
                     "%s/facts" % args.ansible_root,
@@ -192,9 +314,23 @@ def main():
 
         bootstrap_backup()
 
-    args.sfconfig = yaml_load(args.config)
-    args.sfarch = yaml_load(args.arch)
-    args.secrets = yaml_load("%s/secrets.yaml" % args.lib)
+    args.manifest = None
+    if args.incremental and not (args.recover or args.update or
+                                 args.disable or args.erase or
+                                 args.skip_setup):
+        args.manifest = sfconfig.manifest.load(args)
+        if sfconfig.manifest.up_to_date(
+                args.manifest, 'inputs', sfconfig.manifest.inputs(args)) and \
+           sfconfig.manifest.up_to_date(
+                args.manifest, 'outputs', sfconfig.manifest.outputs(args)):
+            print("[+] Nothing changed since the last run, skipping")
+            sfconfig.profile.report(args)
+            return
+
+    with phase("load"):
+        args.sfconfig = yaml_load(args.config)
+        args.sfarch = yaml_load(args.arch)
+        args.secrets = yaml_load("%s/secrets.yaml" % args.lib)
     args.glue = {'sf_tasks_dir': "%s/ansible/tasks" % args.share,
                  'sf_templates_dir': "%s/templates" % args.share,
                  'sf_playbooks_dir': "%s" % args.ansible_root,
@@ -208,17 +344,23 @@ def main():
         args.glue['force_update_tasks'] = False
 
     # Make sure the yaml files are updated
-    sfconfig.upgrade.update_sfconfig(args)
-    sfconfig.upgrade.update_arch(args)
-    fix_rhel_centos_name(args.glue)
+    with phase("upgrade"):
+        sfconfig.upgrade.update_sfconfig(args)
+        sfconfig.upgrade.update_arch(args)
+        fix_rhel_centos_name(args, args.glue)
+    # The typed view of the configuration for the components
+    args.conf = sfconfig.config.Config(args.sfconfig)
 
     # Save arch if needed
     if args.save_arch:
         save_file(args.sfarch, args.arch)
 
+    # Index the architecture hosts and roles
+    args.arch_index = sfconfig.arch.Architecture(args.sfarch["inventory"])
+
     # Parse components options
-    for component in components.values():
-        component.argparse(args)
+    for role in components.argparse_roles(args.arch_index.by_role):
+        components[role].argparse(args)
 
     # Prepare components
     for host in args.sfarch["inventory"]:
@@ -231,27 +373,36 @@ def main():
             args.glue["%s_host" % role.replace('-', '_')] = host["hostname"]
             if role not in components:
                 continue
-            components[role].prepare(args)
+            with phase("prepare %s" % role, "component"):
+                components[role].prepare(args)
 
     # Process the arch and render playbooks
-    sfconfig.arch.process(args)
-    sfconfig.inventory.generate(args)
+    with phase("arch.process"):
+        sfconfig.arch.process(args)
+    with phase("inventory.generate"):
+        sfconfig.inventory.generate(args)
+    args.ansible_settings = sfconfig.inventory.ansible_profile(args)
 
     # Check if fqdn should be updated
     args.glue["update_fqdn"] = False
-    if os.path.isfile("/var/lib/software-factory/.version") and \
-       os.path.isfile(allyaml):
-        previous_args = yaml_load(allyaml)
+    if os.path.isfile(
+            system_path(args, "/var/lib/software-factory/.version")) and \
+       os.path.isfile(sfconfig.groupvars.vars_path(args)):
+        previous_args = yaml_load(sfconfig.groupvars.vars_path(args))
         if args.sfconfig['fqdn'] != previous_args['fqdn']:
             args.glue["update_fqdn"] = True
 
     # Generate group vars
-    sfconfig.groupvars.load(args)
-    for host in args.sfarch["inventory"]:
-        for role in host["roles"]:
-            if role not in components:
-                continue
-            if not args.skip_setup:
+    with phase("groupvars.load"):
+        sfconfig.groupvars.load(args)
+    if not args.skip_setup:
+        with phase("provision_keys"):
+            sfconfig.components.provision_keys(args, components)
+    for host, role in args.arch_index.host_roles():
+        if role not in components:
+            continue
+        if not args.skip_setup:
+            with phase("configure %s" % role, "component"):
                 components[role].configure(args, host)
 
     # Set rdo_release_url as global vars to be usable by sf-base and sf-upgrade
@@ -261,32 +412,52 @@ def main():
     if args.save_sfconfig:
         save_file(args.sfconfig, args.config)
 
+    # Add legacy content
+    args.glue.update(yaml_load(args.config))
+    if os.path.isfile(args.extra):
+        args.glue.update(yaml_load(args.extra))
+    args.glue.update(args.sfarch)
+    # 3.4 backward compatible extra vars
+    legacy_name = 'enable_insecure_slaves'
+    if legacy_name in args.glue:
+        args.glue['enable_insecure_workers'] = args.glue[legacy_name]
+
+    # Compute the roles affected by the change
+    args.limit_roles = None
+    if (args.only_changed_roles or args.dry_run) and not (
+            args.recover or args.update or args.disable or args.erase):
+        args.limit_roles = sfconfig.rolegraph.affected_roles(
+            args, components, sfconfig.rolegraph.load_applied(args))
+        if args.limit_roles is not None:
+            print("[+] Affected roles: %s" % (
+                " ".join(sorted(args.limit_roles)) or "none"))
+    if args.dry_run:
+        sfconfig.profile.report(args)
+        return
+
     # Generate group vars
-    with open(allyaml, "w") as allvars_file:
-        # Add legacy content
-        args.glue.update(yaml_load(args.config))
-        if os.path.isfile(args.extra):
-            args.glue.update(yaml_load(args.extra))
-        args.glue.update(args.sfarch)
-        # 3.4 backward compatible extra vars
-        legacy_name = 'enable_insecure_slaves'
-        if legacy_name in args.glue:
-            args.glue['enable_insecure_workers'] = args.glue[legacy_name]
-        yaml_dump(args.glue, allvars_file)
+    with phase("group_vars.write"):
+        sfconfig.groupvars.write(args)
 
     if 'show_hidden_logs' not in args.glue:
         args.glue['show_hidden_logs'] = False
 
     # Validate role settings
-    for host in args.sfarch["inventory"]:
-        for role in host["roles"]:
-            if role not in components:
-                continue
+    for host, role in args.arch_index.host_roles():
+        if role not in components:
+            continue
+        with phase("validate %s" % role, "component"):
             components[role].validate(args, host)
 
-    sfconfig.inventory.run(args)
+    with phase("inventory.run"):
+        sfconfig.inventory.run(args)
 
     if not args.skip_apply:
+        if not args.disable and not args.erase:
+            # Record the deployed state for the next --incremental run
+            sfconfig.manifest.save(args)
+            sfconfig.rolegraph.save_applied(
+                args, sfconfig.groupvars.vars_path(args))
         execute(["logger", "sfconfig.py: ended"])
         if not args.disable or not args.erase:
             print("""%s: SUCCESS
@@ -298,7 +469,7 @@ Login with admin user, get the admin password by running:
 """ % (args.sfconfig['fqdn'], args.sfconfig['fqdn']))
 
     if (not args.sfconfig['authentication']['SAML2']['disabled'] and
-       not os.path.isfile(saml_idp_file)):
+       not os.path.isfile(system_path(args, saml_idp_file))):
         print("""
 Service Provider metadata is available at /etc/httpd/saml2/mellon_metadata.xml
 Once you have the Identity Provider metadata, run:
@@ -307,13 +478,15 @@ Once you have the Identity Provider metadata, run:
 """)
 
     try:
-        notification = open(
-            "/var/lib/software-factory/ansible/notification.txt").read()
+        notification = open(system_path(
+            args, "/var/lib/software-factory/ansible/notification.txt")).read()
         if notification:
             print(notification)
     except IOError:
         pass
 
+    sfconfig.profile.report(args)
+
 
 if __name__ == "__main__":
     main()
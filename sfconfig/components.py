@@ -10,17 +10,361 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import concurrent.futures
 import crypt
+import datetime
+import fcntl
+import glob
+import hashlib
+import importlib.util
+import inspect
+import json
 import os
 import random
+import re
 import string
+import sys
 from typing import List
 
+try:
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+except ImportError:
+    # Fallback to the openssl and ssh-keygen commands
+    x509 = None
+
 from sfconfig.utils import execute
+from sfconfig.utils import pread
+from sfconfig.utils import write_file
+from sfconfig.utils import yaml_dump
+from sfconfig.utils import yaml_load
+
+CERT_CNF = """[req]
+req_extensions = v3_req
+distinguished_name = req_distinguished_name
+
+[ req_distinguished_name ]
+commonName_default = %s
+
+[ v3_req ]
+subjectAltName=@alt_names
+
+[alt_names]
+DNS.1 = %s
+"""
+CERT_DAYS = 3650
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def generate_rsa_key(bits):
+    return rsa.generate_private_key(
+        public_exponent=65537, key_size=bits, backend=default_backend())
+
+
+def x509_name(**attrs):
+    oids = {'C': NameOID.COUNTRY_NAME, 'O': NameOID.ORGANIZATION_NAME,
+            'OU': NameOID.ORGANIZATIONAL_UNIT_NAME, 'CN': NameOID.COMMON_NAME}
+    return x509.Name([x509.NameAttribute(oids[attr], value)
+                      for attr, value in attrs.items()])
+
+
+def generate_ssh_key(priv, comment):
+    """Generate a PEM encoded rsa key and its openssh public key"""
+    if x509 is None:
+        return execute(["ssh-keygen", "-t", "rsa", "-m", "PEM", "-N", "",
+                        "-f", priv, "-q", '-C', comment])
+    key = generate_rsa_key(3072)
+    pub = key.public_key().public_bytes(
+        serialization.Encoding.OpenSSH, serialization.PublicFormat.OpenSSH)
+    write_file("%s.pub" % priv, pub + (" %s\n" % comment).encode('utf-8'))
+    write_file(priv, key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption()), 0o600)
+
+
+def generate_ca(ca_file, ca_key_file, ou):
+    """Generate a self-signed certificate authority"""
+    if x509 is None:
+        return execute(["openssl", "req", "-nodes", "-days", str(CERT_DAYS),
+                        "-new", "-x509", "-subj",
+                        "/C=FR/O=SoftwareFactory/OU=%s" % ou,
+                        "-keyout", ca_key_file, "-out", ca_file])
+    key = generate_rsa_key(2048)
+    name = x509_name(C="FR", O="SoftwareFactory", OU=ou)
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(
+        name).public_key(key.public_key()).serial_number(
+        x509.random_serial_number()).not_valid_before(now).not_valid_after(
+        now + datetime.timedelta(days=CERT_DAYS)).add_extension(
+        x509.BasicConstraints(ca=True, path_length=None), critical=True
+    ).sign(key, hashes.SHA256(), default_backend())
+    write_file(ca_key_file, key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()), 0o600)
+    write_file(ca_file, cert.public_bytes(serialization.Encoding.PEM))
+
+
+def sign_cert(cert_cnf, cert_req, cert_crt, ca_file, ca_key_file,
+              ca_srl_file):
+    if x509 is None:
+        # The CA serial file is updated by each signature
+        with open(ca_srl_file) as srl:
+            fcntl.flock(srl, fcntl.LOCK_EX)
+            execute(["openssl", "x509", "-req", "-days", str(CERT_DAYS),
+                     "-sha256", "-extensions", "v3_req", "-extfile", cert_cnf,
+                     "-CA", ca_file, "-CAkey", ca_key_file,
+                     "-CAserial", ca_srl_file,
+                     "-in", cert_req, "-out", cert_crt])
+        return
+    csr = x509.load_pem_x509_csr(open(cert_req, "rb").read(),
+                                 default_backend())
+    ca = x509.load_pem_x509_certificate(open(ca_file, "rb").read(),
+                                        default_backend())
+    ca_key = serialization.load_pem_private_key(
+        open(ca_key_file, "rb").read(), None, default_backend())
+    now = datetime.datetime.utcnow()
+    builder = x509.CertificateBuilder().subject_name(
+        csr.subject).issuer_name(ca.subject).public_key(
+        csr.public_key()).serial_number(
+        x509.random_serial_number()).not_valid_before(now).not_valid_after(
+        now + datetime.timedelta(days=CERT_DAYS))
+    for extension in csr.extensions:
+        builder = builder.add_extension(extension.value, extension.critical)
+    cert = builder.sign(ca_key, hashes.SHA256(), default_backend())
+    write_file(cert_crt, cert.public_bytes(serialization.Encoding.PEM))
+
+
+def cert_paths(lib, name):
+    return dict((ext, "%s/certs/%s.%s" % (lib, name, ext))
+                for ext in ("cnf", "key", "req", "crt"))
+
+
+def generate_cert(lib, name, common_name, fqdn, ca_file, ca_key_file,
+                  ca_srl_file):
+    """Create the missing key, request and certificate signed by the CA"""
+    paths = cert_paths(lib, name)
+
+    def xunlink(filename):
+        if os.path.isfile(filename):
+            os.unlink(filename)
+
+    if os.path.isfile(paths["cnf"]) and open(paths["cnf"]).read().find(
+            "DNS.1 = %s\n" % common_name) == -1:
+        # if FQDN changed, remove all certificates
+        for ext in ("cnf", "req", "crt"):
+            xunlink(paths[ext])
+
+    # Then manage certificate request
+    if not os.path.isfile(paths["cnf"]):
+        write_file(paths["cnf"], CERT_CNF % (common_name, common_name))
+
+    if not os.path.isfile(paths["key"]):
+        xunlink(paths["req"])
+        if x509 is None:
+            execute(["openssl", "genrsa", "-out", paths["key"], "2048"])
+        else:
+            write_file(paths["key"], generate_rsa_key(2048).private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.TraditionalOpenSSL,
+                serialization.NoEncryption()), 0o600)
+
+    if not os.path.isfile(paths["req"]):
+        xunlink(paths["crt"])
+        if x509 is None:
+            execute(["openssl", "req", "-new", "-subj",
+                     "/C=FR/O=SoftwareFactory/CN=%s" % fqdn,
+                     "-extensions", "v3_req", "-config", paths["cnf"],
+                     "-key", paths["key"], "-out", paths["req"]])
+        else:
+            key = serialization.load_pem_private_key(
+                open(paths["key"], "rb").read(), None, default_backend())
+            csr = x509.CertificateSigningRequestBuilder().subject_name(
+                x509_name(C="FR", O="SoftwareFactory", CN=fqdn)
+            ).add_extension(x509.SubjectAlternativeName(
+                [x509.DNSName(common_name)]), critical=False).sign(
+                key, hashes.SHA256(), default_backend())
+            write_file(paths["req"],
+                       csr.public_bytes(serialization.Encoding.PEM))
+
+    if not os.path.isfile(paths["crt"]):
+        sign_cert(paths["cnf"], paths["req"], paths["crt"],
+                  ca_file, ca_key_file, ca_srl_file)
+
+
+def cert_info(path):
+    """Return the subject CN, SANs, expiry, serial and sha256 fingerprint"""
+    if x509 is not None:
+        try:
+            cert = x509.load_pem_x509_certificate(
+                open(path, "rb").read(), default_backend())
+        except ValueError:
+            return None
+        cn = cert.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+        try:
+            sans = cert.extensions.get_extension_for_class(
+                x509.SubjectAlternativeName).value.get_values_for_type(
+                x509.DNSName)
+        except x509.ExtensionNotFound:
+            sans = []
+        fingerprint = cert.fingerprint(hashes.SHA256()).hex().upper()
+        if hasattr(cert, "not_valid_after_utc"):
+            not_after = cert.not_valid_after_utc
+        else:
+            not_after = cert.not_valid_after
+        return {
+            'cn': cn[0].value if cn else None,
+            'sans': list(sans),
+            'not_after': not_after.strftime(DATE_FORMAT),
+            'serial': "%X" % cert.serial_number,
+            'fingerprint': ":".join(fingerprint[idx:idx + 2]
+                                    for idx in range(0, len(fingerprint), 2)),
+        }
+    output = pread(["openssl", "x509", "-noout", "-in", path, "-subject",
+                    "-enddate", "-serial", "-fingerprint", "-sha256",
+                    "-text"])
+    not_after = re.search(r"^notAfter=(.*)$", output, re.M)
+    fingerprint = re.search(r"Fingerprint=([0-9A-F:]+)", output, re.I)
+    if not not_after or not fingerprint:
+        return None
+    cn = re.search(r"^subject=.*?CN\s*=\s*([^,/\n]+)", output, re.M)
+    serial = re.search(r"^serial=([0-9A-F]+)$", output, re.M | re.I)
+    return {
+        'cn': cn.group(1).strip() if cn else None,
+        'sans': re.findall(r"DNS:([^,\s]+)", output),
+        'not_after': datetime.datetime.strptime(
+            " ".join(not_after.group(1).split()),
+            "%b %d %H:%M:%S %Y %Z").strftime(DATE_FORMAT),
+        'serial': serial.group(1).lstrip("0").upper() if serial else None,
+        'fingerprint': fingerprint.group(1).upper(),
+    }
+
+
+def cert_index_path(args):
+    return "%s/certs/index.yaml" % args.lib
+
+
+def load_cert_index(args):
+    return yaml_load(cert_index_path(args)) or {}
+
+
+def update_cert_index(args, index):
+    """Refresh the index entries of the certificates that changed"""
+    changed = False
+    names = set(index) | set(["localCA"])
+    for path in glob.glob("%s/certs/*.crt" % args.lib):
+        names.add(os.path.basename(path)[:-4])
+    for name in sorted(names):
+        path = "%s/certs/%s.crt" % (args.lib, name)
+        if name == "localCA":
+            path = args.ca_file
+        if not os.path.isfile(path):
+            changed |= index.pop(name, None) is not None
+            continue
+        mtime = os.stat(path).st_mtime
+        if index.get(name, {}).get("mtime") == mtime:
+            continue
+        entry = cert_info(path) or {'fingerprint': None}
+        entry["mtime"] = mtime
+        entry["path"] = path
+        index[name] = entry
+        changed = True
+    if changed:
+        write_file(cert_index_path(args), yaml_dump(index))
+
+
+def renew_certs(args, days):
+    """Remove the certificates expiring in less than days
+
+    Renewing the CA removes every certificate it signed.
+    """
+    limit = (datetime.datetime.utcnow() + datetime.timedelta(
+        days=days)).strftime(DATE_FORMAT)
+    removed = []
+    ca = args.cert_index.get("localCA", {})
+    if ca.get("not_after") and ca["not_after"] < limit:
+        print("[+] Renewing the local CA expiring on %s" % ca["not_after"])
+        removed = glob.glob("%s/certs/localCA*" % args.lib) + \
+            glob.glob("%s/certs/*.req" % args.lib) + \
+            glob.glob("%s/certs/*.crt" % args.lib)
+    else:
+        for name, entry in sorted(args.cert_index.items()):
+            if name == "localCA" or not entry.get("not_after") or \
+               entry["not_after"] >= limit:
+                continue
+            print("[+] Renewing the %s certificate expiring on %s" % (
+                name, entry["not_after"]))
+            paths = cert_paths(args.lib, name)
+            removed.extend((paths["req"], paths["crt"]))
+    for path in removed:
+        if os.path.isfile(path):
+            os.unlink(path)
+
+
+def cert_up_to_date(args, name, common_name):
+    """Check the certificate files against the index, without reading them"""
+    paths = cert_paths(args.lib, name)
+    entry = getattr(args, "cert_index", {}).get(name, {})
+    return all(map(os.path.isfile, paths.values())) and \
+        entry.get("sans") == [common_name] and \
+        entry.get("mtime") == os.stat(paths["crt"]).st_mtime
+
+
+def provision_keys(args, components):
+    """Generate the ssh keys and certificates the components declare
+
+    The missing keys and certificates are generated concurrently before the
+    components are configured, so that their get_or_generate_* calls only
+    read the files.
+    """
+    ssh_keys = set()
+    certs = {}
+    for host, role in args.arch_index.host_roles():
+        if role not in components:
+            continue
+        ssh_keys.update(components[role].ssh_keys)
+        for name, common_name in components[role].certificates(args, host):
+            certs.setdefault(name, set()).add(common_name)
+
+    args.cert_index = load_cert_index(args)
+    if args.renew_certs is not None:
+        renew_certs(args, args.renew_certs)
+    Component().get_or_generate_CA(args)
+    jobs = []
+    for name in sorted(ssh_keys):
+        priv = "%s/ssh_keys/%s" % (args.lib, name)
+        if not os.path.isfile(priv):
+            jobs.append((generate_ssh_key, priv, '%s@%s' % (
+                name, args.sfconfig["fqdn"])))
+    for name, common_names in sorted(certs.items()):
+        if len(common_names) > 1:
+            # The last configured host wins, let the components handle it
+            continue
+        common_name = common_names.pop()
+        if cert_up_to_date(args, name, common_name):
+            continue
+        jobs.append((generate_cert, args.lib, name, common_name,
+                     args.sfconfig["fqdn"], args.ca_file, args.ca_key_file,
+                     args.ca_srl_file))
+
+    if len(jobs) > 1:
+        print("[+] Generating %d keys and certificates" % len(jobs))
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            for future in [executor.submit(*job) for job in jobs]:
+                future.result()
+    elif jobs:
+        jobs[0][0](*jobs[0][1:])
+    update_cert_index(args, args.cert_index)
 
 
 class Component(object):
     require_roles: List[str] = []
+    # The ssh keys generated by provision_keys before configure
+    ssh_keys: List[str] = []
 
     def hash_password(self, password):
         salt = '$6$' + ''.join(random.choice(
@@ -34,10 +378,9 @@ class Component(object):
         if not os.path.isfile("%s.pub" % path):
             raise RuntimeError("%s: missing .pub file" % path)
 
-        with open("%s/ssh_keys/%s" % (args.lib, name), "w") as of:
-            of.write(open(path).read())
-        with open("%s/ssh_keys/%s.pub" % (args.lib, name), "w") as of:
-            of.write(open("%s.pub" % path).read())
+        write_file("%s/ssh_keys/%s" % (args.lib, name), open(path).read())
+        write_file("%s/ssh_keys/%s.pub" % (args.lib, name),
+                   open("%s.pub" % path).read())
 
     def get_or_generate_ssh_key(self, args, name):
         priv = "%s/ssh_keys/%s" % (args.lib, name)
@@ -45,8 +388,7 @@ class Component(object):
         comment = '%s@%s' % (name, args.sfconfig["fqdn"])
 
         if not os.path.isfile(priv):
-            execute(["ssh-keygen", "-t", "rsa", "-m", "PEM", "-N", "",
-                     "-f", priv, "-q", '-C', comment])
+            generate_ssh_key(priv, comment)
         args.glue[name] = open(priv).read()
         args.glue["%s_pub" % name] = open(pub).read()
 
@@ -58,69 +400,21 @@ class Component(object):
         if not os.path.isfile(args.ca_file):
             # Generate a random OU subject to be able to trust multiple sf CA
             ou = ''.join(random.choice('0123456789abcdef') for n in range(6))
-            execute(["openssl", "req", "-nodes", "-days", "3650", "-new",
-                     "-x509", "-subj", "/C=FR/O=SoftwareFactory/OU=%s" % ou,
-                     "-keyout", args.ca_key_file, "-out", args.ca_file])
+            generate_ca(args.ca_file, args.ca_key_file, ou)
 
         if not os.path.isfile(args.ca_srl_file):
-            open(args.ca_srl_file, "w").write("00\n")
+            write_file(args.ca_srl_file, "00\n")
 
         args.glue["localCA_pem"] = open(args.ca_file).read()
 
     def get_or_generate_cert(self, args, name, common_name):
-        cert_cnf = "%s/certs/%s.cnf" % (args.lib, name)
-        cert_key = "%s/certs/%s.key" % (args.lib, name)
-        cert_req = "%s/certs/%s.req" % (args.lib, name)
-        cert_crt = "%s/certs/%s.crt" % (args.lib, name)
-
-        def xunlink(filename):
-            if os.path.isfile(filename):
-                os.unlink(filename)
-
-        if os.path.isfile(cert_cnf) and \
-                open(cert_cnf).read().find("DNS.1 = %s\n" % common_name) == -1:
-            # if FQDN changed, remove all certificates
-            for fn in [cert_cnf, cert_req, cert_crt]:
-                xunlink(fn)
-
-        # Then manage certificate request
-        if not os.path.isfile(cert_cnf):
-            open(cert_cnf, "w").write("""[req]
-req_extensions = v3_req
-distinguished_name = req_distinguished_name
-
-[ req_distinguished_name ]
-commonName_default = %s
-
-[ v3_req ]
-subjectAltName=@alt_names
-
-[alt_names]
-DNS.1 = %s
-""" % (common_name, common_name))
-
-        if not os.path.isfile(cert_key):
-            if os.path.isfile(cert_req):
-                xunlink(cert_req)
-            execute(["openssl", "genrsa", "-out", cert_key, "2048"])
-
-        if not os.path.isfile(cert_req):
-            if os.path.isfile(cert_crt):
-                xunlink(cert_crt)
-            execute(["openssl", "req", "-new", "-subj",
-                     "/C=FR/O=SoftwareFactory/CN=%s" % args.sfconfig["fqdn"],
-                     "-extensions", "v3_req", "-config", cert_cnf,
-                     "-key", cert_key, "-out", cert_req])
-
-        if not os.path.isfile(cert_crt):
-            execute(["openssl", "x509", "-req", "-days", "3650", "-sha256",
-                     "-extensions", "v3_req", "-extfile", cert_cnf,
-                     "-CA", args.ca_file, "-CAkey", args.ca_key_file,
-                     "-CAserial", args.ca_srl_file,
-                     "-in", cert_req, "-out", cert_crt])
+        paths = cert_paths(args.lib, name)
+        if not cert_up_to_date(args, name, common_name):
+            generate_cert(args.lib, name, common_name, args.sfconfig["fqdn"],
+                          args.ca_file, args.ca_key_file, args.ca_srl_file)
 
-        args.glue["%s_crt" % name] = open(cert_crt).read()
-        args.glue["%s_key" % name] = open(cert_key).read()
+        args.glue["%s_crt" % name] = open(paths["crt"]).read()
+        args.glue["%s_key" % name] = open(paths["key"]).read()
         args.glue["%s_chain" % name] = args.glue["%s_crt" % name]
 
     def add_mysql_database(self, args, name, hosts=[],
@@ -152,15 +446,8 @@ DNS.1 = %s
         pass
 
     def prepare(self, args):
-        missing_roles = set()
-        for role in self.require_roles:
-            found = False
-            for host in args.sfarch["inventory"]:
-                if role in host["roles"]:
-                    found = True
-                    break
-            if not found:
-                missing_roles.add(role)
+        missing_roles = set(role for role in self.require_roles
+                            if not args.arch_index.has_role(role))
         if not args.allinone and missing_roles:
             raise RuntimeError("%s: missing required role %s" % (
                 self.role, missing_roles))
@@ -168,10 +455,172 @@ DNS.1 = %s
             print("%s: Adding missing roles %s" % (self.role,
                                                    " ".join(missing_roles)))
             for role in missing_roles:
-                args.sfarch["inventory"][0]["roles"].append(role)
+                args.arch_index.add_role(args.sfarch["inventory"][0], role)
+
+    def certificates(self, args, host):
+        """Return the (name, common_name) certificates used by configure"""
+        return []
 
     def configure(self, args, host):
         pass
 
     def validate(self, args, host):
         pass
+
+
+class OptionsRecorder(object):
+    """Record the argparse options added by a component usage"""
+    def __init__(self):
+        self.options = []
+
+    def add_argument(self, *args, **kwargs):
+        self.options.append([list(args), kwargs])
+
+
+def registry_cache_path(share):
+    cache_dir = os.environ.get(
+        "XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return "%s/sfconfig/components-%s.json" % (
+        cache_dir, hashlib.sha1(share.encode('utf-8')).hexdigest()[:12])
+
+
+def load_module(modpath):
+    role_name = modpath.split('/')[-3][3:]
+    spec = importlib.util.spec_from_file_location(
+        "sfconfig.components.%s" % role_name, modpath)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def module_components(modpath):
+    """Return the component instances defined in a role module"""
+    role_name = modpath.split('/')[-3][3:]
+    components = {}
+    for name, cls in inspect.getmembers(load_module(modpath),
+                                        inspect.isclass):
+        if issubclass(cls, Component) and name != "Component":
+            component = cls()
+            if not getattr(component, "role", None):
+                component.role = role_name
+            components[component.role] = component
+    return components
+
+
+def index_components(components):
+    """Return the registry entries of a role module components"""
+    entries = {}
+    for role, component in components.items():
+        recorder = OptionsRecorder()
+        component.usage(recorder)
+        entries[role] = {
+            'class': type(component).__name__,
+            'require_roles': list(component.require_roles),
+            'options': recorder.options,
+            'argparse': type(component).argparse is not Component.argparse,
+        }
+    return entries
+
+
+class ComponentRegistry(object):
+    """The components of the share roles, loaded on first access
+
+    The index of the roles meta/sfconfig.py modules is cached and only the
+    modules that changed are loaded to refresh it. The modules with options
+    that are not json serializable are not cached and always loaded.
+    """
+    def __init__(self, share):
+        self.share = share
+        self.modules = {}
+        self.components = {}
+        self.index = {}
+        self.load_index()
+
+    def load_index(self):
+        cache_path = registry_cache_path(self.share)
+        try:
+            cache = json.load(open(cache_path))
+        except (IOError, ValueError):
+            cache = {}
+        # The index also depends on the Component base class
+        if cache.get("version") != os.stat(__file__).st_mtime:
+            cache = {}
+        cache = cache.get("modules", {})
+        modules = {}
+        for modpath in sorted(glob.glob(
+                "%s/ansible/roles/*/meta/sfconfig.py" % self.share)):
+            mtime = os.stat(modpath).st_mtime
+            entry = cache.get(modpath)
+            if not entry or entry["mtime"] != mtime or "error" in entry:
+                try:
+                    components = module_components(modpath)
+                    entry = {'mtime': mtime,
+                             'roles': index_components(components)}
+                except Exception as e:
+                    # Only fail when the role is used
+                    entry = {'mtime': mtime, 'roles': {}, 'error': str(e)}
+                    entry['roles'][modpath.split('/')[-3][3:]] = {
+                        'class': None, 'require_roles': [], 'options': [],
+                        'argparse': False}
+                else:
+                    try:
+                        json.dumps(entry)
+                    except (TypeError, ValueError):
+                        # The options can't be cached, e.g. with type=int:
+                        # keep the module loaded, it is indexed on each run
+                        self.modules[modpath] = components
+            modules[modpath] = entry
+            for role, role_entry in entry["roles"].items():
+                self.index[role] = dict(role_entry, path=modpath)
+        cached = dict((modpath, entry) for modpath, entry in modules.items()
+                      if modpath not in self.modules)
+        if cached != cache:
+            try:
+                if not os.path.isdir(os.path.dirname(cache_path)):
+                    os.makedirs(os.path.dirname(cache_path))
+                write_file(cache_path, json.dumps(
+                    {'version': os.stat(__file__).st_mtime,
+                     'modules': cached}))
+            except (IOError, OSError):
+                pass
+        self.errors = dict((modpath, entry["error"])
+                           for modpath, entry in modules.items()
+                           if "error" in entry)
+        self.mtimes = dict((modpath, entry["mtime"])
+                           for modpath, entry in modules.items())
+
+    def stale(self):
+        """Check if a role module changed since the registry was loaded"""
+        mtimes = {}
+        for modpath in glob.glob(
+                "%s/ansible/roles/*/meta/sfconfig.py" % self.share):
+            mtimes[modpath] = os.stat(modpath).st_mtime
+        return mtimes != self.mtimes
+
+    def add_options(self, parser):
+        for role in sorted(self.index):
+            for args, kwargs in self.index[role]["options"]:
+                parser.add_argument(*args, **kwargs)
+
+    def argparse_roles(self, roles):
+        """Return the deployed roles and the roles with an argparse hook"""
+        return sorted(role for role in self.index
+                      if role in roles or self.index[role]["argparse"])
+
+    def require_roles(self, role):
+        return self.index[role]["require_roles"]
+
+    def __contains__(self, role):
+        return role in self.index
+
+    def __getitem__(self, role):
+        if role not in self.components:
+            modpath = self.index[role]["path"]
+            if modpath in self.errors:
+                raise RuntimeError("%s: couldn't load (%s)" % (
+                    modpath, self.errors[modpath]))
+            if modpath not in self.modules:
+                self.modules[modpath] = module_components(modpath)
+            self.components[role] = self.modules[modpath][role]
+        return self.components[role]
@@ -0,0 +1,446 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# The sfconfig.yaml schema: the migrations to the current schema version,
+# the validation and a typed attribute access to the configuration.
+
+import copy
+
+# The schema version written to sfconfig.yaml once the migrations are applied
+SCHEMA_VERSION = 2
+NoneType = type(None)
+
+
+class Opt(object):
+    """A field that may be missing"""
+    def __init__(self, kind):
+        self.kind = kind
+
+
+class ListOf(object):
+    """A list of values of the same kind"""
+    def __init__(self, kind):
+        self.kind = kind
+
+
+class Section(object):
+    """A typed view of a sfconfig.yaml section
+
+    The view doesn't copy the values, the components can still modify the
+    section dictionary.
+    """
+    __slots__ = ("_data",)
+    # The field key by attribute name, with the key value type
+    fields = {}
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getattr__(self, name):
+        try:
+            key, kind = self.fields[name]
+        except KeyError:
+            raise AttributeError("%s has no field %s" % (
+                type(self).__name__, name))
+        value = self._data.get(key)
+        if isinstance(kind, Opt):
+            kind = kind.kind
+        if isinstance(kind, type) and issubclass(kind, Section) and \
+           value is not None:
+            return kind(value)
+        return value
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    @classmethod
+    def validate(cls, data, path, errors):
+        for key, kind in cls.fields.values():
+            field_path = "%s.%s" % (path, key) if path else key
+            if key not in data:
+                if not isinstance(kind, Opt):
+                    errors.append("%s: missing value" % field_path)
+                continue
+            if isinstance(kind, Opt):
+                kind = kind.kind
+            validate_value(data[key], kind, field_path, errors)
+
+
+def type_names(kind):
+    kinds = kind if isinstance(kind, tuple) else (kind,)
+    return " or ".join(
+        "null" if k is NoneType else "a mapping" if k is dict or (
+            isinstance(k, type) and issubclass(k, Section)) else k.__name__
+        for k in kinds)
+
+
+def validate_value(value, kind, path, errors):
+    if isinstance(kind, ListOf):
+        if not isinstance(value, list):
+            errors.append("%s: expected a list, got %r" % (path, value))
+            return
+        for idx, item in enumerate(value):
+            validate_value(item, kind.kind, "%s[%d]" % (path, idx), errors)
+        return
+    kinds = kind if isinstance(kind, tuple) else (kind,)
+    for k in kinds:
+        if isinstance(k, type) and issubclass(k, Section):
+            if isinstance(value, dict):
+                k.validate(value, path, errors)
+                return
+        elif isinstance(value, k):
+            return
+    errors.append("%s: expected %s, got %r" % (
+        path, type_names(kind), value))
+
+
+def section(name, fields):
+    """Create a Section class from the {key: type} fields"""
+    return type(name, (Section,), {
+        "__slots__": (),
+        "fields": dict((key.replace("-", "_"), (key, kind))
+                       for key, kind in fields.items()),
+    })
+
+
+OptStr = Opt((str, NoneType))
+
+Network = section("Network", {
+    "smtp_relay": OptStr,
+    "ntp_main_server": OptStr,
+    "admin_mail_forward": OptStr,
+    "static_hostnames": Opt((list, NoneType)),
+    "koji_host": OptStr,
+    "disable_external_resources": bool,
+    "tls_cert_file": (str, NoneType),
+    "tls_chain_file": (str, NoneType),
+    "tls_key_file": (str, NoneType),
+})
+ConfigLocations = section("ConfigLocations", {
+    "config-repo": (str, NoneType),
+    "jobs-repo": (str, NoneType),
+    "strategy": Opt((dict, NoneType)),
+})
+SAML2 = section("SAML2", {
+    "disabled": bool,
+    "login_button_text": OptStr,
+    "key_delimiter": OptStr,
+    "mapping": dict,
+})
+Authentication = section("Authentication", {
+    "admin_password": str,
+    "sso_cookie_timeout": Opt(int),
+    "authenticated_only": Opt(bool),
+    "differentiate_usernames": Opt(bool),
+    "ldap": Opt(dict),
+    "active_directory": dict,
+    "oauth2": Opt(dict),
+    "openid": Opt(dict),
+    "openid_connect": Opt(dict),
+    "SAML2": SAML2,
+})
+Nodepool = section("Nodepool", {
+    "k1s_default_pods": Opt(bool),
+    "clouds_file": (str, NoneType),
+    "kube_file": (str, NoneType),
+    "providers": Opt((list, NoneType)),
+    "dib_reg_passwords": Opt((list, NoneType)),
+})
+HeapSizes = {
+    "maximum_heap_size": (str, int),
+    "minimum_heap_size": (str, int),
+}
+Elasticsearch = section("Elasticsearch", dict(HeapSizes, replicas=int))
+Logstash = section("Logstash", dict(HeapSizes, retention_days=int))
+RetentionPolicy = section("RetentionPolicy", {
+    "tenant": OptStr,
+    "project": OptStr,
+    "pipeline": OptStr,
+    "job": OptStr,
+    "result": OptStr,
+    "expiry": int,
+})
+Logs = section("Logs", {
+    "expiry": int,
+    "retention_policies": ListOf(RetentionPolicy),
+    "disk_high_watermark": int,
+    "disk_low_watermark": int,
+})
+Zuul = section("Zuul", {
+    "default_nodeset_name": str,
+    "default_nodeset_label": str,
+    "default_retry_attempts": int,
+    "periodic_pipeline_mail_rcpt": str,
+    "success_log_url": OptStr,
+    "failure_log_url": OptStr,
+    "ara_report": bool,
+    "github_gate_require_review": Opt(bool),
+    "prerelease_regexp": str,
+    "release_regexp": str,
+    "gerrit_connections": Opt((list, NoneType)),
+    "github_connections": Opt((list, NoneType)),
+    "pagure_connections": Opt((list, NoneType)),
+    "git_connections": (list, NoneType),
+    "upstream_zuul_jobs": bool,
+})
+Gerritbot = section("Gerritbot", {
+    "disabled": bool,
+    "ircserver": OptStr,
+    "ircport": Opt(int),
+    "botname": OptStr,
+    "password": OptStr,
+})
+Gerrit = section("Gerrit", {
+    "all_projects_config": (list, NoneType),
+})
+Config = section("Config", {
+    "schema_version": int,
+    "fqdn": str,
+    "default-tenant-name": str,
+    "debug": Opt(bool),
+    "welcome_page_path": OptStr,
+    "network": Network,
+    "tenant-deployment": (dict, NoneType),
+    "config-locations": ConfigLocations,
+    "authentication": Authentication,
+    "theme": Opt((dict, NoneType)),
+    "gateway_directories": (list, NoneType),
+    "mirrors": Opt((dict, NoneType)),
+    "nodepool": Nodepool,
+    "elasticsearch": Elasticsearch,
+    "logstash": Logstash,
+    "logs": Logs,
+    "zuul": Zuul,
+    "gerritbot": Opt(Gerritbot),
+    "mumble": Opt((dict, NoneType)),
+    "gerrit": Gerrit,
+})
+
+
+def validate(data):
+    """Return the list of all the configuration errors"""
+    errors = []
+    if not isinstance(data, dict):
+        return ["expected a mapping, got %r" % data]
+    Config.validate(data, "", errors)
+    return errors
+
+
+# Migrations
+class Default(object):
+    """Set a value when it is missing (or one of the empty values)"""
+    def __init__(self, path, value, empty=()):
+        self.path = path
+        self.value = value
+        self.empty = empty
+
+    def apply(self, data):
+        parent = data
+        for key in self.path[:-1]:
+            parent = parent.setdefault(key, {})
+        key = self.path[-1]
+        if key in parent and parent[key] not in self.empty:
+            return False
+        parent[key] = copy.deepcopy(self.value)
+        return True
+
+
+class Remove(object):
+    def __init__(self, path):
+        self.path = path
+
+    def apply(self, data):
+        parent = data
+        for key in self.path[:-1]:
+            parent = parent.get(key)
+            if not isinstance(parent, dict):
+                return False
+        return parent.pop(self.path[-1], self) is not self
+
+
+class Rename(object):
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+
+    def apply(self, data):
+        if self.old not in data:
+            return False
+        data[self.new] = data.pop(self.old)
+        return True
+
+
+class DefaultItems(object):
+    """Set a value in each item of a list when it is missing"""
+    def __init__(self, path, key, value):
+        self.path = path
+        self.key = key
+        self.value = value
+
+    def apply(self, data):
+        items = data
+        for key in self.path:
+            items = items.get(key) or {}
+        dirty = False
+        for item in items or []:
+            if self.key not in item:
+                item[self.key] = copy.deepcopy(self.value)
+                dirty = True
+        return dirty
+
+
+class Call(object):
+    """A migration that doesn't fit the declarative operations"""
+    def __init__(self, func):
+        self.func = func
+
+    def apply(self, data):
+        return self.func(data)
+
+
+def elasticsearch_heap_size(data):
+    # Apply the removed heap_size value to the new parameters
+    heap_size = data['elasticsearch'].pop('heap_size', None)
+    if heap_size is None:
+        return False
+    for key in ('maximum_heap_size', 'minimum_heap_size'):
+        data['elasticsearch'].setdefault(key, heap_size)
+    return True
+
+
+def default_nodeset(data):
+    if "default_nodeset_name" in data["zuul"]:
+        return False
+    data["zuul"]["default_nodeset_name"] = "container"
+    data["zuul"]["default_nodeset_label"] = "centos-oci"
+    return True
+
+
+# The logs settings removed in 2.7
+LEGACY_LOGS_KEYS = (
+    "disabled", "container", "logserver_prefix", "authurl", "x_storage_url",
+    "username", "password", "tenantname", "authversion", "x_tempurl_key",
+    "send_tempurl_key")
+
+# The migrations by schema version, a configuration without schema_version
+# gets every migration
+MIGRATIONS = [
+    (1, [
+        # 2.6.0: expose elasticsearch config
+        # 3.3.0: update elasticsearch config
+        Default(('elasticsearch', 'replicas'), 0),
+        Call(elasticsearch_heap_size),
+        Default(('elasticsearch', 'maximum_heap_size'), '512m'),
+        Default(('elasticsearch', 'minimum_heap_size'), '512m'),
+        # 2.6.0: expose logstash config
+        # 3.3.0: update logstash config
+        Default(('logstash', 'retention_days'), 60),
+        Default(('logstash', 'maximum_heap_size'), '128m'),
+        Default(('logstash', 'minimum_heap_size'), '128m'),
+        Default(('network', 'disable_external_resources'), False),
+        # 3.3.0: update gateway_directories default value
+        Default(('gateway_directories',), [], empty=('',)),
+        # 2.7.0: remove useless backup config section
+        Remove(('backup',)),
+        # 3.0: rename (zuul|nodepool)3 without suffix
+        Rename('zuul3', 'zuul'),
+        Rename('nodepool3', 'nodepool'),
+        # 2.7: refactor logs settings
+    ] + [Remove(('logs', key)) for key in LEGACY_LOGS_KEYS] + [
+        Remove(('logs', "swift_logsexport_%s" % key))
+        for key in LEGACY_LOGS_KEYS] + [
+        Default(('logs', 'expiry'), 60),
+        Default(('zuul', 'upstream_zuul_jobs'), False),
+        Call(default_nodeset),
+        DefaultItems(('zuul', 'github_connections'), 'app_key', None),
+        Default(('zuul', 'periodic_pipeline_mail_rcpt'), "root@localhost"),
+        Default(('zuul', 'prerelease_regexp'),
+                r'([0-9]+)\.([0-9]+)\.([0-9]+)'
+                r'(?:-([0-9alpha|beta|rc.-]+))?(?:\+([0-9a-zA-Z.-]+))?'),
+        Default(('zuul', 'release_regexp'),
+                r'([0-9]+)\.([0-9]+)\.([0-9]+)'
+                r'(?:-([0-9a-zA-Z.-]+))?(?:\+([0-9a-zA-Z.-]+))?'),
+        Default(('authentication', 'active_directory'), {
+            "disabled": True,
+            "ldap_url": "ldap://sftests.com",
+            "ldap_account_domain": "domain.sftests.com",
+            "ldap_account_base": "ou=Users,dc=domain,dc=sftests,dc=com",
+            "ldap_account_username_attribute": "sAMAccountName",
+            "ldap_account_mail_attribute": "mail",
+            "ldap_account_surname_attribute": "name",
+        }),
+        Default(('zuul', 'default_retry_attempts'), 3),
+        Remove(('authentication', 'allowed_proxy_prefixes')),
+        Default(('zuul', 'git_connections'), []),
+        # 3.1: add SAML2 default auth values
+        Default(('authentication', 'SAML2'), {
+            'disabled': True,
+            'login_button_text': 'Replace me with a SAML login prompt',
+            'key_delimiter': ';',
+            'mapping': {
+                'login': 'urn:oid:2.5.4.42',
+                'email': 'urn:oid:1.2.840.113549.1.9.1',
+                'name': 'urn:oid:2.5.4.42',
+                'uid': 'uid',
+                'ssh_keys': None,
+                'groups': None,
+            },
+        }),
+        # 3.3: add SAML2 groups values
+        Default(('authentication', 'SAML2', 'mapping', 'groups'), None),
+        Default(('config-locations',), {
+            'config-repo': '', 'jobs-repo': '',
+            'strategy': {'sync': 'push', 'user': 'git'}}),
+        Default(('tenant-deployment',), {}),
+        Default(('nodepool', 'clouds_file'), None),
+        Default(('nodepool', 'kube_file'), None),
+        Default(('default-tenant-name',), "local"),
+        Default(('network', 'tls_cert_file'), ""),
+        Default(('network', 'tls_chain_file'), ""),
+        Default(('network', 'tls_key_file'), ""),
+        Default(('zuul', 'ara_report'), True),
+        Default(('gerrit',), {
+            "all_projects_config": [{
+                'name': 'plugin.reviewers-by-blame.maxReviewers',
+                'value': '5'
+            }, {
+                'name': 'plugin.reviewers-by-blame.ignoreDrafts',
+                'value': 'true'
+            }, {
+                'name': 'plugin.reviewers-by-blame.ignoreSubjectRegEx',
+                'value': "'(WIP|DNM)(.*)'"
+            }]
+        }),
+    ]),
+    (2, [
+        Default(('logs', 'retention_policies'), []),
+        Default(('logs', 'disk_high_watermark'), 0),
+        Default(('logs', 'disk_low_watermark'), 80),
+    ]),
+]
+
+
+def migrate(data):
+    """Apply the migrations newer than the schema version
+
+    Return True when the configuration changed, besides the schema version.
+    """
+    version = data.get("schema_version", 0)
+    dirty = False
+    for migration_version, operations in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        for operation in operations:
+            if operation.apply(data):
+                dirty = True
+    data["schema_version"] = SCHEMA_VERSION
+    return dirty
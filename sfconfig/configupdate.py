@@ -0,0 +1,241 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Run the sf_configrepo_update playbook for the roles affected by the config
+# repository changes since the last successful update.
+
+import argparse
+import fcntl
+import glob
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from sfconfig.groupvars import vars_path
+from sfconfig.utils import write_file
+from sfconfig.utils import yaml_dump
+from sfconfig.utils import yaml_load
+
+# The config repository directories read by each role update task
+ROLE_PATHS = {
+    "managesf": ("resources/", "policies/"),
+    "gerrit": ("gerrit/",),
+    "gerritbot": ("gerritbot/",),
+    "gateway": ("dashboards/", "resources/"),
+    "mirror": ("mirrors/",),
+    "repoxplorer": ("repoxplorer/", "resources/"),
+    "zuul": ("zuul/", "resources/"),
+    "nodepool": ("nodepool/",),
+    "grafana": ("metrics/",),
+    "hound": ("resources/",),
+    "dlrn": ("dlrn/",),
+    "cgit": ("resources/",),
+    "cauth": ("resources/",),
+    "hypervisor-k1s": ("containers/",),
+}
+# The zuul in-repo configuration, loaded by zuul itself
+ZUUL_PATHS = ("zuul.d/", "playbooks/", "roles/", ".zuul.yaml", "zuul.yaml")
+# Files without effect on the deployment
+IGNORED_PATHS = ("README",)
+
+CONFIG_REPO = "/root/config"
+STATE_PATH = "/var/lib/software-factory/state/configrepo_update"
+LOCAL_PATCH = "/var/lib/software-factory/git/config.patch"
+# The sfconfig and config update runs are serialized with this lock
+LOCK_PATH = "/var/lib/software-factory/state/ansible.lock"
+QUEUE_DIR = "/var/lib/software-factory/state/configrepo_update.queue"
+METRICS_PATH = "/var/lib/software-factory/state/configrepo_update.metrics"
+
+
+def git(config_repo, *argv):
+    """Return the output of a git command, or None when it failed"""
+    proc = subprocess.Popen(["git"] + list(argv), cwd=config_repo,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    stdout, _ = proc.communicate()
+    if proc.returncode:
+        return None
+    return stdout.strip()
+
+
+def changed_paths(config_repo, base, target):
+    """Return the paths changed between two commits, or None if unknown"""
+    if not base or git(config_repo, "fetch", "--all") is None:
+        return None
+    diff = git(config_repo, "diff", "--name-only", base, target)
+    if diff is None:
+        return None
+    return diff.split("\n") if diff else []
+
+
+def affected_roles(paths):
+    """Return the roles to update, or None when every role is affected"""
+    if paths is None:
+        return None
+    roles = set()
+    for path in paths:
+        if path.startswith(ZUUL_PATHS) or \
+           os.path.basename(path) in IGNORED_PATHS:
+            continue
+        path_roles = [role for role, prefixes in ROLE_PATHS.items()
+                      if path.startswith(prefixes)]
+        if not path_roles:
+            print("[+] %s is not used by a known role, updating all roles" %
+                  path)
+            return None
+        roles.update(path_roles)
+    return roles
+
+
+def filter_playbook(playbook, roles):
+    """Remove the update of the roles that are not affected"""
+    plays = []
+    for play in playbook:
+        if play.get("vars", {}).get("role_action") != "update":
+            plays.append(play)
+            continue
+        play = dict(play)
+        play["roles"] = [role for role in play.get("roles", [])
+                         if role[3:] in roles]
+        if play["roles"] or play.get("tasks"):
+            plays.append(play)
+    return plays
+
+
+def enqueue(commit):
+    """Add an update request to the queue"""
+    if not os.path.isdir(QUEUE_DIR):
+        os.makedirs(QUEUE_DIR, 0o700)
+    entry = os.path.join(QUEUE_DIR, "%020d-%d" % (
+        int(time.time() * 1e6), os.getpid()))
+    write_file(entry, "%s\n" % (commit or ""))
+    return entry
+
+
+def pending():
+    """Return the queued update requests, oldest first"""
+    return sorted(path for path in glob.glob(os.path.join(QUEUE_DIR, "*-*"))
+                  if not path.endswith(".tmp"))
+
+
+def statsd_address(args):
+    """Return the statsd host and port of the deployment, if any"""
+    glue = yaml_load(vars_path(args)) or {}
+    host = glue.get("statsd_host", glue.get("influxdb_host"))
+    if not host or "influxdb" not in glue.get("roles", []):
+        return None
+    return host, int(glue.get("statsd_port", 8125))
+
+
+def report_metrics(args, metrics):
+    """Append the metrics to the history and send them to statsd"""
+    with open(METRICS_PATH, "a") as of:
+        of.write(json.dumps(metrics) + "\n")
+    address = statsd_address(args)
+    if not address:
+        return
+    lines = [
+        "sf.configrepo_update.queue_depth:%d|g" % metrics["queue_depth"],
+        "sf.configrepo_update.coalesced:%d|c" % (metrics["queue_depth"] - 1),
+        "sf.configrepo_update.wait:%d|ms" % (metrics["wait"] * 1000),
+        "sf.configrepo_update.duration:%d|ms" % (metrics["duration"] * 1000),
+    ]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.sendto("\n".join(lines).encode("utf-8"), address)
+    except (OSError, socket.error) as e:
+        print("[+] Couldn't send the metrics to %s:%d: %s" % (
+            address[0], address[1], e))
+    finally:
+        sock.close()
+
+
+def update(args, target):
+    """Run the config update playbook against the target commit"""
+    playbook_path = "%s/sf_configrepo_update.yml" % args.ansible_root
+    base = None
+    if not args.full and os.path.isfile(STATE_PATH):
+        base = open(STATE_PATH).read().strip()
+    if os.path.isfile(LOCAL_PATCH) and os.stat(LOCAL_PATCH).st_size:
+        # The local patch content is applied on top of the commit
+        base = None
+
+    roles = affected_roles(changed_paths(
+        args.config_repo, base, target or "origin/master"))
+    if roles is not None:
+        print("[+] Updating roles: %s" % (" ".join(sorted(roles)) or "none"))
+        fast_path = "%s/sf_configrepo_update_fast.yml" % args.ansible_root
+        write_file(fast_path, yaml_dump(
+            filter_playbook(yaml_load(playbook_path), roles)))
+        playbook_path = fast_path
+    sys.stdout.flush()
+
+    # The reset_config_repo task resets the config repo to ZUUL_COMMIT
+    os.environ["ZUUL_COMMIT"] = target
+    os.environ["ANSIBLE_CONFIG"] = "%s/ansible.cfg" % args.ansible_root
+    rc = subprocess.call(["ansible-playbook", "-v", playbook_path])
+    if rc == 0:
+        # Record the applied commit for the next update
+        head = git(args.config_repo, "rev-parse", "HEAD")
+        if head:
+            write_file(STATE_PATH, head + "\n")
+    return rc
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description="Update the services from the config repository")
+    p.add_argument("--ansible_root",
+                   default="/var/lib/software-factory/ansible")
+    p.add_argument("--config-repo", default=CONFIG_REPO)
+    p.add_argument("--commit", default=os.environ.get("ZUUL_COMMIT"),
+                   help="The config commit, default to the ZUUL_COMMIT "
+                        "environment variable or origin/master")
+    p.add_argument("--full", action="store_true",
+                   help="Update every role")
+    args = p.parse_args(argv)
+    args.root = None
+
+    # Queue the request, the run holding the lock applies every request
+    # queued before it started
+    entry = enqueue(args.commit)
+    begin = time.monotonic()
+    with open(LOCK_PATH, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        wait = time.monotonic() - begin
+        if not os.path.isfile(entry):
+            print("[+] The update was applied by a coalesced run")
+            return 0
+        entries = pending()
+        target = open(entries[-1]).read().strip()
+        if len(entries) > 1:
+            print("[+] Coalescing %d queued updates, updating to %s" % (
+                len(entries), target or "origin/master"))
+        rc = update(args, target)
+        # Keep the other requests in the queue when the update failed
+        for path in (entries if rc == 0 else [entry]):
+            os.unlink(path)
+        report_metrics(args, {
+            "date": time.strftime("%Y%m%d-%H%M%S"),
+            "commit": target,
+            "queue_depth": len(entries),
+            "wait": wait,
+            "duration": time.monotonic() - begin - wait,
+            "rc": rc})
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main())
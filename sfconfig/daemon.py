@@ -0,0 +1,365 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# A long-lived sfconfig service that keeps the components and the parsed
+# files in memory and runs the operational tasks requested on a local unix
+# socket HTTP API:
+#
+#   GET  /runs             list the runs
+#   POST /runs             queue a run: {"action": "apply", "args": [...]}
+#   GET  /runs/<id>        get a run status
+#   GET  /runs/<id>/log    stream a run output until it is finished
+
+import argparse
+import collections
+import http.client
+import http.server
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import sfconfig.cmd
+import sfconfig.configupdate
+import sfconfig.profile
+import sfconfig.utils
+
+SOCKET_PATH = "/var/run/sfconfig/sfconfig.sock"
+LOGS_DIR = "/var/log/software-factory/sfconfig-daemon"
+ANSIBLE_ROOT = "/var/lib/software-factory/ansible"
+# The generated configuration with the sfconfig inventory and roles path
+ANSIBLE_CONFIG = "%s/ansible.cfg" % ANSIBLE_ROOT
+LOCK_PATH = "/var/lib/software-factory/state/ansible.lock"
+# The number of queued runs before rejecting new requests
+MAX_QUEUED = 32
+# The number of finished runs kept in memory
+MAX_FINISHED = 100
+
+
+def run_playbook(name):
+    def run(daemon, argv):
+        os.environ["ANSIBLE_CONFIG"] = ANSIBLE_CONFIG
+        sfconfig.utils.execute([
+            "flock", LOCK_PATH, "ansible-playbook", "-v"] + argv + [
+            "%s/%s.yml" % (ANSIBLE_ROOT, name)])
+    return run
+
+
+def run_sfconfig(extra_argv):
+    def run(daemon, argv):
+        if daemon.components is None or daemon.components.stale():
+            daemon.components = sfconfig.utils.load_components(daemon.share)
+        sys.argv = ["sfconfig", "--share", daemon.share] + extra_argv + argv
+        sfconfig.profile.records = None
+        sfconfig.cmd.main(daemon.components)
+    return run
+
+
+def run_config_update(daemon, argv):
+    os.environ["ANSIBLE_CONFIG"] = ANSIBLE_CONFIG
+    rc = sfconfig.configupdate.main(argv)
+    if rc:
+        raise RuntimeError("Config update failed (%d)" % rc)
+
+
+ACTIONS = {
+    "generate": run_sfconfig(["--skip-apply"]),
+    "apply": run_sfconfig([]),
+    "config-update": run_config_update,
+    "tenant-update": run_playbook("sf_tenant_update"),
+    "backup": run_playbook("sf_backup"),
+}
+# The actions only depending on the latest state, a new request replaces the
+# arguments of a queued one
+LATEST_ACTIONS = ("config-update", "tenant-update")
+
+
+class Run(object):
+    def __init__(self, uid, action, argv):
+        self.uid = uid
+        self.action = action
+        self.argv = argv
+        self.state = "queued"
+        self.coalesced = 0
+        self.queued = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.log = os.path.join(LOGS_DIR, "%s-%s.log" % (uid, action))
+
+    def to_dict(self):
+        return dict((key, getattr(self, key)) for key in (
+            "uid", "action", "argv", "state", "coalesced", "queued",
+            "started", "finished", "error", "log"))
+
+
+class Daemon(object):
+    """Queue the requested runs and execute them one at a time"""
+    def __init__(self, share):
+        self.share = share
+        self.components = sfconfig.utils.load_components(share)
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.runs = collections.OrderedDict()
+        self.count = 0
+
+    def submit(self, action, argv):
+        """Queue a run, or return the queued run it coalesces into"""
+        if action not in ACTIONS:
+            raise ValueError("Unknown action %s" % action)
+        with self.lock:
+            for run in self.runs.values():
+                if run.state != "queued" or run.action != action:
+                    continue
+                if run.argv == argv or action in LATEST_ACTIONS:
+                    run.argv = argv
+                    run.coalesced += 1
+                    return run
+            if self.queue.qsize() >= MAX_QUEUED:
+                raise OverflowError("Too many queued runs")
+            self.count += 1
+            run = Run("%s-%04d" % (time.strftime("%Y%m%d-%H%M%S"),
+                                   self.count), action, argv)
+            self.runs[run.uid] = run
+            finished = [uid for uid, old in self.runs.items()
+                        if old.finished]
+            for uid in finished[:-MAX_FINISHED]:
+                del self.runs[uid]
+        self.queue.put(run)
+        return run
+
+    def execute(self, run):
+        """Execute a run with its output redirected to the run log"""
+        environ = dict(os.environ)
+        argv = list(sys.argv)
+        cwd = os.getcwd()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved = [os.dup(1), os.dup(2)]
+        log = os.open(run.log, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        try:
+            os.dup2(log, 1)
+            os.dup2(log, 2)
+            ACTIONS[run.action](self, run.argv)
+            run.state = "success"
+        except SystemExit as e:
+            run.state = "success" if not e.code else "failure"
+            if e.code:
+                run.error = "Exit code %s" % e.code
+        except Exception as e:
+            run.state = "failure"
+            run.error = str(e)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            for fd in saved + [log]:
+                os.close(fd)
+            os.environ.clear()
+            os.environ.update(environ)
+            sys.argv = argv
+            os.chdir(cwd)
+
+    def worker(self):
+        while True:
+            run = self.queue.get()
+            with self.lock:
+                run.state = "running"
+                run.started = time.time()
+            print("[%s] Running %s %s" % (time.ctime(), run.action,
+                                          " ".join(run.argv)))
+            self.execute(run)
+            run.finished = time.time()
+            print("[%s] %s %s: %s" % (time.ctime(), run.uid, run.action,
+                                      run.state))
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    def address_string(self):
+        return "local"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def reply(self, code, body):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def get_run(self, uid):
+        run = self.server.daemon.runs.get(uid)
+        if not run:
+            self.reply(404, {"error": "Unknown run %s" % uid})
+        return run
+
+    def do_GET(self):
+        path = self.path.strip("/").split("/")
+        if path == ["runs"]:
+            self.reply(200, [run.to_dict() for run in
+                             list(self.server.daemon.runs.values())])
+        elif len(path) == 2 and path[0] == "runs":
+            run = self.get_run(path[1])
+            if run:
+                self.reply(200, run.to_dict())
+        elif len(path) == 3 and path[0] == "runs" and path[2] == "log":
+            run = self.get_run(path[1])
+            if run:
+                self.stream_log(run)
+        else:
+            self.reply(404, {"error": "Unknown path %s" % self.path})
+
+    def stream_log(self, run):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.end_headers()
+        while not os.path.isfile(run.log):
+            if run.finished:
+                return
+            time.sleep(0.5)
+        with open(run.log, "rb") as log:
+            while True:
+                finished = run.finished
+                chunk = log.read(65536)
+                if chunk:
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+                elif finished:
+                    return
+                else:
+                    time.sleep(0.5)
+
+    def do_POST(self):
+        if self.path.strip("/") != "runs":
+            return self.reply(404, {"error": "Unknown path %s" % self.path})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8"))
+            argv = [str(arg) for arg in request.get("args", [])]
+            run = self.server.daemon.submit(request.get("action"), argv)
+        except (ValueError, AttributeError) as e:
+            return self.reply(400, {"error": str(e)})
+        except OverflowError as e:
+            return self.reply(429, {"error": str(e)})
+        self.reply(202, run.to_dict())
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        http.client.HTTPConnection.__init__(self, "localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def request(socket_path, method, path, body=None):
+    conn = UnixHTTPConnection(socket_path)
+    conn.request(method, path, body=body and json.dumps(body),
+                 headers={"Content-Type": "application/json"})
+    return conn.getresponse()
+
+
+def serve(args):
+    for dirname in (os.path.dirname(args.socket), LOGS_DIR):
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, 0o700)
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    # The socket is only reachable by root from its creation
+    umask = os.umask(0o177)
+    try:
+        server = Server(args.socket, RequestHandler)
+    finally:
+        os.umask(umask)
+    server.daemon = Daemon(args.share)
+    worker = threading.Thread(target=server.daemon.worker)
+    worker.daemon = True
+    worker.start()
+    print("[%s] Listening on %s" % (time.ctime(), args.socket))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    finally:
+        os.unlink(args.socket)
+
+
+def submit(args):
+    resp = request(args.socket, "POST", "/runs",
+                   {"action": args.action, "args": args.args})
+    run = json.loads(resp.read().decode("utf-8"))
+    if resp.status != 202:
+        sfconfig.utils.fail(run["error"])
+    if run["coalesced"]:
+        print("Coalesced into the queued run %s" % run["uid"])
+    else:
+        print("Queued run %s" % run["uid"])
+    if not args.follow:
+        return
+    resp = request(args.socket, "GET", "/runs/%s/log" % run["uid"])
+    for chunk in iter(lambda: resp.read1(65536), b""):
+        sys.stdout.buffer.write(chunk)
+        sys.stdout.flush()
+    resp = request(args.socket, "GET", "/runs/%s" % run["uid"])
+    run = json.loads(resp.read().decode("utf-8"))
+    print("%s: %s" % (run["uid"], run["state"]))
+    if run["state"] != "success":
+        exit(1)
+
+
+def status(args):
+    resp = request(args.socket, "GET", "/runs")
+    for run in json.loads(resp.read().decode("utf-8")):
+        print("%-20s %-14s %-8s %s" % (run["uid"], run["action"],
+                                       run["state"], " ".join(run["argv"])))
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description="Run the sfconfig tasks from a long-lived service")
+    p.add_argument("--socket", default=SOCKET_PATH)
+    sub = p.add_subparsers(dest="command")
+    serve_parser = sub.add_parser("serve", help="Start the service")
+    serve_parser.add_argument("--share", default="/usr/share/sf-config")
+    submit_parser = sub.add_parser("submit", help="Request a run")
+    submit_parser.add_argument("action", choices=sorted(ACTIONS))
+    submit_parser.add_argument("args", nargs=argparse.REMAINDER,
+                               help="The action arguments")
+    submit_parser.add_argument("--follow", action="store_true",
+                               help="Stream the run output")
+    sub.add_parser("status", help="List the runs")
+    args = p.parse_args()
+
+    if args.command == "serve":
+        serve(args)
+    elif args.command == "submit":
+        submit(args)
+    elif args.command == "status":
+        status(args)
+    else:
+        p.print_help()
+
+
+if __name__ == "__main__":
+    main()
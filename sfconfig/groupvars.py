@@ -10,24 +10,154 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import glob
+import os
+import pickle
 import uuid
 
+from sfconfig.inventory import base_role
+from sfconfig.rolegraph import TOKEN_RE
+from sfconfig.rolegraph import read_file
+from sfconfig.rolegraph import role_dependencies
+from sfconfig.rolegraph import role_tokens
+from sfconfig.utils import write_file
 from sfconfig.utils import yaml_dump
 from sfconfig.utils import yaml_load
 
+# The roles that run on every host
+COMMON_ROLES = ("base", "postfix", "repos", "ssh", "upgrade")
+
+
+def defaults_cache_path(args):
+    return "%s/defaults.cache" % args.ansible_root
+
+
+def is_secret(value):
+    return str(value).strip().replace('"', '') == 'CHANGE_ME'
+
+
+def load_defaults(args, roles):
+    """Return the merged roles defaults and the CHANGE_ME variable names
+
+    The parsed defaults are cached and a defaults file is only loaded again
+    when its mtime or size changed.
+    """
+    try:
+        with open(defaults_cache_path(args), "rb") as f:
+            cache = pickle.load(f)
+    except Exception:
+        cache = {}
+    cached_files = cache.get("files", {})
+    files = {}
+    for role in roles:
+        path = "%s/ansible/roles/sf-%s/defaults/main.yml" % (args.share, role)
+        try:
+            st = os.stat(path)
+            stat = (st.st_mtime, st.st_size)
+        except OSError:
+            stat = None
+        entry = cached_files.get(path)
+        if not entry or entry["stat"] != stat:
+            role_vars = yaml_load(path) if stat else {}
+            entry = {'stat': stat, 'vars': role_vars,
+                     'secrets': [key for key, value in role_vars.items()
+                                 if is_secret(value)]}
+        files[path] = entry
+
+    if cache.get("roles") == roles and files == cached_files:
+        return cache["defaults"], cache["secrets"]
+
+    defaults, secrets = {}, []
+    for entry in files.values():
+        defaults.update(entry["vars"])
+        secrets.extend(entry["secrets"])
+    write_file(defaults_cache_path(args), pickle.dumps(
+        {'roles': roles, 'files': files, 'defaults': defaults,
+         'secrets': secrets}, pickle.HIGHEST_PROTOCOL))
+    return defaults, secrets
+
+
+def split_vars_path(args):
+    return "%s/sfconfig-vars.yaml" % args.ansible_root
+
+
+def vars_path(args):
+    """Return the file with all the variables of the last run"""
+    if os.path.isfile(split_vars_path(args)):
+        return split_vars_path(args)
+    return "%s/group_vars/all.yaml" % args.ansible_root
+
+
+def group_tokens(args, group):
+    """Return the identifiers used by a group role and its dependencies"""
+    tokens = set()
+    todo, done = [base_role(group)], set()
+    while todo:
+        role = todo.pop()
+        done.add(role)
+        tokens.update(role_tokens(args.share, role))
+        todo.extend(set(role_dependencies(args.share, role)) - done)
+    return tokens
+
+
+def split(args):
+    """Return the variables of every inventory group
+
+    A variable is only written to the groups of the roles using it, unless
+    it is used by a common role or the generated playbooks, or is not used
+    by any known role (e.g. it is looked up dynamically).
+    """
+    common = set()
+    for role in COMMON_ROLES:
+        common.update(group_tokens(args, role))
+    for playbook in glob.glob("%s/*.yml" % args.ansible_root):
+        common.update(TOKEN_RE.findall(read_file(playbook)))
+    groups = dict((group, group_tokens(args, group))
+                  for group in args.glue["roles"])
+
+    result = {'all': {}}
+    for key, value in args.glue.items():
+        users = [group for group, tokens in groups.items() if key in tokens]
+        if key in common or not users:
+            result['all'][key] = value
+            continue
+        for group in users:
+            result.setdefault(group, {})[key] = value
+    return result
+
+
+def write(args):
+    """Write the group_vars files, only when their content changed"""
+    group_vars_dir = "%s/group_vars" % args.ansible_root
+    # The group_vars files written by the previous --split-group-vars run
+    previous = (yaml_load(split_vars_path(args)) or {}).get(
+        "sfconfig_split_group_vars", [])
+    if args.split_group_vars:
+        files = dict(("%s/%s.yaml" % (group_vars_dir, group), content)
+                     for group, content in split(args).items())
+        names = sorted(os.path.basename(path) for path in files)
+        files[split_vars_path(args)] = dict(
+            args.glue, sfconfig_split_group_vars=names)
+    else:
+        files = {"%s/all.yaml" % group_vars_dir: args.glue}
+    for path, content in sorted(files.items()):
+        if write_file(path, yaml_dump(content)):
+            print("[+] Wrote %s" % path)
+
+    # Remove the files of the previous split run, other files are kept
+    for path in ["%s/%s" % (group_vars_dir, name) for name in previous] + [
+            split_vars_path(args)]:
+        if path not in files and os.path.isfile(path):
+            os.unlink(path)
+
 
 def load(args):
     """Load roles defaults and generate CHANGE_ME secrets"""
     # Generate all variable when the value is CHANGE_ME and collect defaults
-    args.defaults = {}
-    for role in args.glue["roles"]:
-        role_vars = yaml_load("%s/ansible/roles/sf-%s/defaults/main.yml" % (
-                              args.share, role))
-        args.defaults.update(role_vars)
-        for key, value in role_vars.items():
-            if str(value).strip().replace('"', '') == 'CHANGE_ME':
-                if key not in args.secrets:
-                    args.secrets[key] = str(uuid.uuid4())
+    args.defaults, secrets = load_defaults(args, list(args.glue["roles"]))
+    for key in secrets:
+        if key not in args.secrets:
+            args.secrets[key] = str(uuid.uuid4())
 
     # Set default glue
     args.glue["gateway_url"] = "https://%s" % args.sfconfig["fqdn"]
@@ -39,5 +169,5 @@ def load(args):
 
     # Save secrets to new secrets file
     if not args.skip_setup:
-        yaml_dump(args.secrets, open("%s/secrets.yaml" % args.lib, "w"))
+        write_file("%s/secrets.yaml" % args.lib, yaml_dump(args.secrets))
     args.glue.update(args.secrets)
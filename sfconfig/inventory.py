@@ -12,27 +12,64 @@
 
 import configparser
 import copy
+import glob
+import hashlib
+import importlib.util
+import io
 import os
-import yaml
+import resource
+import shutil
 
+from jinja2 import ChoiceLoader
+from jinja2 import FileSystemBytecodeCache
 from jinja2 import FileSystemLoader
+from jinja2 import ModuleLoader
 from jinja2.environment import Environment
 
+import sfconfig.manifest
+import sfconfig.profile
 import sfconfig.utils
 
+# Ansible execution profiles selected with sfconfig --ansible-profile
+ANSIBLE_PROFILES = ("default", "fast", "mitogen")
+# The fast profile forks settings
+FORKS_MAX = 100
+FDS_PER_FORK = 16
+# ssh ControlPersist settings, %C is a 40 characters hash and ssh adds a
+# 17 characters suffix to the socket path while creating the master
+CONTROL_PERSIST = "300s"
+CONTROL_PATH_HASH_LEN = 40 + 17
+UNIX_PATH_MAX = 107
+
+# Roles such as zuul-merger are in fact the zuul role with the zuul_services
+# argument set to "zuul-merger"
+META_ROLES = (
+    ("nodepool", ["launcher", "builder"]),
+    ("zuul", ["scheduler", "merger", "executor", "web"]),
+)
+
 
 def write_playbook(playbook_path, playbook):
-    if os.path.exists(playbook_path):
-        current = open(playbook_path).read()
-    else:
-        current = ""
-    new = yaml.safe_dump(playbook, default_flow_style=False)
-    if new != current:
-        with open(playbook_path, "w") as out:
-            out.write(new)
+    if sfconfig.utils.write_file(playbook_path,
+                                 sfconfig.utils.yaml_dump(playbook)):
         print("[+] Wrote %s" % playbook_path)
 
 
+def base_role(role):
+    """Return the playbook role of a service role such as zuul-merger"""
+    for role_name, services in META_ROLES:
+        if role in ["%s-%s" % (role_name, service) for service in services]:
+            return role_name
+    return role
+
+
+def limit_roles(args, roles):
+    """Filter out the roles that are not affected by the change"""
+    if getattr(args, "limit_roles", None) is None:
+        return roles
+    return [role for role in roles if base_role(role) in args.limit_roles]
+
+
 def notify_journald(msg):
     return {'name': 'Signal journald', 'command': 'logger sfconfig %s' % msg}
 
@@ -60,14 +97,46 @@ def host_play(host, roles=[], params={}, tasks=[]):
     return host_play
 
 
+def hosts_plays(hosts_roles, params={}, skip_empty=False):
+    """Generate host plays, grouping the hosts running the same roles
+
+    Consecutive hosts with the same roles and the same role parameters
+    don't depend on each other, they are configured in a single play using
+    the free strategy so that the play is bounded by the slowest host. The
+    plays keep the arch.yaml hosts order.
+    """
+    groups = []
+    for host, roles in hosts_roles:
+        if skip_empty and not roles:
+            continue
+        # host_public_url is a host variable set in the inventory
+        host_params = dict((k, v) for k, v in host.get('params', {}).items()
+                           if k != 'host_public_url')
+        if groups and groups[-1]['roles'] == roles and \
+           groups[-1]['params'] == host_params:
+            groups[-1]['hosts'].append(host['hostname'])
+        else:
+            groups.append({'hosts': [host['hostname']], 'roles': roles,
+                           'params': host_params})
+
+    plays = []
+    for group in groups:
+        play = host_play({'hostname': ':'.join(group['hosts']),
+                          'params': group['params']}, group['roles'], params)
+        if len(group['hosts']) > 1:
+            play['strategy'] = 'free'
+        plays.append(play)
+    return plays
+
+
 def disable(args, pb):
     action = {'role_action': 'disable', 'erase': False}
 
     # Disable all but mysql and install-server
-    for host in args.inventory:
-        host_roles = [role for role in host["roles"] if
-                      role not in ("mysql", "install-server")]
-        pb.append(host_play(host, host_roles, action))
+    pb.extend(hosts_plays([
+        (host, [role for role in host["roles"] if
+                role not in ("mysql", "install-server")])
+        for host in args.inventory], action))
 
     # Then disable mysql and install-server
     pb.append(host_play('mysql', 'mysql', action))
@@ -93,10 +162,10 @@ def erase(args, pb):
                  'erase_prompt.user_input != fqdn']}))
 
     # Erase all but mysql and install-server
-    for host in args.inventory:
-        host_roles = [role for role in host["roles"] if
-                      role not in ("mysql", "install-server")]
-        pb.append(host_play(host, host_roles, action))
+    pb.extend(hosts_plays([
+        (host, [role for role in host["roles"] if
+                role not in ("mysql", "install-server")])
+        for host in args.inventory], action))
 
     # Then erase mysql and install-server
     pb.append(host_play('mysql', 'mysql', action))
@@ -120,9 +189,8 @@ def disable_action(args):
 
 def update(args, pb):
     # Ensure mirrors are set before upgrade
-    for host in args.inventory:
-        pb.append(host_play(host, host["roles"],
-                            {'role_action': 'configure_mirror'}))
+    pb.extend(hosts_plays([(host, host["roles"]) for host in args.inventory],
+                          {'role_action': 'configure_mirror'}))
 
     # Apply upgrade role on all hosts to update packages
     pb.append(host_play('all', 'upgrade'))
@@ -133,9 +201,11 @@ def update(args, pb):
 
 def install(args, pb):
     action = {'role_action': 'install'}
-    pb.append(host_play('all', 'base', action))
-    for host in args.inventory:
-        pb.append(host_play(host, host['roles'], action))
+    if limit_roles(args, ['base']):
+        pb.append(host_play('all', 'base', action))
+    pb.extend(hosts_plays([(host, limit_roles(args, host['roles']))
+                           for host in args.inventory], action,
+                          skip_empty=True))
 
 
 def recover(args, pb):
@@ -181,30 +251,40 @@ def recover(args, pb):
 def setup(args, pb):
     action = {'role_action': 'setup'}
     # Setup install-server ssh keys
-    pb.append(host_play('install-server', 'ssh', action))
+    if limit_roles(args, ['ssh']):
+        pb.append(host_play('install-server', 'ssh', action))
 
     # Setup base role on all hosts
+    local_hosts, remote_hosts = [], []
     for host in args.inventory:
-        roles_action = {'role_action': 'setup', 'manage_etc_hosts': True}
-        host_roles = ["postfix", "base"]
         if host.get("remote", False):
             # This host is running on isolated network
-            host_roles = ["base"]
-            roles_action['manage_etc_hosts'] = False
-        pb.append(host_play(host, host_roles, roles_action))
+            remote_hosts.append((host, limit_roles(args, ["base"])))
+        else:
+            local_hosts.append((host, limit_roles(args, ["postfix", "base"])))
+    pb.extend(hosts_plays(local_hosts, {'role_action': 'setup',
+                                        'manage_etc_hosts': True},
+                          skip_empty=True))
+    pb.extend(hosts_plays(remote_hosts, {'role_action': 'setup',
+                                         'manage_etc_hosts': False},
+                          skip_empty=True))
 
     # Setup infra role firsts
     pre_roles = ("mysql",
                  "cauth", "keycloak",
                  "gateway", "hypervisor-openshift")
-    for role in pre_roles:
+    for role in limit_roles(args, pre_roles):
         if role in args.glue["roles"]:
             pb.append(host_play(role, role, action))
 
     # Setup all components except infra roles
-    for host in args.inventory:
-        host_roles = [role for role in host["roles"] if role not in pre_roles]
-        pb.append(host_play(host, host_roles, action))
+    pb.extend(hosts_plays([
+        (host, [role for role in limit_roles(args, host["roles"])
+                if role not in pre_roles])
+        for host in args.inventory], action, skip_empty=True))
+
+    if not limit_roles(args, ['repos']):
+        return
 
     # Create config projects
     pb.append(host_play('install-server', 'repos', action))
@@ -246,6 +326,7 @@ def config_update(args, pb, skip_sync=False):
             'repos', {'role_action': 'copy_config_repo'}))
 
     # Update all components
+    hosts_roles = []
     for host in args.inventory:
         host_roles = []
         if not skip_sync:
@@ -256,10 +337,13 @@ def config_update(args, pb, skip_sync=False):
                         "zuul_services", [])).issubset(
                             set(("zuul-merger", "zuul-executor")))):
                 continue
-        for role in roles_order:
+        for role in limit_roles(args, roles_order):
             if role in host["roles"]:
                 host_roles.append(role)
-        pb.append(host_play(host, host_roles, {'role_action': 'update'}))
+        if skip_sync and not host_roles:
+            continue
+        hosts_roles.append((host, host_roles))
+    pb.extend(hosts_plays(hosts_roles, {'role_action': 'update'}))
 
 
 def nodepool_restart(args, pb):
@@ -344,26 +428,29 @@ def notify_operator(args, pb):
 
 def tenant_update(args, pb):
     # Update tenant components managed on the main instance
+    hosts_roles = []
     for host in args.inventory:
         host_roles = []
         for role in ["zuul"]:
             if role in host["roles"]:
                 host_roles.append(role)
-        pb.append(host_play(host, host_roles, {
-            'role_action': 'update',
-            'force_update': True}))
+        hosts_roles.append((host, host_roles))
+    pb.extend(hosts_plays(hosts_roles, {
+        'role_action': 'update',
+        'force_update': True}))
 
 
 def postconf(args, pb):
-    for host in args.inventory:
-        pb.append(host_play(host, host["roles"], {'role_action': 'postconf'}))
+    pb.extend(hosts_plays([(host, limit_roles(args, host["roles"]))
+                           for host in args.inventory],
+                          {'role_action': 'postconf'}, skip_empty=True))
 
 
 def enable_action(args):
     pb = []
 
     if not (args.skip_setup and len(args.glue["inventory"]) == 1) and \
-       not args.skip_populate_hosts:
+       not args.skip_populate_hosts and limit_roles(args, ['ssh']):
         pb.append(host_play('install-server', 'ssh',
                             {'role_action': 'populate_hosts'}))
     playbook_name = "sfconfig"
@@ -427,7 +514,7 @@ def enable_action(args):
             if "install-server" not in host["roles"]:
                 testinfra.append("--connection=ssh")
                 testinfra.append("--hosts=%s" % host["hostname"])
-            for role in host["roles"]:
+            for role in limit_roles(args, host["roles"]):
                 if args.glue.get("tenant-deployment") and role == "gerrit":
                     continue
                 if role in testinfra_tests:
@@ -456,7 +543,67 @@ def enable_action(args):
     return playbook_name, pb
 
 
-def configure_ansible():
+def control_path_dir(args):
+    return "%s/cp" % args.ansible_root
+
+
+def ansible_profile(args):
+    """Validate and return the ansible.cfg settings of the --ansible-profile
+
+    The fast profile uses the fact cache with smart gathering, reuses the
+    ssh connections with ControlPersist and sizes the forks from the
+    inventory. The mitogen profile also uses the mitogen_linear strategy.
+    """
+    settings = []
+    if args.ansible_profile == "default":
+        return settings
+
+    # Smart gathering only collects the facts missing from the cache
+    facts_dir = "%s/facts" % args.ansible_root
+    if not os.access(facts_dir, os.W_OK):
+        sfconfig.utils.fail("%s: the facts cache is not writable" % facts_dir)
+    settings.extend([
+        ("defaults", "gathering", "smart"),
+        ("defaults", "fact_caching", "jsonfile"),
+        ("defaults", "fact_caching_connection", facts_dir)])
+
+    # Reuse the ssh connections between the plays
+    if not shutil.which("ssh"):
+        sfconfig.utils.fail("ssh: command not found")
+    cp_dir = control_path_dir(args)
+    if len(cp_dir) + 1 + CONTROL_PATH_HASH_LEN > UNIX_PATH_MAX:
+        sfconfig.utils.fail("%s: the ssh control path directory is too long "
+                            "for a unix socket" % cp_dir)
+    settings.extend([
+        ("ssh_connection", "ssh_args",
+         "-o ControlMaster=auto -o ControlPersist=%s" % CONTROL_PERSIST),
+        ("ssh_connection", "control_path_dir", cp_dir),
+        ("ssh_connection", "control_path", "%(directory)s/%%C")])
+
+    # One fork per host, within the open files limit
+    forks = max(1, min(len(args.inventory), FORKS_MAX))
+    nofile = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if nofile != resource.RLIM_INFINITY and forks * FDS_PER_FORK > nofile:
+        forks = max(1, nofile // FDS_PER_FORK)
+        print("[+] Limiting ansible forks to %d (open files limit is %d)" % (
+            forks, nofile))
+    settings.append(("defaults", "forks", str(forks)))
+
+    if args.ansible_profile == "mitogen":
+        spec = importlib.util.find_spec("ansible_mitogen")
+        strategy_dir = spec and os.path.join(
+            os.path.dirname(spec.origin), "plugins", "strategy")
+        if not strategy_dir or not os.path.isfile(
+                os.path.join(strategy_dir, "mitogen_linear.py")):
+            sfconfig.utils.fail("ansible_mitogen: the mitogen strategy "
+                                "plugin is not installed")
+        settings.extend([
+            ("defaults", "strategy_plugins", strategy_dir),
+            ("defaults", "strategy", "mitogen_linear")])
+    return settings
+
+
+def configure_ansible(args):
     ansible_cfg = "/var/lib/software-factory/ansible/ansible.cfg"
     ansiblecfg = configparser.ConfigParser()
     ansiblecfg.read("/usr/share/sf-config/ansible/ansible.cfg")
@@ -468,7 +615,27 @@ def configure_ansible():
                        "%s/plugins/actions" % ara_loc)
         ansiblecfg.set("defaults", "library",
                        "%s/plugins/modules" % ara_loc)
-    ansiblecfg.write(open(ansible_cfg, "w"))
+    if sfconfig.profile.enabled():
+        # Record the plays and roles timing with the sfconfig_profile callback
+        callback_plugins = ansiblecfg.get(
+            "defaults", "callback_plugins", fallback="").split(":")
+        callback_plugins.append("%s/ansible/callback_plugins" % args.share)
+        ansiblecfg.set("defaults", "callback_plugins",
+                       ":".join(filter(None, callback_plugins)))
+        ansiblecfg.set("defaults", "callback_whitelist", "%s,%s" % (
+            ansiblecfg.get("defaults", "callback_whitelist"),
+            "sfconfig_profile"))
+        profile_path = sfconfig.profile.ansible_profile_path(args)
+        if not os.path.isdir(os.path.dirname(profile_path)):
+            os.makedirs(os.path.dirname(profile_path), 0o700)
+        os.environ["SFCONFIG_PROFILE_FILE"] = profile_path
+    for section, key, value in args.ansible_settings:
+        if key == "control_path_dir" and not os.path.isdir(value):
+            os.makedirs(value, 0o700)
+        ansiblecfg.set(section, key, value)
+    content = io.StringIO()
+    ansiblecfg.write(content)
+    sfconfig.utils.write_file(ansible_cfg, content.getvalue())
     os.environ["ANSIBLE_CONFIG"] = ansible_cfg
     os.environ["ARA_LOG_FILE"] = ""
     os.environ["ARA_DIR"] = "/var/lib/software-factory/ansible/ara/"
@@ -491,6 +658,17 @@ def run(args):
 
     playbook_path = "%s/%s.yml" % (args.ansible_root, playbook_name)
     write_playbook(playbook_path, playbook)
+    # The outputs can only be up to date when no generated file changed
+    generated = set(sfconfig.manifest.outputs(args))
+    changed = [path for path in sfconfig.utils.changed_files
+               if os.path.relpath(path, args.ansible_root) in generated]
+    if getattr(args, "manifest", None) and not changed and \
+       sfconfig.manifest.up_to_date(
+            args.manifest, 'outputs', sfconfig.manifest.outputs(args)):
+        print("[+] Generated files didn't change, skipping ansible run")
+        # Record the new inputs to skip the generation next time
+        sfconfig.manifest.save(args)
+        args.skip_apply = True
     os.environ["ANSIBLE_CONFIG"] = "%s/ansible/ansible.cfg" % args.share
     run_cmd = ["flock", "/var/lib/software-factory/state/ansible.lock",
                "ansible-playbook", playbook_path]
@@ -498,8 +676,11 @@ def run(args):
     if not args.skip_apply:
         os.chdir("/")
         install_ansible(args)
-        configure_ansible()
-        sfconfig.utils.execute(run_cmd)
+        configure_ansible(args)
+        # The manifest is saved back once the playbook succeeded
+        sfconfig.manifest.invalidate(args)
+        with sfconfig.profile.phase("ansible-playbook %s" % playbook_name):
+            sfconfig.utils.execute(run_cmd)
 
 
 def get_logs(args, pb):
@@ -551,20 +732,68 @@ def backup(args, pb):
         pb.append(play)
 
 
+# The jinja environments, by templates directory
+template_envs = {}
+
+
+def template_cache_dir(templates_dir):
+    cache_dir = os.environ.get(
+        "XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return "%s/sfconfig/jinja-%s" % (cache_dir, hashlib.sha1(
+        templates_dir.encode('utf-8')).hexdigest()[:12])
+
+
+def compiled_templates_dir(templates_dir):
+    """Return the pre-compiled templates directory, if it is up to date"""
+    compiled_dir = "%s.compiled" % templates_dir.rstrip("/")
+    if not os.path.isdir(compiled_dir):
+        return None
+    compiled = os.stat(compiled_dir).st_mtime
+    for path in glob.glob("%s/*" % templates_dir):
+        if os.stat(path).st_mtime > compiled:
+            return None
+    return compiled_dir
+
+
+def template_env(templates_dir):
+    """Return the shared jinja environment of a templates directory
+
+    The templates are loaded from the pre-compiled modules shipped with the
+    package when available, else they are compiled once and their bytecode
+    is cached.
+    """
+    env = template_envs.get(templates_dir)
+    if env is None:
+        loader = FileSystemLoader(templates_dir)
+        compiled_dir = compiled_templates_dir(templates_dir)
+        if compiled_dir:
+            loader = ChoiceLoader([ModuleLoader(compiled_dir), loader])
+        cache_dir = template_cache_dir(templates_dir)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, 0o700)
+            bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        except OSError:
+            bytecode_cache = None
+        env = Environment(trim_blocks=True, loader=loader,
+                          bytecode_cache=bytecode_cache)
+        template_envs[templates_dir] = env
+    return env
+
+
 def render_template(dest, template, data):
-    if os.path.exists(dest):
-        current = open(dest).read()
-    else:
-        current = ""
-    loader = FileSystemLoader(os.path.dirname(template))
-    env = Environment(trim_blocks=True, loader=loader)
+    env = template_env(os.path.dirname(template))
     template = env.get_template(os.path.basename(template))
-    new = template.render(data)
-    if new[-1] != "\n":
-        new += "\n"
-    if new != current:
-        with open(dest, "w") as out:
-            out.write(new)
+    # Stream the template output instead of rendering the whole document
+    new = io.StringIO()
+    chunk = ""
+    for chunk in template.generate(data):
+        new.write(chunk)
+    if not chunk.endswith("\n"):
+        new.write("\n")
+    if not os.path.isdir(os.path.dirname(dest)):
+        os.makedirs(os.path.dirname(dest))
+    if sfconfig.utils.write_file(dest, new.getvalue()):
         print("[+] Wrote %s" % dest)
 
 
@@ -597,9 +826,8 @@ def generate(args):
                         args.glue["roles"].setdefault(role_name, []).append(
                             host)
 
-        ensure_role_services("nodepool", ["launcher", "builder"])
-        ensure_role_services("zuul", ["scheduler", "merger", "executor",
-                                      "web"])
+        for role_name, meta_names in META_ROLES:
+            ensure_role_services(role_name, meta_names)
 
         # if firehose role is in the arch, install publishers where needed
         if "firehose" in args.glue["roles"]:
@@ -646,6 +874,6 @@ def generate(args):
     # including network static_hostname defined in sfconfig.yaml
     host_arch = copy.copy(arch)
     host_arch["network"] = args.sfconfig["network"]
-    render_template("/etc/hosts",
+    render_template(sfconfig.utils.system_path(args, "/etc/hosts"),
                     "%s/etc-hosts.j2" % templates,
                     host_arch)
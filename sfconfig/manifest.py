@@ -0,0 +1,96 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Content-hash manifest of sfconfig inputs and generated outputs, used to
+# skip the ansible run when nothing changed since the last successful run.
+
+import glob
+import hashlib
+import os
+
+from sfconfig.utils import system_path
+from sfconfig.utils import write_file
+from sfconfig.utils import yaml_dump
+from sfconfig.utils import yaml_load
+
+
+def manifest_path(args):
+    return "%s/sfconfig-manifest.yaml" % args.ansible_root
+
+
+def digest(path):
+    """Return the sha256 of a file content, or None if it doesn't exist"""
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                h.update(chunk)
+    except IOError:
+        return None
+    return h.hexdigest()
+
+
+def tree_digest(path, exclude=()):
+    """Return the sha256 of a directory tree (file names and content)"""
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            filepath = os.path.join(root, name)
+            if filepath in exclude:
+                continue
+            h.update(os.path.relpath(filepath, path).encode('utf-8'))
+            h.update((digest(filepath) or "").encode('utf-8'))
+    return h.hexdigest()
+
+
+def inputs(args):
+    """Collect the hashes of everything that can change the deployment"""
+    return {
+        'arch': digest(args.arch),
+        'config': digest(args.config),
+        'extra': digest(args.extra),
+        # The secrets, certificates and ssh keys
+        'lib': tree_digest(args.lib, exclude=(manifest_path(args),)),
+        'release': digest(system_path(args, "/etc/sf-release")),
+        'ansible': tree_digest("%s/ansible" % args.share),
+        'templates': tree_digest("%s/templates" % args.share),
+    }
+
+
+def outputs(args):
+    """Collect the hashes of the generated group_vars, hosts and playbooks"""
+    paths = ["%s/hosts" % args.ansible_root]
+    paths.extend(sorted(glob.glob("%s/group_vars/*.yaml" % args.ansible_root)))
+    paths.extend(sorted(glob.glob("%s/*.yml" % args.ansible_root)))
+    return dict((os.path.relpath(path, args.ansible_root), digest(path))
+                for path in paths)
+
+
+def load(args):
+    return yaml_load(manifest_path(args)) or {}
+
+
+def invalidate(args):
+    """Remove the manifest, e.g. before running a playbook that may fail"""
+    if os.path.isfile(manifest_path(args)):
+        os.unlink(manifest_path(args))
+
+
+def save(args):
+    write_file(manifest_path(args), yaml_dump(
+        {'inputs': inputs(args), 'outputs': outputs(args)}))
+
+
+def up_to_date(manifest, section, current):
+    """Check a manifest section against the current hashes"""
+    return bool(manifest.get(section)) and manifest[section] == current
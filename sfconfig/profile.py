@@ -0,0 +1,130 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Record the wall time of sfconfig phases, components, subprocesses and
+# ansible plays when sfconfig runs with --profile
+
+import contextlib
+import json
+import os
+import sys
+import time
+
+import sfconfig.utils
+
+# The list of records, None when profiling is disabled
+records = None
+started = None
+
+
+def start():
+    global records, started
+    records = []
+    started = time.monotonic()
+
+
+def enabled():
+    return records is not None
+
+
+def record(category, name, duration):
+    if records is not None:
+        records.append({'category': category, 'name': name,
+                        'duration': duration})
+
+
+@contextlib.contextmanager
+def phase(name, category="phase"):
+    """Record the wall time of a block when profiling is enabled"""
+    if records is None:
+        yield
+        return
+    begin = time.monotonic()
+    try:
+        yield
+    finally:
+        record(category, name, time.monotonic() - begin)
+
+
+def ansible_profile_path(args):
+    return "%s/profile/ansible.json" % args.ansible_root
+
+
+def load_ansible_profile(args):
+    """Add the plays and roles timing recorded by the ansible callback"""
+    path = ansible_profile_path(args)
+    if not os.path.isfile(path):
+        return
+    for entry in json.load(open(path)):
+        record(entry['category'], entry['name'], entry['duration'])
+    os.unlink(path)
+
+
+def aggregate():
+    """Sum the records by category and name"""
+    result = {}
+    for entry in records:
+        key = (entry['category'], entry['name'])
+        agg = result.setdefault(key, {'category': entry['category'],
+                                      'name': entry['name'],
+                                      'count': 0,
+                                      'duration': 0.0})
+        agg['count'] += 1
+        agg['duration'] += entry['duration']
+    return sorted(result.values(), key=lambda x: x['duration'], reverse=True)
+
+
+def report(args, top=20):
+    """Write the profile json and history, then print a summary table"""
+    if records is None or not args.profile:
+        return
+    load_ansible_profile(args)
+    profile_dir = "%s/profile" % args.ansible_root
+    if not os.path.isdir(profile_dir):
+        os.makedirs(profile_dir, 0o700)
+
+    now = time.strftime("%Y%m%d-%H%M%S")
+    profile = {
+        'date': now,
+        'version': sfconfig.utils.get_sf_version(args),
+        'argv': sys.argv[1:],
+        'total': time.monotonic() - started,
+        'records': aggregate(),
+    }
+    profile_path = "%s/sfconfig-%s.json" % (profile_dir, now)
+    sfconfig.utils.write_file(profile_path, json.dumps(profile, indent=2))
+
+    # Keep a summary per run to compare sf versions
+    history_path = "%s/history.json" % profile_dir
+    categories = {}
+    for entry in profile['records']:
+        categories[entry['category']] = categories.get(
+            entry['category'], 0) + entry['duration']
+    previous = None
+    if os.path.isfile(history_path):
+        for line in open(history_path):
+            previous = json.loads(line)
+    with open(history_path, "a") as of:
+        of.write(json.dumps({'date': now, 'version': profile['version'],
+                             'total': profile['total'],
+                             'categories': categories}) + "\n")
+
+    print("\nsfconfig profile (%s):" % profile_path)
+    print("%-12s %-50s %6s %10s" % ("category", "name", "count", "seconds"))
+    for entry in profile['records'][:top]:
+        print("%-12s %-50s %6d %10.2f" % (
+            entry['category'], entry['name'][:50], entry['count'],
+            entry['duration']))
+    print("%-12s %-50s %6s %10.2f" % ("total", "", "", profile['total']))
+    if previous:
+        print("Previous run (%s, version %s): %.2f seconds" % (
+            previous['date'], previous['version'], previous['total']))
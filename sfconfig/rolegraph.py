@@ -0,0 +1,148 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Compute the roles affected by a group_vars change
+
+import os
+import re
+import shutil
+
+from sfconfig.inventory import base_role
+from sfconfig.utils import yaml_dump
+from sfconfig.utils import yaml_load
+from sfconfig.utils import yaml_loads
+
+# Role directories that are rendered or evaluated by ansible
+ROLE_DIRS = ("defaults", "handlers", "meta", "tasks", "templates", "vars")
+TOKEN_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+SHARED_TASKS_RE = re.compile(r"sf_tasks_dir\s*}}/([A-Za-z0-9_.-]+)")
+
+
+def applied_vars_path(args):
+    return "%s/applied_vars.yaml" % args.ansible_root
+
+
+def load_applied(args):
+    """Return the group_vars of the last successful run"""
+    return yaml_load(applied_vars_path(args)) or {}
+
+
+def save_applied(args, path):
+    shutil.copyfile(path, applied_vars_path(args))
+
+
+def read_file(path):
+    try:
+        return open(path, errors="replace").read()
+    except IOError:
+        return ""
+
+
+def role_tokens(share, role):
+    """Return the identifiers used by a role tasks and templates"""
+    tokens = set()
+    role_path = "%s/ansible/roles/sf-%s" % (share, role)
+    for role_dir in ROLE_DIRS:
+        for root, dirs, files in os.walk(os.path.join(role_path, role_dir)):
+            for name in files:
+                content = read_file(os.path.join(root, name))
+                tokens.update(TOKEN_RE.findall(content))
+                # Add the shared tasks included with sf_tasks_dir
+                for shared in SHARED_TASKS_RE.findall(content):
+                    tokens.update(TOKEN_RE.findall(read_file(
+                        "%s/ansible/tasks/%s" % (share, shared))))
+    return tokens
+
+
+def role_dependencies(share, role):
+    """Return the role names listed in the role meta dependencies"""
+    meta = yaml_load("%s/ansible/roles/sf-%s/meta/main.yml" % (share, role))
+    deps = []
+    for dep in (meta or {}).get("dependencies") or []:
+        if isinstance(dep, dict):
+            dep = dep.get("role", dep.get("name", ""))
+        if dep.startswith("sf-"):
+            deps.append(dep[3:])
+    return deps
+
+
+def changed_keys(previous, current):
+    return set(key for key in set(previous) | set(current)
+               if previous.get(key) != current.get(key))
+
+
+def inventory_roles(inventory):
+    return dict((host["hostname"], sorted(host["roles"]))
+                for host in inventory)
+
+
+def affected_roles(args, components, previous):
+    """Return the set of roles to run, or None when everything is affected
+
+    A role is affected when one of the group_vars it consumes changed, or
+    when it depends on an affected role (meta dependencies and component
+    require_roles).
+    """
+    if not previous or "inventory" not in previous:
+        print("[+] No previously applied group_vars, running all roles")
+        return None
+    if inventory_roles(previous["inventory"]) != \
+            inventory_roles(args.glue["inventory"]):
+        print("[+] The architecture changed, running all roles")
+        return None
+
+    # Compare the values as they are written in the group_vars
+    current = yaml_loads(yaml_dump(args.glue))
+    keys = changed_keys(previous, current)
+    roles = set(["base", "postfix", "ssh", "repos"])
+    for host in args.inventory:
+        roles.update(host["roles"])
+
+    # For dictionaries such as the sfconfig.yaml sections, only the roles
+    # using one of the changed attributes are affected
+    subkeys = {}
+    for key in keys:
+        if isinstance(previous.get(key), dict) and \
+           isinstance(current.get(key), dict):
+            subkeys[key] = changed_keys(previous[key], current[key])
+
+    affected = set()
+    consumed = set()
+    for role in roles:
+        tokens = role_tokens(args.share, role)
+        for key in keys & tokens:
+            consumed.add(key)
+            if key not in subkeys or subkeys[key] & tokens:
+                affected.add(role)
+    if keys - consumed:
+        # Keys can be looked up dynamically, e.g. with hostvars[host][key]
+        print("[+] Variables %s are not used by a known role, "
+              "running all roles" % ", ".join(sorted(keys - consumed)))
+        return None
+
+    # Add the roles that depend on affected roles
+    dependents = {}
+    for role in roles:
+        for dep in role_dependencies(args.share, role):
+            dependents.setdefault(dep, set()).add(role)
+    for name in roles:
+        if name not in components:
+            continue
+        for dep in components.require_roles(name):
+            dependents.setdefault(dep, set()).add(base_role(name))
+    todo = list(affected)
+    while todo:
+        for role in dependents.get(base_role(todo.pop()), ()):
+            if role in roles and role not in affected:
+                affected.add(role)
+                todo.append(role)
+    return affected
@@ -0,0 +1,63 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+from unittest import mock
+
+import sfconfig.components
+
+MODULE = '''
+from sfconfig.components import Component
+
+
+class %s(Component):
+    def usage(self, parser):
+        parser.add_argument("--%s", %s)
+'''
+
+
+class TestRegistry:
+    """The registry index is cached unless the options can't be"""
+    def setup_share(self, tmpdir):
+        for role, option, kwargs in (
+                ("simple", "simple-option", "action='store_true'"),
+                ("typed", "typed-option", "type=int")):
+            tmpdir.join("ansible/roles/sf-%s/meta/sfconfig.py" % role).write(
+                MODULE % (role.capitalize(), option, kwargs), ensure=True)
+
+    def registry(self, tmpdir):
+        with mock.patch.dict("os.environ",
+                             {"XDG_CACHE_HOME": str(tmpdir.join("cache"))}):
+            registry = sfconfig.components.ComponentRegistry(str(tmpdir))
+            cache = json.load(open(sfconfig.components.registry_cache_path(
+                str(tmpdir))))
+        return registry, cache
+
+    def test_typed_options_not_cached(self, tmpdir):
+        self.setup_share(tmpdir)
+        registry, cache = self.registry(tmpdir)
+        assert sorted(registry.index) == ["simple", "typed"]
+        assert [path.split('/')[-3] for path in cache["modules"]] == [
+            "sf-simple"]
+        assert registry.index["typed"]["options"] == [
+            [["--typed-option"], {"type": int}]]
+        assert registry["typed"].role == "typed"
+
+    def test_cache_reused(self, tmpdir):
+        self.setup_share(tmpdir)
+        self.registry(tmpdir)
+        with mock.patch("sfconfig.components.module_components",
+                        wraps=sfconfig.components.module_components) as load:
+            registry, cache = self.registry(tmpdir)
+        assert [call[0][0].split('/')[-3] for call in load.call_args_list] \
+            == ["sf-typed"]
+        assert registry["simple"].role == "simple"
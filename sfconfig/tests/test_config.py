@@ -0,0 +1,25 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import sfconfig.config
+
+
+class TestMigrate:
+    """The migrations match the former update_sfconfig upgrades"""
+    def test_gateway_directories(self):
+        for value, expected in (('', []), (None, None), (['doc'], ['doc'])):
+            data = {'gateway_directories': value}
+            sfconfig.config.migrate(data)
+            assert data['gateway_directories'] == expected
+        data = {}
+        sfconfig.config.migrate(data)
+        assert data['gateway_directories'] == []
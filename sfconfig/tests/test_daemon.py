@@ -0,0 +1,76 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import os
+from unittest import mock
+
+import sfconfig.configupdate
+import sfconfig.daemon
+
+
+class TestPlaybookEnvironment:
+    """The playbook runners use the generated ansible.cfg"""
+    def record_environ(self, *args, **kwargs):
+        self.environ = dict(os.environ)
+        return 0
+
+    def test_run_playbook(self):
+        with mock.patch.dict(os.environ, clear=True), \
+                mock.patch("sfconfig.utils.execute",
+                           side_effect=self.record_environ) as execute:
+            sfconfig.daemon.ACTIONS["tenant-update"](None, [])
+        assert execute.call_args[0][0][-1] == \
+            "/var/lib/software-factory/ansible/sf_tenant_update.yml"
+        assert self.environ["ANSIBLE_CONFIG"] == \
+            "/var/lib/software-factory/ansible/ansible.cfg"
+
+    def test_run_config_update(self):
+        with mock.patch.dict(os.environ, clear=True), \
+                mock.patch("sfconfig.configupdate.main",
+                           side_effect=self.record_environ):
+            sfconfig.daemon.ACTIONS["config-update"](None, [])
+        assert self.environ["ANSIBLE_CONFIG"] == \
+            "/var/lib/software-factory/ansible/ansible.cfg"
+
+    def test_config_update(self):
+        args = argparse.Namespace(
+            ansible_root="/var/lib/software-factory/ansible",
+            config_repo="/root/config", full=True)
+        with mock.patch.dict(os.environ, clear=True), \
+                mock.patch("sfconfig.configupdate.git", return_value=None), \
+                mock.patch("subprocess.call",
+                           side_effect=self.record_environ) as call:
+            assert sfconfig.configupdate.update(args, "abc") == 0
+        assert call.call_args[0][0][-1] == \
+            "/var/lib/software-factory/ansible/sf_configrepo_update.yml"
+        assert self.environ["ANSIBLE_CONFIG"] == \
+            "/var/lib/software-factory/ansible/ansible.cfg"
+        assert self.environ["ZUUL_COMMIT"] == "abc"
+
+
+class TestServe:
+    def test_socket_mode(self, tmpdir):
+        args = argparse.Namespace(socket=str(tmpdir.join("sfconfig.sock")),
+                                  share="/usr/share/sf-config")
+        modes = []
+
+        def serve_forever(server):
+            modes.append(os.stat(args.socket).st_mode & 0o777)
+
+        with mock.patch("sfconfig.daemon.LOGS_DIR", str(tmpdir)), \
+                mock.patch("sfconfig.daemon.Daemon"), \
+                mock.patch("threading.Thread"), \
+                mock.patch("sfconfig.daemon.Server.serve_forever",
+                           serve_forever):
+            sfconfig.daemon.serve(args)
+        assert modes == [0o600]
@@ -0,0 +1,92 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+from unittest import mock
+
+import sfconfig.cmd
+import sfconfig.inventory
+import sfconfig.utils
+
+SHARE = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+def snapshot(path):
+    """Return the content of every file of a tree"""
+    return dict((str(entry), entry.read_binary())
+                for entry in path.visit() if entry.isfile())
+
+
+class TestGenerateOnly:
+    """The --generate-only run only writes under its root"""
+    def generate(self, tmpdir, arch, *options):
+        home = tmpdir.ensure("home", dir=True)
+        inputs = tmpdir.join("inputs")
+        if not inputs.check():
+            inputs.ensure(dir=True)
+            shutil.copyfile("%s/defaults/sfconfig.yaml" % SHARE,
+                            str(inputs.join("sfconfig.yaml")))
+            shutil.copyfile("%s/refarch/%s.yaml" % (SHARE, arch),
+                            str(inputs.join("arch.yaml")))
+        before = dict((path.basename, path.read_binary())
+                      for path in inputs.listdir())
+        load_components = sfconfig.utils.load_components
+        argv = ["sfconfig", "--generate-only", str(tmpdir.join("root")),
+                "--share", SHARE, "--arch", str(inputs.join("arch.yaml")),
+                "--config", str(inputs.join("sfconfig.yaml")),
+                "--extra", str(tmpdir.join("extra"))] + list(options)
+        with mock.patch.dict(os.environ, {"HOME": str(home)}), \
+                mock.patch("sys.argv", argv), \
+                mock.patch("sfconfig.utils.load_components",
+                           lambda: load_components(SHARE)), \
+                mock.patch.dict(sfconfig.inventory.template_envs, clear=True):
+            os.environ.pop("XDG_CACHE_HOME", None)
+            sfconfig.cmd.main()
+        return home, inputs, before
+
+    def test_inputs_unchanged(self, tmpdir):
+        home, inputs, before = self.generate(tmpdir, "allinone")
+        after = dict((path.basename, path.read_binary())
+                     for path in inputs.listdir())
+        assert after == before
+        # The upgraded copies are kept under the root
+        config = tmpdir.join("root").join(str(inputs.join("sfconfig.yaml")))
+        assert b"schema_version" in config.read_binary()
+        assert tmpdir.join("root/var/lib/software-factory/ansible/"
+                           "sfconfig.yml").check()
+
+    def test_caches_under_root(self, tmpdir):
+        home, _, _ = self.generate(tmpdir, "allinone")
+        assert home.listdir() == []
+        assert tmpdir.join("root/var/cache/sfconfig").listdir()
+
+    def test_dry_run(self, tmpdir):
+        self.generate(tmpdir, "allinone")
+        state = tmpdir.join("root/var/lib/software-factory")
+        before = snapshot(state)
+        # The deployment secrets are generated again
+        state.join("bootstrap-data/secrets.yaml").remove()
+        state.join("bootstrap-data/ssh_keys/zuul_rsa").remove()
+        del before[str(state.join("bootstrap-data/secrets.yaml"))]
+        del before[str(state.join("bootstrap-data/ssh_keys/zuul_rsa"))]
+        # The configuration is upgraded again
+        tmpdir.join("inputs/sfconfig.yaml").write(tmpdir.join(
+            "inputs/sfconfig.yaml").read().replace(
+                "schema_version: 2\n", ""))
+        _, inputs, inputs_before = self.generate(
+            tmpdir, "allinone", "--dry-run")
+        assert dict((path.basename, path.read_binary())
+                    for path in inputs.listdir()) == inputs_before
+        # Nothing is written to the bootstrap-data and ansible directories
+        assert snapshot(state) == before
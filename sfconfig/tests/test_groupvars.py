@@ -0,0 +1,42 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+from unittest import mock
+
+import sfconfig.groupvars
+
+
+class TestWrite:
+    """Only the group_vars files of a split run are removed"""
+    def write(self, tmpdir, split, groups):
+        args = argparse.Namespace(
+            ansible_root=str(tmpdir), split_group_vars=split,
+            glue={'fqdn': 'sftests.com'})
+        with mock.patch("sfconfig.groupvars.split", return_value=groups):
+            sfconfig.groupvars.write(args)
+
+    def test_operator_files_kept(self, tmpdir):
+        tmpdir.join("group_vars/custom.yaml").write("a: b\n", ensure=True)
+        self.write(tmpdir, False, None)
+        self.write(tmpdir, True, {'all': {}, 'zuul': {'a': 1}})
+        self.write(tmpdir, False, None)
+        assert sorted(path.basename for path in tmpdir.join(
+            "group_vars").listdir()) == ["all.yaml", "custom.yaml"]
+        assert not tmpdir.join("sfconfig-vars.yaml").check()
+
+    def test_split_files_removed(self, tmpdir):
+        tmpdir.mkdir("group_vars")
+        self.write(tmpdir, True, {'all': {}, 'zuul': {}, 'nodepool': {}})
+        self.write(tmpdir, True, {'all': {}, 'zuul': {}})
+        assert sorted(path.basename for path in tmpdir.join(
+            "group_vars").listdir()) == ["all.yaml", "zuul.yaml"]
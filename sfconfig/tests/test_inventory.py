@@ -0,0 +1,39 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import sfconfig.inventory
+
+
+def hosts(*names):
+    return [{'hostname': name} for name in names]
+
+
+class TestHostsPlays:
+    """The host plays keep the arch.yaml order"""
+    def test_consecutive_hosts_grouped(self):
+        a, b, c, d = hosts("a", "b", "c", "d")
+        plays = sfconfig.inventory.hosts_plays([
+            (a, ["zuul"]), (b, ["zuul"]), (c, ["nodepool"]), (d, ["zuul"])])
+        assert [play['hosts'] for play in plays] == ["a:b", "c", "d"]
+        assert plays[0]['strategy'] == 'free'
+        assert 'strategy' not in plays[1]
+
+    def test_empty_hosts(self):
+        a, b = hosts("a", "b")
+        plays = sfconfig.inventory.hosts_plays(
+            [(a, []), (b, ["zuul"])], {'role_action': 'update'})
+        assert [play['hosts'] for play in plays] == ["a", "b"]
+        assert 'roles' not in plays[0]
+        assert plays[0]['vars'] == {'role_action': 'update'}
+        plays = sfconfig.inventory.hosts_plays(
+            [(a, []), (b, ["zuul"])], skip_empty=True)
+        assert [play['hosts'] for play in plays] == ["b"]
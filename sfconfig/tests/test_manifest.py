@@ -0,0 +1,41 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+
+import sfconfig.manifest
+
+
+class TestInputs:
+    """The manifest inputs cover the generated secrets"""
+    def args(self, tmpdir):
+        return argparse.Namespace(
+            root=str(tmpdir), share=str(tmpdir.mkdir("share")),
+            lib=str(tmpdir.mkdir("lib")), ansible_root=str(tmpdir.join("lib")),
+            arch=str(tmpdir.join("arch.yaml")),
+            config=str(tmpdir.join("sfconfig.yaml")),
+            extra=str(tmpdir.join("extra.yaml")))
+
+    def test_lib_changes(self, tmpdir):
+        args = self.args(tmpdir)
+        tmpdir.join("lib/secrets.yaml").write("key: value\n")
+        tmpdir.join("lib/ssh_keys/zuul_rsa").write("key", ensure=True)
+        before = sfconfig.manifest.inputs(args)
+        tmpdir.join("lib/ssh_keys/zuul_rsa").write("new key")
+        assert sfconfig.manifest.inputs(args) != before
+
+    def test_manifest_excluded(self, tmpdir):
+        args = self.args(tmpdir)
+        tmpdir.join("lib/secrets.yaml").write("key: value\n")
+        before = sfconfig.manifest.inputs(args)
+        sfconfig.manifest.save(args)
+        assert sfconfig.manifest.inputs(args) == before
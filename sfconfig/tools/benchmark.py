@@ -0,0 +1,203 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Benchmark the sfconfig generation pipeline offline, using the refarch
+# files and synthetic large architectures.
+
+import argparse
+import contextlib
+import copy
+import glob
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+import sfconfig.cmd
+import sfconfig.profile
+import sfconfig.utils
+from sfconfig.utils import yaml_dump
+from sfconfig.utils import yaml_load
+
+
+FAKE_PEM = "-----BEGIN %s-----\nc2ZiZW5jaG1hcms=\n-----END %s-----\n"
+
+
+def fake_file(path, kind="CERTIFICATE"):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as of:
+        of.write(FAKE_PEM % (kind, kind))
+
+
+def fake_execute(argv):
+    """Create the files the openssl, ssh-keygen and zk-ca commands output"""
+    command = os.path.basename(argv[0])
+    if command == "ssh-keygen":
+        priv = argv[argv.index("-f") + 1]
+        fake_file(priv, "RSA PRIVATE KEY")
+        with open("%s.pub" % priv, "w") as of:
+            of.write("ssh-rsa c2ZiZW5jaG1hcms= benchmark\n")
+    elif command == "openssl":
+        for option in ("-out", "-keyout"):
+            if option in argv:
+                fake_file(argv[argv.index(option) + 1])
+    elif command == "zk-ca.sh":
+        root, hostname = argv[1], argv[2]
+        for path in ("demoCA/cacert.pem", "certs/client.pem",
+                     "keys/clientkey.pem", "keystores/%s.pem" % hostname):
+            fake_file(os.path.join(root, path))
+
+
+def synthetic_arch(base, executors, mergers, launchers):
+    """Extend an architecture with many zuul and nodepool hosts"""
+    arch = copy.deepcopy(base)
+    arch["description"] = "Synthetic architecture (%d executors, " \
+        "%d mergers, %d launchers)" % (executors, mergers, launchers)
+    for idx in range(executors + mergers + launchers):
+        if idx < executors:
+            name, role = "ze%03d" % idx, "zuul-executor"
+        elif idx < executors + mergers:
+            name, role = "zm%03d" % (idx - executors), "zuul-merger"
+        else:
+            name, role = "nl%03d" % (idx - executors - mergers), \
+                "nodepool-launcher"
+        arch["inventory"].append({
+            "name": name,
+            "ip": "10.%d.%d.%d" % (idx // 65536, (idx // 256) % 256,
+                                   idx % 256 + 1),
+            "roles": [role]})
+    return arch
+
+
+def run_pipeline(args, name, arch):
+    """Run sfconfig --generate-only in a temporary directory"""
+    workdir = tempfile.mkdtemp(prefix="sfconfig-benchmark-")
+    try:
+        shutil.copy(args.config, "%s/sfconfig.yaml" % workdir)
+        with open("%s/arch.yaml" % workdir, "w") as of:
+            yaml_dump(arch, of)
+        argv = ["sfconfig", "--generate-only", "%s/root" % workdir,
+                "--share", args.share,
+                "--arch", "%s/arch.yaml" % workdir,
+                "--config", "%s/sfconfig.yaml" % workdir,
+                "--extra", "%s/custom-vars.yaml" % workdir]
+        load_components = sfconfig.utils.load_components
+
+        def run():
+            with contextlib.ExitStack() as stack:
+                for target, value in (
+                        ("sys.argv", argv),
+                        ("sfconfig.utils.load_components",
+                         lambda: load_components(args.share)),
+                        ("sfconfig.utils.execute", fake_execute),
+                        ("sfconfig.components.execute", fake_execute)):
+                    stack.enter_context(mock.patch(target, value))
+                if not args.verbose:
+                    stack.enter_context(
+                        contextlib.redirect_stdout(io.StringIO()))
+                sfconfig.cmd.main()
+
+        # Measure the peak memory on the first, cold, run which generates
+        # the keys and certificates and fills the yaml and templates caches.
+        # The timed runs are separate as tracemalloc slows down the run
+        sfconfig.utils.yaml_cache.clear()
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results = []
+        for _ in range(args.iterations):
+            sfconfig.profile.start()
+            begin = time.monotonic()
+            run()
+            results.append({'total': time.monotonic() - begin,
+                            'phases': sfconfig.profile.aggregate()})
+            sfconfig.profile.records = None
+        return {'name': name, 'hosts': len(arch["inventory"]),
+                'peak_memory': peak, 'runs': results}
+    finally:
+        shutil.rmtree(workdir)
+
+
+def print_result(result):
+    totals = sorted(run['total'] for run in result['runs'])
+    peak = result['peak_memory']
+    print("%-30s %5d hosts  min %7.3fs  median %7.3fs  peak %7.1f MiB" % (
+        result['name'][:30], result['hosts'], totals[0],
+        totals[len(totals) // 2], peak / 1024. / 1024.))
+    phases = {}
+    for run in result['runs']:
+        for phase in run['phases']:
+            key = "%s %s" % (phase['category'], phase['name'])
+            phases[key] = min(phases.get(key, phase['duration']),
+                              phase['duration'])
+    for key, duration in sorted(phases.items(), key=lambda x: x[1],
+                                reverse=True)[:5]:
+        print("    %-50s %7.3fs" % (key[:50], duration))
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description="Benchmark the sfconfig generation pipeline offline")
+    p.add_argument("--share", default="/usr/share/sf-config",
+                   help="Templates and ansible roles")
+    p.add_argument("--config", help="The configuration file, default to "
+                   "the share defaults/sfconfig.yaml")
+    p.add_argument("--arch", action="append", default=[],
+                   help="Architecture files, default to the share refarch")
+    p.add_argument("--executors", type=int, default=60)
+    p.add_argument("--mergers", type=int, default=30)
+    p.add_argument("--launchers", type=int, default=10)
+    p.add_argument("--iterations", type=int, default=3)
+    p.add_argument("--output", help="Write the results to a json file")
+    p.add_argument("--verbose", action="store_true")
+    args = p.parse_args()
+
+    if not args.config:
+        args.config = "%s/defaults/sfconfig.yaml" % args.share
+    if not args.arch:
+        args.arch = sorted(glob.glob("%s/refarch/*.yaml" % args.share))
+
+    benchmarks = []
+    for arch_file in args.arch:
+        arch = yaml_load(arch_file)
+        benchmarks.append((os.path.basename(arch_file), arch))
+    if args.executors or args.mergers or args.launchers:
+        base = yaml_load("%s/refarch/minimal.yaml" % args.share)
+        benchmarks.append(("synthetic", synthetic_arch(
+            base, args.executors, args.mergers, args.launchers)))
+
+    results = []
+    for name, arch in benchmarks:
+        try:
+            result = run_pipeline(args, name, arch)
+        except (Exception, SystemExit) as e:
+            # Some refarch are not deployable as-is, e.g. tenant deployments
+            print("%-30s failed: %s" % (name[:30], e), file=sys.stderr)
+            continue
+        print_result(result)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as of:
+            json.dump(results, of, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Pre-compile the sfconfig templates, loaded by inventory.template_env from
+# the templates.compiled directory next to the templates directory.
+
+import argparse
+import os
+
+from jinja2 import FileSystemLoader
+from jinja2.environment import Environment
+
+
+def main():
+    p = argparse.ArgumentParser(description="Pre-compile the templates")
+    p.add_argument("templates", help="The templates directory")
+    p.add_argument("--output", help="default to <templates>.compiled")
+    args = p.parse_args()
+
+    templates = args.templates.rstrip("/")
+    output = args.output or "%s.compiled" % templates
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    env = Environment(trim_blocks=True, loader=FileSystemLoader(templates))
+    env.compile_templates(output, zip=None)
+    # The compiled templates are only used when they are newer than the
+    # sources
+    os.utime(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,6 @@ import argparse
 import urllib.request
 import json
 import os
-import yaml
 
 import sfconfig.utils
 
@@ -391,13 +390,10 @@ def update_grafyaml_action(args):
             args, provider)
     changed = False
     for name, data in data.items():
-        content = yaml.safe_dump({'dashboard': data},
-                                 default_flow_style=False)
+        content = sfconfig.utils.yaml_dump({'dashboard': data})
         graf_file = os.path.join(args.output_dir, name)
-        if os.path.exists(graf_file) and open(graf_file).read() == content:
-            continue
-        changed = True
-        open(graf_file, "w").write(content)
+        if sfconfig.utils.write_file(graf_file, content):
+            changed = True
         print("%s: updated content" % graf_file)
     return 4 if changed else 0
 
@@ -14,137 +14,32 @@ import os
 import sys
 import uuid
 import re
+from sfconfig.config import SCHEMA_VERSION
+from sfconfig.config import migrate
+from sfconfig.config import validate
+from sfconfig.utils import fail
+from sfconfig.utils import get_sf_version
 from sfconfig.utils import pread
+from sfconfig.utils import system_path
+from sfconfig.utils import write_file
 
 
 def update_sfconfig(args):
     """ This method ensure /etc/software-factory content is upgraded """
-    dirty = False
     data = args.sfconfig
+    current = data.get("schema_version") == SCHEMA_VERSION
+    dirty = False
+    if not current:
+        dirty = migrate(data)
 
-    # 2.6.0: expose elasticsearch config
-    # 3.3.0: update elasticsearch config
-    if 'elasticsearch' not in data:
-        data['elasticsearch'] = {}
-        dirty = True
-    if 'replicas' not in data['elasticsearch']:
-        data['elasticsearch']['replicas'] = 0
-        dirty = True
-    # Get heap_size value to apply to new parameters, then delete unused key
-    elastic_heap_size = '512m'
-    if 'heap_size' in data['elasticsearch']:
-        elastic_heap_size = data['elasticsearch']['heap_size']
-        del data['elasticsearch']['heap_size']
-        dirty = True
-    if 'maximum_heap_size' not in data['elasticsearch']:
-        data['elasticsearch']['maximum_heap_size'] = elastic_heap_size
-        dirty = True
-    if 'minimum_heap_size' not in data['elasticsearch']:
-        data['elasticsearch']['minimum_heap_size'] = elastic_heap_size
-        dirty = True
-
-    # 2.6.0: expose logstash config
-    # 3.3.0: update logstash config
-    if 'logstash' not in data:
-        data['logstash'] = {}
-        dirty = True
-    if 'retention_days' not in data['logstash']:
-        data['logstash']['retention_days'] = 60
-        dirty = True
-    if 'maximum_heap_size' not in data['logstash']:
-        data['logstash']['maximum_heap_size'] = '128m'
-        dirty = True
-    if 'minimum_heap_size' not in data['logstash']:
-        data['logstash']['minimum_heap_size'] = '128m'
-        dirty = True
-
-    if 'disable_external_resources' not in data['network']:
-        data['network']['disable_external_resources'] = False
-        dirty = True
     if args.disable_external_resources and \
        not data['network']['disable_external_resources']:
         data['network']['disable_external_resources'] = True
         dirty = True
 
-    # 3.3.0: update gateway_directories default value
-    if data.get('gateway_directories', '') == '':
-        data['gateway_directories'] = []
-        dirty = True
-
-    # 2.7.0: remove useless backup config section
-    if 'backup' in data:
-        del data['backup']
-        dirty = True
-
-    # 3.0: rename (zuul|nodepool)3 without suffix
-    for key in ('zuul', 'nodepool'):
-        if '%s3' % key in data:
-            data[key] = data['%s3' % key]
-            del data['%s3' % key]
-            dirty = True
-
-    # 2.7: refactor logs settings
-    for key in ("disabled", "container", "logserver_prefix", "authurl",
-                "x_storage_url", "username", "password", "tenantname",
-                "authversion", "x_tempurl_key", "send_tempurl_key"):
-        if "swift_logsexport_%s" % key in data['logs']:
-            key = "swift_logsexport_%s" % key
-        if key in data['logs']:
-            del data['logs'][key]
-            dirty = True
-
-    if "expiry" not in data["logs"]:
-        data["logs"]["expiry"] = 60
-        dirty = True
-
-    if "upstream_zuul_jobs" not in data.get("zuul", {}):
-        data.setdefault("zuul", {})
-        data["zuul"]["upstream_zuul_jobs"] = False
-        dirty = True
-
-    if "default_nodeset_name" not in data["zuul"]:
-        data["zuul"]["default_nodeset_name"] = "container"
-        data["zuul"]["default_nodeset_label"] = "centos-oci"
-        dirty = True
-
-    for github_connection in data['zuul'].get('github_connections', []):
-        if "app_key" not in github_connection:
-            github_connection["app_key"] = None
-            dirty = True
-
-    if "periodic_pipeline_mail_rcpt" not in data['zuul']:
-        data['zuul']['periodic_pipeline_mail_rcpt'] = "root@localhost"
-        dirty = True
-
-    if "prerelease_regexp" not in data['zuul']:
-        data['zuul']['prerelease_regexp'] = r'([0-9]+)\.([0-9]+)\.([0-9]+)' \
-             r'(?:-([0-9alpha|beta|rc.-]+))?(?:\+([0-9a-zA-Z.-]+))?'
-        dirty = True
-
-    if "release_regexp" not in data['zuul']:
-        data['zuul']['release_regexp'] = r'([0-9]+)\.([0-9]+)\.([0-9]+)' \
-            r'(?:-([0-9a-zA-Z.-]+))?(?:\+([0-9a-zA-Z.-]+))?'
-        dirty = True
-
-    if "active_directory" not in data["authentication"]:
-        data["authentication"]["active_directory"] = {
-            "disabled": True,
-            "ldap_url": "ldap://sftests.com",
-            "ldap_account_domain": "domain.sftests.com",
-            "ldap_account_base": "ou=Users,dc=domain,dc=sftests,dc=com",
-            "ldap_account_username_attribute": "sAMAccountName",
-            "ldap_account_mail_attribute": "mail",
-            "ldap_account_surname_attribute": "name",
-        }
-        dirty = True
-
-    if "default_retry_attempts" not in data['zuul']:
-        data['zuul']['default_retry_attempts'] = 3
-        dirty = True
-
     # Check for duplicate gerrit connection bug
     to_delete = None
-    for connection in data["zuul"].get("gerrit_connections", []):
+    for connection in data["zuul"].get("gerrit_connections") or []:
         if connection["name"] == "gerrit":
             print("Warning: Gerrit connection named 'gerrit' is reserved for "
                   "the internal gerrit")
@@ -153,83 +48,10 @@ def update_sfconfig(args):
         data["zuul"]["gerrit_connections"].remove(to_delete)
         dirty = True
 
-    if 'allowed_proxy_prefixes' in data['authentication']:
-        del data['authentication']['allowed_proxy_prefixes']
-        dirty = True
-
-    if "git_connections" not in data["zuul"]:
-        data["zuul"]["git_connections"] = []
-        dirty = True
-
-    # 3.3: add SAML2 groups values
-    if 'SAML2' in data['authentication']:
-        if 'groups' not in data['authentication']['SAML2']['mapping']:
-            data['authentication']['SAML2']['mapping']['groups'] = None
-            dirty = True
-
-    # 3.1: add SAML2 default auth values
-    else:
-        data['authentication']['SAML2'] = {
-            'disabled': True,
-            'login_button_text': 'Replace me with a SAML login prompt',
-            'key_delimiter': ';',
-            'mapping': {
-                'login': 'urn:oid:2.5.4.42',
-                'email': 'urn:oid:1.2.840.113549.1.9.1',
-                'name': 'urn:oid:2.5.4.42',
-                'uid': 'uid',
-                'ssh_keys': None,
-                'groups': None,
-            },
-        }
-        dirty = True
-
-    if "config-locations" not in data:
-        data["config-locations"] = {
-            'config-repo': '', 'jobs-repo': '',
-            'strategy': {'sync': 'push', 'user': 'git'}}
-        dirty = True
-
-    if "tenant-deployment" not in data:
-        data["tenant-deployment"] = {}
-        dirty = True
-
-    if "clouds_file" not in data["nodepool"]:
-        data["nodepool"]["clouds_file"] = None
-        dirty = True
-
-    if "kube_file" not in data["nodepool"]:
-        data["nodepool"]["kube_file"] = None
-        dirty = True
-
-    if "default-tenant-name" not in data:
-        data["default-tenant-name"] = "local"
-        dirty = True
-
-    if "tls_cert_file" not in data["network"]:
-        data["network"]["tls_cert_file"] = ""
-        data["network"]["tls_chain_file"] = ""
-        data["network"]["tls_key_file"] = ""
-        dirty = True
-
-    if "ara_report" not in data["zuul"]:
-        data["zuul"]["ara_report"] = True
-        dirty = True
-
-    if "gerrit" not in data:
-        data["gerrit"] = {
-            "all_projects_config": [{
-                'name': 'plugin.reviewers-by-blame.maxReviewers',
-                'value': '5'
-            }, {
-                'name': 'plugin.reviewers-by-blame.ignoreDrafts',
-                'value': 'true'
-            }, {
-                'name': 'plugin.reviewers-by-blame.ignoreSubjectRegEx',
-                'value': "'(WIP|DNM)(.*)'"
-            }]
-        }
-        dirty = True
+    errors = validate(data)
+    if errors:
+        fail("%s: invalid configuration:\n  %s" % (
+            args.config, "\n  ".join(errors)))
 
     args.save_sfconfig = dirty
 
@@ -240,14 +62,23 @@ def update_sfconfig(args):
         # Admin_password is changed in place to avoid automatic sfconfig.yaml
         # upgrade on first deployment (which break formating)
         raw_config = open(args.config).read()
-        open(args.config, 'w').write(re.sub(
+        write_file(args.config, re.sub(
             "admin_password:.*", "admin_password: %s" % new_pass, raw_config))
 
+    if not current and not dirty:
+        # Only record the schema version to keep the file formatting
+        raw_config = open(args.config).read()
+        raw_config = re.sub("(?m)^schema_version:.*\n", "", raw_config)
+        write_file(args.config, "%s%sschema_version: %d\n" % (
+            raw_config, "" if raw_config.endswith("\n") else "\n",
+            SCHEMA_VERSION))
+
 
-def runc_provider_exists():
+def runc_provider_exists(args):
     runc = ''
-    if os.path.isdir("/root/config/nodepool"):
-        runc = pread(["grep", "-r", "driver: runc", "/root/config/nodepool"])
+    nodepool_config = system_path(args, "/root/config/nodepool")
+    if os.path.isdir(nodepool_config):
+        runc = pread(["grep", "-r", "driver: runc", nodepool_config])
         if runc:
             print("Existing runc provider:\n" + runc)
     return runc != ''
@@ -257,15 +88,12 @@ def update_arch(args):
     dirty = False
     data = args.sfarch
 
-    try:
-        sf_version = open("/etc/sf-release").read().strip()
-    except IOError:
-        sf_version = "master"
+    sf_version = get_sf_version(args)
 
     for host in data['inventory']:
         if "hypervisor-oci" in host["roles"] or \
            "hypervisor-runc" in host["roles"] or \
-           runc_provider_exists():
+           runc_provider_exists(args):
             print("Runc providers needs to be removed manually "
                   "before performing the upgrade.")
             exit(1)
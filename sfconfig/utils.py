@@ -10,32 +10,30 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import copy
 import os
 import glob
+import shutil
 import subprocess
 import sys
 import yaml
 
+import sfconfig.profile
+
+# Use the libyaml bindings when available
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# The parsed yaml files, by path, with their mtime, size and inode
+yaml_cache = {}
+# The files written by write_file during this run
+changed_files = []
+
 
 def load_components(share="/usr/share/sf-config"):
-    import inspect
-    import imp
     import sfconfig.components
 
-    components = {}
-
-    for modpath in glob.glob("%s/ansible/roles/*/meta/sfconfig.py" % share):
-        role_name = modpath.split('/')[-3][3:]
-        module = imp.load_source("sfconfig.components.%s" % role_name,
-                                 modpath)
-        for clsmember in inspect.getmembers(module, inspect.isclass):
-            if issubclass(clsmember[1], sfconfig.components.Component) and \
-               clsmember[0] != "Component":
-                component = clsmember[1]()
-                if not getattr(component, "role", None):
-                    component.role = role_name
-                components[component.role] = component
-    return components
+    return sfconfig.components.ComponentRegistry(share)
 
 
 def list_testinfra(share="/usr/share/sf-config"):
@@ -46,6 +44,31 @@ def list_testinfra(share="/usr/share/sf-config"):
     return testinfra
 
 
+def system_path(args, path):
+    """Return a system path, relocated under the --generate-only root"""
+    if not getattr(args, "root", None):
+        return path
+    return os.path.join(args.root, path.lstrip("/"))
+
+
+def get_os_id(args):
+    """Return the os-release ID, e.g. rhel or centos"""
+    try:
+        for line in open(system_path(args, "/etc/os-release")):
+            if line.lower().startswith("id="):
+                return line.split('=', 1)[1].strip().strip('"').lower()
+    except IOError:
+        pass
+    return ""
+
+
+def get_sf_version(args):
+    try:
+        return open(system_path(args, "/etc/sf-release")).read().strip()
+    except IOError:
+        return "master"
+
+
 def get_default(d, key, default):
     val = d.get(key, default)
     if not val:
@@ -54,13 +77,15 @@ def get_default(d, key, default):
 
 
 def execute(argv):
-    if subprocess.Popen(argv).wait():
-        raise RuntimeError("Command failed: %s" % argv)
+    with sfconfig.profile.phase(os.path.basename(argv[0]), "subprocess"):
+        if subprocess.Popen(argv).wait():
+            raise RuntimeError("Command failed: %s" % argv)
 
 
 def pread(argv):
-    return subprocess.Popen(
-        argv, stdout=subprocess.PIPE).stdout.read().decode('utf-8')
+    with sfconfig.profile.phase(os.path.basename(argv[0]), "subprocess"):
+        return subprocess.Popen(
+            argv, stdout=subprocess.PIPE).stdout.read().decode('utf-8')
 
 
 def fail(msg):
@@ -81,7 +106,7 @@ def yaml_merge_load(inp):
 
     user = {}
     for path in paths:
-        data = yaml.safe_load(open(path))
+        data = yaml_load(path)
         if not data:
             continue
         for key, value in data.items():
@@ -92,20 +117,76 @@ def yaml_merge_load(inp):
 
 
 def yaml_load(filename):
+    """Load a yaml file, the documents are cached until the file changes"""
     try:
-        return yaml.safe_load(open(filename))
-    except IOError:
+        st = os.stat(filename)
+        key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        cached = yaml_cache.get(filename)
+        if not cached or cached[0] != key:
+            with open(filename) as f:
+                cached = (key, yaml.load(f, Loader=SafeLoader))
+            yaml_cache[filename] = cached
+    except (IOError, OSError):
         return {}
-    except yaml.parser.ParserError as e:
+    except yaml.YAMLError as e:
         fail("%s: couldn't load (%s)" % (filename, e))
+    # Callers may modify the document
+    return copy.deepcopy(cached[1])
+
+
+def yaml_loads(content):
+    return yaml.load(content, Loader=SafeLoader)
 
 
-def yaml_dump(content, fileobj):
-    yaml.safe_dump(content, fileobj, default_flow_style=False)
+def yaml_dump(content, fileobj=None):
+    """Dump to the fileobj, or return the document when fileobj is None"""
+    return yaml.dump(content, fileobj, Dumper=SafeDumper,
+                     default_flow_style=False)
+
+
+def write_file(path, content, mode=None):
+    """Atomically replace a file when its content changed
+
+    The content is written to a temporary file which is synced and renamed,
+    so that a crash never leaves a truncated file. The existing file mode
+    is kept, unless a mode is given. Return True when the file was written.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    try:
+        with open(path, "rb") as f:
+            unchanged = f.read() == content
+        current_mode = os.stat(path).st_mode & 0o7777
+    except (IOError, OSError):
+        unchanged, current_mode = False, None
+    if mode is None:
+        mode = current_mode
+    if unchanged:
+        if mode is not None and mode != current_mode:
+            os.chmod(path, mode)
+        return False
+
+    tmp_path = "%s.tmp" % path
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                 mode if mode is not None else 0o666)
+    try:
+        with os.fdopen(fd, "wb") as of:
+            of.write(content)
+            of.flush()
+            os.fsync(of.fileno())
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    changed_files.append(path)
+    return True
 
 
 def save_file(content, filename):
-    os.rename(filename, "%s.orig" % filename)
-    yaml_dump(content, open(filename, "w"))
+    shutil.copy2(filename, "%s.orig" % filename)
+    write_file(filename, yaml_dump(content))
     print("Updated %s (old version saved to %s)" % (filename,
                                                     "%s.orig" % filename))
@@ -11,7 +11,6 @@
 # under the License.
 
 import utils
-import yaml
 
 
 class TestHypervisorOpenShift(utils.Base):
@@ -21,8 +20,7 @@ class TestHypervisorOpenShift(utils.Base):
                                  "--insecure-skip-tls-verify=true")
 
     def test_workers_are_isolated(self, host):
-        group_vars = yaml.safe_load(open(
-            "/var/lib/software-factory/ansible/group_vars/all.yaml"))
+        group_vars = utils.load_group_vars()
         if group_vars.get("enable_insecure_workers") is not True:
             # Make sure managesf internal url access fails
             assert host.run("curl --connect-timeout 3 %s" % group_vars[
@@ -10,12 +10,22 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import os
 import yaml
 
+from sfconfig.utils import SafeLoader
+
 GROUP_VAR_PATH = "/var/lib/software-factory/ansible/group_vars/all.yaml"
+# All the variables when sfconfig runs with --split-group-vars
+SPLIT_VARS_PATH = "/var/lib/software-factory/ansible/sfconfig-vars.yaml"
+
+
+def load_group_vars():
+    if os.path.isfile(SPLIT_VARS_PATH):
+        return yaml.load(open(SPLIT_VARS_PATH), Loader=SafeLoader)
+    return yaml.load(open(GROUP_VAR_PATH), Loader=SafeLoader)
 
 
 class Base:
     def enabled_roles(self):
-        group_vars = yaml.load(open(GROUP_VAR_PATH))
-        return group_vars["roles"]
+        return load_group_vars()["roles"]